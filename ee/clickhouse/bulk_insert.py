@@ -0,0 +1,197 @@
+import atexit
+import datetime
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import statsd
+from celery.signals import worker_process_shutdown
+from django.utils import timezone
+from sentry_sdk import capture_exception
+
+from ee.clickhouse.client import sync_insert
+from ee.clickhouse.sql.events import EVENTS_TABLE
+from ee.clickhouse.sql.session_recording_events import SESSION_RECORDING_EVENTS_TABLE
+from ee.kafka_client.topics import KAFKA_EVENTS, KAFKA_SESSION_RECORDING_EVENTS
+from posthog.settings import (
+    CLICKHOUSE_BULK_INSERT_MAX_QUEUE_ROWS,
+    CLICKHOUSE_BULK_INSERT_MAX_ROWS,
+    CLICKHOUSE_BULK_INSERT_MAX_WAIT_MS,
+    STATSD_HOST,
+    STATSD_PREFIX,
+)
+
+logger = logging.getLogger(__name__)
+
+INSERT_ATTEMPTS = 3
+
+_thread_start_lock = threading.Lock()
+
+
+class BulkInserter:
+    """
+    Buffers rows for a ClickHouse table in-process and writes them from a background thread with one native columnar
+    INSERT whenever `max_rows` rows are buffered, or every `max_wait_ms`. ClickHouse creates a part per INSERT, so this
+    is a lot cheaper than inserting rows one by one.
+
+    `insert` blocks while `max_queue_rows` rows are buffered. Failed inserts are retried a few times before the rows
+    are dropped, which is logged and counted in statsd. Whatever is buffered is written when the process exits.
+    """
+
+    def __init__(self, table: str, columns: List[str], max_rows: int, max_wait_ms: int, max_queue_rows: int):
+        self.table = table
+        self.columns = columns
+        self.max_rows = max_rows
+        self.max_wait_seconds = max_wait_ms / 1000
+        self.max_queue_rows = max_queue_rows
+        self.rows: List[Sequence[Any]] = []
+        self.condition = threading.Condition()
+        self.flush_lock = threading.Lock()
+        self.thread_pid: Optional[int] = None
+
+        atexit.register(self.flush)
+        # Celery's prefork children exit without running atexit handlers
+        worker_process_shutdown.connect(self._on_worker_shutdown, weak=False)
+
+    def insert(self, row: Sequence[Any]) -> None:
+        self._start_thread()
+        with self.condition:
+            self.condition.wait_for(lambda: len(self.rows) < self.max_queue_rows)
+            self.rows.append(row)
+            if len(self.rows) >= self.max_rows:
+                self.condition.notify_all()
+
+    def flush(self) -> None:
+        with self.flush_lock:
+            with self.condition:
+                rows, self.rows = self.rows, []
+                self.condition.notify_all()
+            if not rows:
+                return
+            columns = [list(column) for column in zip(*rows)]
+            for attempt in range(1, INSERT_ATTEMPTS + 1):
+                try:
+                    sync_insert(self.table, self.columns, columns)
+                    return
+                except Exception:
+                    if attempt == INSERT_ATTEMPTS:
+                        self._report_dropped_rows(len(rows))
+                        raise
+                    time.sleep(attempt * self.max_wait_seconds)
+
+    def _start_thread(self) -> None:
+        # Tracked per pid, as gunicorn and celery workers are forked after import
+        if self.thread_pid == os.getpid():
+            return
+        with _thread_start_lock:
+            if self.thread_pid == os.getpid():
+                return
+            # Locks and rows are inherited from the parent process, which is responsible for inserting those rows
+            self.rows = []
+            self.condition = threading.Condition()
+            self.flush_lock = threading.Lock()
+            threading.Thread(target=self._run, name="clickhouse-bulk-insert-{}".format(self.table), daemon=True).start()
+            # Set last, as other threads stop taking the lock once it matches. They must see the new rows and condition.
+            self.thread_pid = os.getpid()
+
+    def _report_dropped_rows(self, count: int) -> None:
+        logger.error("Dropped %s rows for %s after %s failed inserts", count, self.table, INSERT_ATTEMPTS)
+        if STATSD_HOST is not None:
+            statsd.Counter("%s_posthog_clickhouse_bulk_insert" % (STATSD_PREFIX,)).increment(
+                "{}.dropped_rows".format(self.table), count
+            )
+
+    def _run(self) -> None:
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: len(self.rows) >= self.max_rows, timeout=self.max_wait_seconds)
+            try:
+                self.flush()
+            except Exception as e:
+                capture_exception(e)
+
+    def _on_worker_shutdown(self, **kwargs) -> None:
+        self.flush()
+
+
+EVENT_COLUMNS = [
+    "uuid",
+    "event",
+    "properties",
+    "timestamp",
+    "team_id",
+    "distinct_id",
+    "elements_chain",
+    "created_at",
+    "_timestamp",
+    "_offset",
+]
+
+
+def event_row(pb_event: Any) -> List[Any]:
+    return [
+        pb_event.uuid,
+        pb_event.event,
+        pb_event.properties,
+        datetime.datetime.fromisoformat(pb_event.timestamp),
+        pb_event.team_id,
+        pb_event.distinct_id,
+        pb_event.elements_chain,
+        datetime.datetime.fromisoformat(pb_event.created_at),
+        timezone.now(),
+        0,
+    ]
+
+
+SESSION_RECORDING_EVENT_COLUMNS = [
+    "uuid",
+    "timestamp",
+    "team_id",
+    "distinct_id",
+    "session_id",
+    "snapshot_data",
+    "created_at",
+    "_timestamp",
+    "_offset",
+]
+
+
+def session_recording_event_row(data: Dict[str, Any]) -> List[Any]:
+    return [
+        data["uuid"],
+        datetime.datetime.fromisoformat(data["timestamp"]),
+        data["team_id"],
+        data["distinct_id"],
+        data["session_id"],
+        data["snapshot_data"],
+        datetime.datetime.fromisoformat(data["created_at"]),
+        timezone.now(),
+        0,
+    ]
+
+
+# Messages that'd be produced to these topics are inserted in bulk instead when Kafka is disabled
+BULK_INSERTERS: Dict[str, Tuple[BulkInserter, Callable[[Any], List[Any]]]] = {
+    KAFKA_EVENTS: (
+        BulkInserter(
+            EVENTS_TABLE,
+            EVENT_COLUMNS,
+            max_rows=CLICKHOUSE_BULK_INSERT_MAX_ROWS,
+            max_wait_ms=CLICKHOUSE_BULK_INSERT_MAX_WAIT_MS,
+            max_queue_rows=CLICKHOUSE_BULK_INSERT_MAX_QUEUE_ROWS,
+        ),
+        event_row,
+    ),
+    KAFKA_SESSION_RECORDING_EVENTS: (
+        BulkInserter(
+            SESSION_RECORDING_EVENTS_TABLE,
+            SESSION_RECORDING_EVENT_COLUMNS,
+            max_rows=CLICKHOUSE_BULK_INSERT_MAX_ROWS,
+            max_wait_ms=CLICKHOUSE_BULK_INSERT_MAX_WAIT_MS,
+            max_queue_rows=CLICKHOUSE_BULK_INSERT_MAX_QUEUE_ROWS,
+        ),
+        session_recording_event_row,
+    ),
+}
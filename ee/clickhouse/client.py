@@ -1,6 +1,5 @@
 import asyncio
 import hashlib
-import json
 from time import time
 from typing import Any, List, Tuple
 
@@ -11,7 +10,7 @@ from clickhouse_driver import Client as SyncClient
 from clickhouse_pool import ChPool
 from django.conf import settings
 
-from posthog import redis
+from posthog import json_codec, redis
 from posthog.settings import (
     CLICKHOUSE,
     CLICKHOUSE_ASYNC,
@@ -35,12 +34,15 @@ if PRIMARY_DB != CLICKHOUSE:
     def async_execute(query, args=None):
         return
 
-    def sync_execute(query, args=None):
+    def sync_execute(query, args=None, query_settings=None):
         return
 
     def cache_sync_execute(query, args=None, redis_client=None, ttl=None):
         return
 
+    def sync_insert(table: str, columns: List[str], data: List[List[Any]]) -> None:
+        return
+
 
 else:
     if not TEST and CLICKHOUSE_ASYNC:
@@ -96,11 +98,11 @@ else:
             redis_client.set(key, _serialize(result), ex=ttl)
             return result
 
-    def sync_execute(query, args=None):
+    def sync_execute(query, args=None, query_settings=None):
         start_time = time()
         try:
             with ch_sync_pool.get_client() as client:
-                result = client.execute(query, args)
+                result = client.execute(query, args, settings=query_settings)
         finally:
             execution_time = time() - start_time
             if settings.SHELL_PLUS_PRINT_SQL:
@@ -108,20 +110,25 @@ else:
                 print("Execution time: %.6fs" % (execution_time,))
         return result
 
+    def sync_insert(table: str, columns: List[str], data: List[List[Any]]) -> None:
+        """Inserts column-oriented `data` (one list of values per column) with a single native INSERT"""
+        with ch_sync_pool.get_client() as client:
+            client.execute("INSERT INTO {} ({}) VALUES".format(table, ", ".join(columns)), data, columnar=True)
+
 
 def _deserialize(result_bytes: bytes) -> List[Tuple]:
     results = []
-    for x in json.loads(result_bytes):
+    for x in json_codec.loads(result_bytes):
         results.append(tuple(x))
     return results
 
 
 def _serialize(result: Any) -> bytes:
-    return json.dumps(result).encode("utf-8")
+    return json_codec.dumps_bytes(result)
 
 
 def _key_hash(query: str, args: Any) -> bytes:
-    key = hashlib.md5(query.encode("utf-8") + json.dumps(args).encode("utf-8")).digest()
+    key = hashlib.md5(query.encode("utf-8") + json_codec.dumps_bytes(args)).digest()
     return key
 
 
@@ -0,0 +1,7 @@
+from infi.clickhouse_orm import migrations
+
+from ee.clickhouse.sql.session_recording_events import SESSION_RECORDING_EVENTS_TTL_ONLY_DROP_PARTS_SQL
+
+operations = [
+    migrations.RunSQL(SESSION_RECORDING_EVENTS_TTL_ONLY_DROP_PARTS_SQL),
+]
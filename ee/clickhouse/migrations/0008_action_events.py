@@ -0,0 +1,8 @@
+from infi.clickhouse_orm import migrations
+
+from ee.clickhouse.sql.actions import ACTION_EVENTS_TABLE_SQL, EVENTS_INGESTED_AT_INDEX_SQL
+
+operations = [
+    migrations.RunSQL(ACTION_EVENTS_TABLE_SQL),
+    migrations.RunSQL(EVENTS_INGESTED_AT_INDEX_SQL),
+]
@@ -0,0 +1,8 @@
+from infi.clickhouse_orm import migrations
+
+from ee.clickhouse.sql.events import EVENTS_ELEMENTS_COLUMNS_SQL, EVENTS_ELEMENTS_INDEXES_SQL
+
+operations = [
+    migrations.RunSQL(EVENTS_ELEMENTS_COLUMNS_SQL),
+    migrations.RunSQL(EVENTS_ELEMENTS_INDEXES_SQL),
+]
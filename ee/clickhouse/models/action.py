@@ -1,15 +1,56 @@
-import re
-from typing import Dict, List, Tuple
+import datetime
+from typing import Dict, List, Optional, Tuple
 
+import pytz
 from django.forms.models import model_to_dict
-
+from django.utils import timezone
+
+from ee.clickhouse.client import sync_execute
+from ee.clickhouse.models.element import _escape
+from ee.clickhouse.sql.actions import (
+    ACTION_EVENTS_UUIDS_SQL,
+    DELETE_ACTION_EVENTS_SQL,
+    INSERT_ACTION_EVENTS_SQL,
+    LAST_INGESTED_AT_SQL,
+    NEWLY_INGESTED_EVENTS_FILTER,
+)
 from posthog.constants import AUTOCAPTURE_EVENT
 from posthog.models import Action, Filter
 from posthog.models.action_step import ActionStep
 from posthog.models.event import Selector
 
+# Calculations go up to the latest ingestion time (_timestamp, the Kafka message time) ClickHouse has stored. Events
+# from Kafka partitions that are consumed more slowly than others can show up later with an earlier ingestion time,
+# up to this much earlier, so they are matched again by the next calculation.
+LATE_EVENTS_WINDOW = datetime.timedelta(minutes=5)
+
+
+def format_action_filter(
+    action: Action, prepend: str = "", index=0, use_loop: bool = False, date_filter: str = ""
+) -> Tuple[str, Dict]:
+    """
+    Returns a condition on events for matching the action. `date_filter` is the timestamp condition of the query using
+    it (as returned by parse_timestamps, without a table), which keeps it from reading stored matches of other dates.
+    """
+    if action.events_calculated_until is None:
+        return _format_action_steps_filter(action, prepend, use_loop)
+
+    action_filter, params = _format_action_steps_filter(action, prepend)
+    params = {
+        **params,
+        "team_id": action.team_id,
+        "{}action_id".format(prepend): action.pk,
+        "{}ingested_after".format(prepend): action.events_calculated_until - LATE_EVENTS_WINDOW,
+    }
+    formatted_query = ACTION_EVENTS_UUIDS_SQL.format(
+        prepend=prepend, action_filter=action_filter, date_filter=date_filter
+    )
+    if use_loop:
+        return formatted_query, params
+    return "uuid IN ({})".format(formatted_query), params
+
 
-def format_action_filter(action: Action, prepend: str = "", index=0, use_loop: bool = False) -> Tuple[str, Dict]:
+def _format_action_steps_filter(action: Action, prepend: str = "", use_loop: bool = False) -> Tuple[str, Dict]:
     # get action steps
     params = {"team_id": action.team.pk}
     steps = action.steps.all()
@@ -51,6 +92,58 @@ def format_action_filter(action: Action, prepend: str = "", index=0, use_loop: b
     return formatted_query, params
 
 
+def update_action_events(action: Action, calculated_until: Optional[datetime.datetime] = None) -> None:
+    """
+    Stores the matches of events ingested up to `calculated_until`, by default the latest ingestion time ClickHouse
+    has stored, in the action_events table. Only events ingested since the last calculation are matched, unless the
+    steps have changed since, in which case all of them are.
+    """
+    if calculated_until is None:
+        calculated_until = _get_last_ingested_at(action)
+        if action.events_calculated_until is not None and calculated_until <= action.events_calculated_until:
+            # Nothing was ingested since
+            return
+    updated_at = Action.objects.values_list("updated_at", flat=True).get(pk=action.pk)
+    action_filter, params = _format_action_steps_filter(action)
+    params = {**params, "team_id": action.team_id, "action_id": action.pk, "calculated_until": calculated_until}
+
+    if action.events_calculated_until is None:
+        Action.objects.filter(pk=action.pk).update(is_calculating=True, last_calculated_at=timezone.now())
+        try:
+            sync_execute(DELETE_ACTION_EVENTS_SQL, params, query_settings={"mutations_sync": 1})
+            sync_execute(INSERT_ACTION_EVENTS_SQL.format(ingested_after_filter="", action_filter=action_filter), params)
+        finally:
+            Action.objects.filter(pk=action.pk).update(is_calculating=False)
+    else:
+        # Events can reach ClickHouse after later ones, so recently ingested events are matched again. Only those
+        # without stored matches are stored, the others would be duplicates until action_events is merged.
+        params["ingested_after"] = action.events_calculated_until - LATE_EVENTS_WINDOW
+        sync_execute(
+            INSERT_ACTION_EVENTS_SQL.format(
+                ingested_after_filter=NEWLY_INGESTED_EVENTS_FILTER, action_filter=action_filter
+            ),
+            params,
+        )
+
+    # If the steps changed during the calculation, the next one starts over
+    Action.objects.filter(pk=action.pk, updated_at=updated_at).update(events_calculated_until=calculated_until)
+    action.events_calculated_until = calculated_until
+
+
+def _get_last_ingested_at(action: Action) -> datetime.datetime:
+    params: Dict = {"team_id": action.team_id}
+    ingested_after_filter = ""
+    if action.events_calculated_until is not None:
+        # Lets the _timestamp index skip everything calculated before
+        params["ingested_after"] = action.events_calculated_until
+        ingested_after_filter = "AND _timestamp > %(ingested_after)s"
+    last_ingested_at = sync_execute(LAST_INGESTED_AT_SQL.format(ingested_after_filter=ingested_after_filter), params)
+    timestamp = last_ingested_at[0][0] if last_ingested_at else 0
+    if not timestamp and action.events_calculated_until is not None:
+        return action.events_calculated_until
+    return datetime.datetime.fromtimestamp(timestamp, tz=pytz.utc)
+
+
 def filter_event(step: ActionStep, prepend: str = "", index: int = 0) -> Tuple[List[str], Dict]:
     params = {}
     conditions = []
@@ -105,18 +198,22 @@ def filter_element(step: ActionStep, prepend: str = "") -> Tuple[List[str], Dict
         conditions.append("match(elements_chain, %({}selector_regex)s)".format(prepend))
 
     if filters.get("tag_name"):
-        params["{}tag_name_regex".format(prepend)] = r"(^|;){}(\.|$|;|:)".format(filters["tag_name"])
-        conditions.append("match(elements_chain, %({}tag_name_regex)s)".format(prepend))
+        params["{}tag_name".format(prepend)] = filters["tag_name"]
+        conditions.append("has(elements_tag_names, %({}tag_name)s)".format(prepend))
 
+    # has() can use the bloom filter indexes, arrayExists() makes sure both match on the same element
     attributes: Dict[str, str] = {}
     for key in ["href", "text"]:
         if filters.get(key):
-            attributes[key] = re.escape(filters[key])
-
-    if len(attributes.keys()) > 0:
-        params["{}attributes_regex".format(prepend)] = ".*?({}).*?".format(
-            ".*?".join(['{}="{}"'.format(key, value) for key, value in attributes.items()])
+            attributes[key] = _escape(filters[key])
+            params["{}{}".format(prepend, key)] = attributes[key]
+            conditions.append("has(elements_{}s, %({}{})s)".format(key, prepend, key))
+
+    if len(attributes.keys()) > 1:
+        conditions.append(
+            "arrayExists((href, text) -> href = %({prepend}href)s AND text = %({prepend}text)s, elements_hrefs, elements_texts)".format(
+                prepend=prepend
+            )
         )
-        conditions.append("match(elements_chain, %({}attributes_regex)s)".format(prepend))
 
     return (conditions, params)
@@ -1,16 +1,15 @@
-import re
-from typing import List
+import string
+from functools import lru_cache
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
 
 from posthog.models.element import Element
 
-parse_attributes_regex = re.compile(r"(?P<attribute>(?P<key>.*?)\=\"(?P<value>.*?[^\\])\")", re.MULTILINE,)
+# Identical chains repeat a lot, e.g. for every click on the same button, so parsed chains are kept around
+CHAIN_CACHE_SIZE = 10000
 
-# Below splits all elements by ;, while ignoring escaped quotes and semicolons within quotes
-split_chain_regex = re.compile(r'(?:[^\s;"]|"(?:\\.|[^"])*")+')
-
-# Below splits the tag/classes from attributes
-# Needs a regex because classes can have : too
-split_class_attributes = re.compile(r"(.*?)($|:([a-zA-Z\-\_0-9]*=.*))")
+_ATTRIBUTE_KEY_CHARACTERS = frozenset(string.ascii_letters + string.digits + "-_")
+_ELEMENT_FIELDS = {"text": "text", "href": "href", "attr_id": "attr_id"}
+_ELEMENT_INT_FIELDS = {"nth-child": "nth_child", "nth-of-type": "nth_of_type"}
 
 
 def _escape(input: str) -> str:
@@ -41,34 +40,106 @@ def elements_to_string(elements: List[Element],) -> str:
     return ";".join(ret)
 
 
+class ChainElement(NamedTuple):
+    """An element parsed from an elements_chain. Parsed chains are shared, so don't mutate attr_class or attributes."""
+
+    order: int
+    tag_name: Optional[str] = None
+    attr_class: Optional[List[str]] = None
+    text: Optional[str] = None
+    href: Optional[str] = None
+    attr_id: Optional[str] = None
+    nth_child: Optional[int] = None
+    nth_of_type: Optional[int] = None
+    attributes: Dict[str, str] = {}
+
+    def to_dict(self) -> Dict[str, Any]:
+        # Same as posthog.api.element.ElementSerializer
+        return {
+            "text": self.text,
+            "tag_name": self.tag_name,
+            "attr_class": list(self.attr_class) if self.attr_class is not None else None,
+            "href": self.href,
+            "attr_id": self.attr_id,
+            "nth_child": self.nth_child,
+            "nth_of_type": self.nth_of_type,
+            "attributes": dict(self.attributes),
+            "order": self.order,
+        }
+
+    def to_element(self) -> Element:
+        return Element(**self.to_dict())
+
+
 def chain_to_elements(chain: str) -> List[Element]:
-    elements = []
-    for idx, el_string in enumerate(re.findall(split_chain_regex, chain)):
-        el_string_split = re.findall(split_class_attributes, el_string)[0]
-        attributes = re.finditer(parse_attributes_regex, el_string_split[2]) if len(el_string_split) > 2 else []
-
-        element = Element(order=idx)
-
-        if el_string_split[0]:
-            tag_and_class = el_string_split[0].split(".", 1)
-            element.tag_name = tag_and_class[0]
-            if len(tag_and_class) > 1:
-                element.attr_class = [cl for cl in tag_and_class[1].split(".") if cl != ""]
-
-        for ii in attributes:
-            item = ii.groupdict()
-            if item["key"] == "href":
-                element.href = item["value"]
-            elif item["key"] == "nth-child":
-                element.nth_child = int(item["value"])
-            elif item["key"] == "nth-of-type":
-                element.nth_of_type = int(item["value"])
-            elif item["key"] == "text":
-                element.text = item["value"]
-            elif item["key"] == "attr_id":
-                element.attr_id = item["value"]
-            elif item["key"]:
-                element.attributes[item["key"]] = item["value"]
-
-        elements.append(element)
-    return elements
+    return [element.to_element() for element in parse_chain(chain)]
+
+
+@lru_cache(maxsize=CHAIN_CACHE_SIZE)
+def parse_chain(chain: str) -> Tuple[ChainElement, ...]:
+    """
+    Parses an elements_chain, as written by elements_to_string, in a single pass. Elements are split on semicolons
+    outside of quoted values, and attribute values are kept escaped.
+    """
+    elements: List[ChainElement] = []
+    length = len(chain)
+    position = 0
+    while position < length:
+        element_end = chain.find(";", position)
+        if element_end == -1:
+            element_end = length
+        attributes_start = _find_attributes_start(chain, position, element_end)
+        head = chain[position : attributes_start if attributes_start != -1 else element_end]
+
+        fields: Dict[str, Any] = {}
+        if head:
+            tag_name, dot, classes = head.partition(".")
+            fields["tag_name"] = tag_name
+            if dot:
+                fields["attr_class"] = [name for name in classes.split(".") if name != ""]
+
+        if attributes_start != -1:
+            attributes: Dict[str, str] = {}
+            position = attributes_start + 1
+            while position < length and chain[position] != ";":
+                value_start = chain.find('="', position)
+                if value_start == -1 or chain.find(";", position, value_start) != -1:
+                    break
+                key = chain[position:value_start]
+                value_start += 2
+                value_end = chain.find('"', value_start)
+                while value_end != -1 and chain[value_end - 1] == "\\":
+                    value_end = chain.find('"', value_end + 1)
+                if value_end == -1:
+                    value_end = length
+                value = chain[value_start:value_end]
+                position = value_end + 1
+
+                if key in _ELEMENT_FIELDS:
+                    fields[_ELEMENT_FIELDS[key]] = value
+                elif key in _ELEMENT_INT_FIELDS:
+                    fields[_ELEMENT_INT_FIELDS[key]] = int(value)
+                elif key:
+                    attributes[key] = value
+            fields["attributes"] = attributes
+            element_end = chain.find(";", min(position, length))
+            if element_end == -1:
+                element_end = length
+
+        if head or attributes_start != -1:
+            elements.append(ChainElement(order=len(elements), **fields))
+        position = element_end + 1
+    return tuple(elements)
+
+
+def _find_attributes_start(chain: str, start: int, end: int) -> int:
+    # Attributes start at the first colon followed by a key and "=", class names can contain colons too
+    colon = chain.find(":", start, end)
+    while colon != -1:
+        key_end = colon + 1
+        while key_end < end and chain[key_end] in _ATTRIBUTE_KEY_CHARACTERS:
+            key_end += 1
+        if key_end < end and chain[key_end] == "=":
+            return colon
+        colon = chain.find(":", colon + 1, end)
+    return -1
@@ -1,5 +1,4 @@
 import datetime
-import json
 from typing import Any, Dict, List, Optional
 from uuid import UUID, uuid4
 
@@ -29,7 +28,7 @@ from ee.clickhouse.sql.person import (
 )
 from ee.kafka_client.client import ClickhouseProducer
 from ee.kafka_client.topics import KAFKA_PERSON, KAFKA_PERSON_UNIQUE_ID
-from posthog import settings
+from posthog import json_codec, settings
 from posthog.ee import is_ee_enabled
 from posthog.models.filter import Filter
 from posthog.models.person import Person, PersonDistinctId
@@ -74,7 +73,7 @@ def create_person(
     data = {
         "id": str(uuid),
         "team_id": team_id,
-        "properties": json.dumps(properties),
+        "properties": json_codec.dumps(properties),
         "is_identified": int(is_identified),
         "created_at": timestamp.strftime("%Y-%m-%d %H:%M:%S.%f"),
     }
@@ -84,7 +83,7 @@ def create_person(
 
 
 def update_person_properties(team_id: int, id: str, properties: Dict) -> None:
-    sync_execute(UPDATE_PERSON_PROPERTIES, {"team_id": team_id, "id": id, "properties": json.dumps(properties)})
+    sync_execute(UPDATE_PERSON_PROPERTIES, {"team_id": team_id, "id": id, "properties": json_codec.dumps(properties)})
 
 
 def update_person_is_identified(team_id: int, id: str, is_identified: bool) -> None:
@@ -169,7 +168,7 @@ class ClickhousePersonSerializer(serializers.Serializer):
     distinct_ids = serializers.SerializerMethodField()
 
     def get_name(self, person):
-        props = json.loads(person[3])
+        props = json_codec.loads(person[3])
         email = props.get("email", None)
         return email or person[0]
 
@@ -183,7 +182,7 @@ class ClickhousePersonSerializer(serializers.Serializer):
         return person[2]
 
     def get_properties(self, person):
-        return json.loads(person[3])
+        return json_codec.loads(person[3])
 
     def get_is_identified(self, person):
         return person[4]
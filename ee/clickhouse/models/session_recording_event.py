@@ -1,5 +1,4 @@
 import datetime
-import json
 import uuid
 from typing import Dict, List, Optional, Tuple, Union
 
@@ -10,6 +9,7 @@ from ee.clickhouse.models.util import cast_timestamp_or_now
 from ee.clickhouse.sql.session_recording_events import INSERT_SESSION_RECORDING_EVENT_SQL
 from ee.kafka_client.client import ClickhouseProducer
 from ee.kafka_client.topics import KAFKA_SESSION_RECORDING_EVENTS
+from posthog import json_codec
 
 
 def create_session_recording_event(
@@ -27,10 +27,16 @@ def create_session_recording_event(
         "team_id": team_id,
         "distinct_id": distinct_id,
         "session_id": session_id,
-        "snapshot_data": json.dumps(snapshot_data),
+        "snapshot_data": json_codec.dumps(snapshot_data),
         "timestamp": timestamp,
         "created_at": timestamp,
     }
     p = ClickhouseProducer()
-    p.produce(sql=INSERT_SESSION_RECORDING_EVENT_SQL, topic=KAFKA_SESSION_RECORDING_EVENTS, data=data)
+    # Keyed so that the snapshots of a session stay in order
+    p.produce(
+        sql=INSERT_SESSION_RECORDING_EVENT_SQL,
+        topic=KAFKA_SESSION_RECORDING_EVENTS,
+        data=data,
+        key="{}:{}".format(team_id, session_id),
+    )
     return str(uuid)
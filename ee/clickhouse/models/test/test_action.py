@@ -1,9 +1,12 @@
 import json
+from datetime import timedelta
 from typing import Dict, List, Optional
 from uuid import uuid4
 
+from django.utils import timezone
+
 from ee.clickhouse.client import sync_execute
-from ee.clickhouse.models.action import filter_event, format_action_filter
+from ee.clickhouse.models.action import filter_event, format_action_filter, update_action_events
 from ee.clickhouse.models.event import create_event
 from ee.clickhouse.sql.actions import ACTION_QUERY
 from ee.clickhouse.util import ClickhouseTestMixin
@@ -50,12 +53,112 @@ def _create_person(**kwargs) -> Person:
     return Person(id=person.uuid)
 
 
+def _get_events_for_calculated_action(action: Action) -> List[Event]:
+    # Stores matches of every event, so none are matched on the fly
+    action.events_calculated_until = None
+    update_action_events(action, calculated_until=timezone.now() + timedelta(hours=1))
+    return _get_events_for_action(action)
+
+
 class TestActions(
     ClickhouseTestMixin, filter_by_actions_factory(_create_event, _create_person, _get_events_for_action)  # type: ignore
 ):
     pass
 
 
+class TestCalculatedActions(
+    ClickhouseTestMixin,
+    filter_by_actions_factory(_create_event, _create_person, _get_events_for_calculated_action),  # type: ignore
+):
+    pass
+
+
+class TestActionEvents(ClickhouseTestMixin, BaseTest):
+    def _action_event_uuids(self, action: Action) -> List[str]:
+        return [str(event.pk) for event in _get_events_for_action(action)]
+
+    def test_stored_matches_are_queried(self):
+        action = Action.objects.create(team=self.team, name="signed up")
+        ActionStep.objects.create(action=action, event="user signed up")
+        signed_up = _create_event(event="user signed up", team=self.team, distinct_id="whatever")
+        _create_event(event="user logged in", team=self.team, distinct_id="whatever")
+
+        update_action_events(action, calculated_until=timezone.now() + timedelta(hours=1))
+
+        self.assertEqual(Action.objects.get(pk=action.pk).events_calculated_until, action.events_calculated_until)
+        # update() skips signals, so the stored matches stay in use
+        ActionStep.objects.filter(action=action).update(event="user logged in")
+        self.assertEqual(self._action_event_uuids(action), [signed_up.pk])
+
+    def test_recent_events_are_matched_on_the_fly(self):
+        action = Action.objects.create(team=self.team, name="signed up")
+        ActionStep.objects.create(action=action, event="user signed up")
+        update_action_events(action, calculated_until=timezone.now() - timedelta(hours=1))
+
+        signed_up = _create_event(event="user signed up", team=self.team, distinct_id="whatever")
+        self.assertEqual(self._action_event_uuids(action), [signed_up.pk])
+
+    def test_calculated_until_last_ingested_event(self):
+        action = Action.objects.create(team=self.team, name="signed up")
+        ActionStep.objects.create(action=action, event="user signed up")
+        signed_up = _create_event(event="user signed up", team=self.team, distinct_id="whatever")
+
+        update_action_events(action)
+
+        last_ingested_at = sync_execute(
+            "SELECT toUnixTimestamp(max(_timestamp)) FROM events WHERE team_id = %(team_id)s", {"team_id": self.team.pk}
+        )[0][0]
+        self.assertEqual(action.events_calculated_until.timestamp(), last_ingested_at)
+        self.assertEqual(self._action_event_uuids(action), [signed_up.pk])
+
+        # Nothing was ingested since, so the calculation is left as is
+        calculated_until = action.events_calculated_until
+        update_action_events(action)
+        self.assertEqual(Action.objects.get(pk=action.pk).events_calculated_until, calculated_until)
+
+    def test_overlapping_calculations_store_matches_once(self):
+        action = Action.objects.create(team=self.team, name="signed up")
+        ActionStep.objects.create(action=action, event="user signed up")
+        signed_up = _create_event(event="user signed up", team=self.team, distinct_id="whatever")
+        update_action_events(action, calculated_until=timezone.now() + timedelta(minutes=1))
+
+        # The event was ingested within LATE_EVENTS_WINDOW of the first calculation, so the second one matches it again
+        update_action_events(action, calculated_until=timezone.now() + timedelta(minutes=2))
+
+        stored = sync_execute(
+            "SELECT uuid FROM action_events WHERE team_id = %(team_id)s AND action_id = %(action_id)s",
+            {"team_id": self.team.pk, "action_id": action.pk},
+        )
+        self.assertEqual([str(row[0]) for row in stored], [signed_up.pk])
+
+    def test_date_filter(self):
+        action = Action.objects.create(team=self.team, name="signed up")
+        ActionStep.objects.create(action=action, event="user signed up")
+        _create_event(event="user signed up", team=self.team, distinct_id="whatever", timestamp="2020-01-02T12:00:00Z")
+        recent = _create_event(event="user signed up", team=self.team, distinct_id="whatever")
+        update_action_events(action, calculated_until=timezone.now() + timedelta(hours=1))
+
+        formatted_query, params = format_action_filter(action, date_filter="and timestamp >= '2020-06-01 00:00:00'")
+        result = sync_execute(ACTION_QUERY.format(action_filter=formatted_query), {"team_id": self.team.pk, **params})
+        self.assertEqual([str(row[0]) for row in result], [recent.pk])
+
+    def test_changing_steps_recalculates_all_events(self):
+        action = Action.objects.create(team=self.team, name="signed up")
+        step = ActionStep.objects.create(action=action, event="user signed up")
+        _create_event(event="user signed up", team=self.team, distinct_id="whatever")
+        logged_in = _create_event(event="user logged in", team=self.team, distinct_id="whatever")
+        update_action_events(action, calculated_until=timezone.now() + timedelta(hours=1))
+
+        step.event = "user logged in"
+        step.save()
+
+        action = Action.objects.get(pk=action.pk)
+        self.assertIsNone(action.events_calculated_until)
+        self.assertEqual(self._action_event_uuids(action), [logged_in.pk])
+        update_action_events(action, calculated_until=timezone.now() + timedelta(hours=1))
+        self.assertEqual(self._action_event_uuids(action), [logged_in.pk])
+
+
 class TestActionFormat(ClickhouseTestMixin, BaseTest):
     def test_filter_event_exact_url(self):
 
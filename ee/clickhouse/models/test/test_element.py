@@ -1,5 +1,6 @@
 from ee.clickhouse.client import sync_execute
-from ee.clickhouse.models.element import chain_to_elements, elements_to_string
+from ee.clickhouse.models.element import ChainElement, chain_to_elements, elements_to_string, parse_chain
+from ee.clickhouse.models.event import create_event
 from ee.clickhouse.util import ClickhouseTestMixin
 from posthog.api.test.base import BaseTest
 from posthog.models import Element
@@ -79,3 +80,67 @@ class TestClickhouseElement(ClickhouseTestMixin, BaseTest):
         self.assertEqual(elements[0].tag_name, "a")
         self.assertEqual(elements[0].href, "/a-url")
         self.assertEqual(elements[0].attr_class, ["small", "xy:z"])
+
+    def test_parse_chain(self) -> None:
+        chain = elements_to_string(
+            elements=[
+                Element(tag_name="a", href="/a-url", text='bla " bla; x="y"', nth_child=1, attributes={"attr__x": ""}),
+                Element(attr_class=["btn"], nth_of_type=2),
+            ]
+        )
+
+        self.assertEqual(
+            parse_chain(chain),
+            (
+                ChainElement(
+                    order=0,
+                    tag_name="a",
+                    text=r"bla \" bla; x=\"y\"",
+                    href="/a-url",
+                    nth_child=1,
+                    nth_of_type=0,
+                    attributes={"attr__x": ""},
+                ),
+                ChainElement(order=1, tag_name="", attr_class=["btn"], nth_child=0, nth_of_type=2, attributes={}),
+            ),
+        )
+        self.assertIs(parse_chain(chain), parse_chain(chain))
+        self.assertEqual(parse_chain(""), ())
+
+        as_dict = parse_chain(chain)[1].to_dict()
+        as_dict["attr_class"].append("mutated")
+        self.assertEqual(parse_chain(chain)[1].attr_class, ["btn"])
+
+    def test_elements_columns(self) -> None:
+        create_event(
+            event_uuid=UUIDT(),
+            event="$autocapture",
+            team=self.team,
+            distinct_id="whatever",
+            elements=[
+                Element(tag_name="a", href="/a-url", attr_class=["small", "xy:z"], text='bla " bla;', nth_child=1),
+                Element(tag_name="button", attr_class=["btn", "btn-primary"], attributes={"attr__text": "no"}),
+                Element(tag_name="div", attr_id="nested"),
+            ],
+        )
+
+        result = sync_execute(
+            """
+            SELECT elements_tag_names, elements_classes, elements_texts, elements_hrefs, elements_attr_ids
+            FROM events WHERE team_id = %(team_id)s
+            """,
+            {"team_id": self.team.pk},
+        )
+
+        self.assertEqual(
+            result,
+            [
+                (
+                    ["a", "button", "div"],
+                    [["small", "xy:z"], ["btn", "btn-primary"], []],
+                    [r"bla \" bla;", "", ""],
+                    ["/a-url", "", ""],
+                    ["", "", "nested"],
+                )
+            ],
+        )
@@ -1,32 +1,30 @@
 import datetime
 import json
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Tuple
 from uuid import UUID
 
 import statsd
 from celery import shared_task
-from dateutil import parser
-from dateutil.relativedelta import relativedelta
 from django.conf import settings
-from django.db.utils import IntegrityError
 from sentry_sdk import capture_exception
 
-from ee.clickhouse.models.event import create_event
+from ee.clickhouse.models.event import create_events, event_to_proto
 from ee.clickhouse.models.session_recording_event import create_session_recording_event
+from ee.idl.gen import events_pb2
 from ee.kafka_client.client import KafkaProducer
 from ee.kafka_client.topics import KAFKA_EVENTS_WAL
 from posthog.ee import is_ee_enabled
-from posthog.models.element import Element
 from posthog.models.person import Person
 from posthog.models.team import Team
 from posthog.models.utils import UUIDT
-from posthog.tasks.process_event import handle_identify_or_alias, store_names_and_properties
+from posthog.tasks.process_event import _pop_elements, handle_identify_or_alias, store_names_and_properties
+from posthog.utils import parse_iso_datetime
 
 if settings.STATSD_HOST is not None:
     statsd.Connection.set_defaults(host=settings.STATSD_HOST, port=settings.STATSD_PORT)
 
 
-def _capture_ee(
+def _prepare_event_ee(
     event_uuid: UUID,
     person_uuid: UUID,
     ip: str,
@@ -36,44 +34,19 @@ def _capture_ee(
     distinct_id: str,
     properties: Dict,
     timestamp: datetime.datetime,
-) -> None:
-    elements = properties.get("$elements")
-    elements_list = []
-    if elements:
-        del properties["$elements"]
-        elements_list = [
-            Element(
-                text=el["$el_text"][0:400] if el.get("$el_text") else None,
-                tag_name=el["tag_name"],
-                href=el["attr__href"][0:2048] if el.get("attr__href") else None,
-                attr_class=el["attr__class"].split(" ") if el.get("attr__class") else None,
-                attr_id=el.get("attr__id"),
-                nth_child=el.get("nth_child"),
-                nth_of_type=el.get("nth_of_type"),
-                attributes={key: value for key, value in el.items() if key.startswith("attr__")},
-            )
-            for index, el in enumerate(elements)
-        ]
+) -> events_pb2.Event:
+    elements_list = _pop_elements(properties)
 
-    team = Team.objects.only("slack_incoming_webhook", "event_names", "event_properties", "anonymize_ips").get(
-        pk=team_id
-    )
+    team = Team.objects.get_cached(team_id)
 
     if not team.anonymize_ips and "$ip" not in properties:
         properties["$ip"] = ip
 
     store_names_and_properties(team=team, event=event, properties=properties)
 
-    if not Person.objects.distinct_ids_exist(team_id=team_id, distinct_ids=[str(distinct_id)]):
-        # Catch race condition where in between getting and creating,
-        # another request already created this user
-        try:
-            Person.objects.create(team_id=team_id, distinct_ids=[str(distinct_id)])
-        except IntegrityError:
-            pass
+    Person.objects.get_or_create_person_id(team_id, str(distinct_id))
 
-    # # determine create events
-    create_event(
+    return event_to_proto(
         event_uuid=event_uuid,
         event=event,
         properties=properties,
@@ -81,26 +54,36 @@ def _capture_ee(
         team=team,
         distinct_id=distinct_id,
         elements=elements_list,
-        site_url=site_url,
+    )
+
+
+def _create_session_recording_event(team_id: int, distinct_id: str, data: dict, timestamp: datetime.datetime) -> None:
+    create_session_recording_event(
+        uuid=UUIDT(),
+        team_id=team_id,
+        distinct_id=distinct_id,
+        session_id=data["properties"]["$session_id"],
+        snapshot_data=data["properties"]["$snapshot_data"],
+        timestamp=timestamp,
     )
 
 
 def handle_timestamp(data: dict, now: datetime.datetime, sent_at: Optional[datetime.datetime]) -> datetime.datetime:
     if data.get("timestamp"):
+        timestamp = parse_iso_datetime(data["timestamp"])
         if sent_at:
             # sent_at - timestamp == now - x
             # x = now + (timestamp - sent_at)
             try:
                 # timestamp and sent_at must both be in the same format: either both with or both without timezones
                 # otherwise we can't get a diff to add to now
-                return now + (parser.isoparse(data["timestamp"]) - sent_at)
+                return now + (timestamp - sent_at)
             except TypeError as e:
                 capture_exception(e)
-        return parser.isoparse(data["timestamp"])
-    now_datetime = now
+        return timestamp
     if data.get("offset"):
-        return now_datetime - relativedelta(microseconds=data["offset"] * 1000)
-    return now_datetime
+        return now - datetime.timedelta(milliseconds=data["offset"])
+    return now
 
 
 if is_ee_enabled():
@@ -114,40 +97,61 @@ if is_ee_enabled():
         now: datetime.datetime,
         sent_at: Optional[datetime.datetime],
     ) -> None:
+        process_events_ee(
+            ip=ip, site_url=site_url, events=[(distinct_id, data)], team_id=team_id, now=now, sent_at=sent_at
+        )
+
+    def process_events_ee(
+        ip: str,
+        site_url: str,
+        events: List[Tuple[str, dict]],
+        team_id: int,
+        now: datetime.datetime,
+        sent_at: Optional[datetime.datetime],
+    ) -> None:
+        """
+        Processes the events of a capture request one by one and produces them to ClickHouse together.
+        """
         timer = statsd.Timer("%s_posthog_cloud" % (settings.STATSD_PREFIX,))
         timer.start()
-        properties = data.get("properties", {})
-        if data.get("$set"):
-            properties["$set"] = data["$set"]
-
-        person_uuid = UUIDT()
-        event_uuid = UUIDT()
-        ts = handle_timestamp(data, now, sent_at)
-        handle_identify_or_alias(data["event"], properties, distinct_id, team_id)
-
-        if data["event"] == "$snapshot":
-            create_session_recording_event(
-                uuid=event_uuid,
-                team_id=team_id,
-                distinct_id=distinct_id,
-                session_id=properties["$session_id"],
-                snapshot_data=properties["$snapshot_data"],
-                timestamp=ts,
+        pb_events: List[events_pb2.Event] = []
+        for distinct_id, data in events:
+            properties = data.get("properties", {})
+            if data.get("$set"):
+                properties["$set"] = data["$set"]
+
+            person_uuid = UUIDT()
+            event_uuid = UUIDT()
+            ts = handle_timestamp(data, now, sent_at)
+
+            if data["event"] == "$snapshot":
+                _create_session_recording_event(team_id, distinct_id, data, ts)
+                continue
+
+            handle_identify_or_alias(data["event"], properties, distinct_id, team_id)
+
+            pb_events.append(
+                _prepare_event_ee(
+                    event_uuid=event_uuid,
+                    person_uuid=person_uuid,
+                    ip=ip,
+                    site_url=site_url,
+                    team_id=team_id,
+                    event=data["event"],
+                    distinct_id=distinct_id,
+                    properties=properties,
+                    timestamp=ts,
+                )
             )
-            return
-
-        _capture_ee(
-            event_uuid=event_uuid,
-            person_uuid=person_uuid,
-            ip=ip,
-            site_url=site_url,
-            team_id=team_id,
-            event=data["event"],
-            distinct_id=distinct_id,
-            properties=properties,
-            timestamp=ts,
-        )
-        timer.stop("process_event_ee")
+        create_events(team_id=team_id, pb_events=pb_events)
+        timer.stop("process_events_ee")
+
+    def process_session_recording_events_ee(
+        team_id: int, events: List[Tuple[str, dict]], now: datetime.datetime, sent_at: Optional[datetime.datetime],
+    ) -> None:
+        # `$snapshot` events need no person or team processing
+        for distinct_id, data in events:
+            _create_session_recording_event(team_id, distinct_id, data, handle_timestamp(data, now, sent_at))
 
 
 else:
@@ -164,6 +168,23 @@ else:
         # Noop if ee is not enabled
         return
 
+    def process_events_ee(
+        ip: str,
+        site_url: str,
+        events: List[Tuple[str, dict]],
+        team_id: int,
+        now: datetime.datetime,
+        sent_at: Optional[datetime.datetime],
+    ) -> None:
+        # Noop if ee is not enabled
+        return
+
+    def process_session_recording_events_ee(
+        team_id: int, events: List[Tuple[str, dict]], now: datetime.datetime, sent_at: Optional[datetime.datetime],
+    ) -> None:
+        # Noop if ee is not enabled
+        return
+
 
 def log_event(
     distinct_id: str,
@@ -173,6 +194,7 @@ def log_event(
     team_id: int,
     now: datetime.datetime,
     sent_at: Optional[datetime.datetime],
+    topic: str = KAFKA_EVENTS_WAL,
 ) -> None:
     data = {
         "distinct_id": distinct_id,
@@ -184,4 +206,5 @@ def log_event(
         "sent_at": sent_at.isoformat() if sent_at else "",
     }
     p = KafkaProducer()
-    p.produce(topic=KAFKA_EVENTS_WAL, data=data)
+    # Keyed so that events of the same user end up in the same partition, in order
+    p.produce(topic=topic, data=data, key="{}:{}".format(team_id, distinct_id))
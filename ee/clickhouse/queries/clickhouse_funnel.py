@@ -40,7 +40,9 @@ class ClickhouseFunnel(Funnel):
             action = Action.objects.get(pk=entity.id)
             for action_step in action.steps.all():
                 self.params["events"].append(action_step.event)
-            action_query, action_params = format_action_filter(action, "step_{}".format(index))
+            action_query, action_params = format_action_filter(
+                action, "step_{}".format(index), date_filter=self._action_date_filter
+            )
             if action_query == "":
                 return ""
 
@@ -61,6 +63,7 @@ class ClickhouseFunnel(Funnel):
             self._filter._date_to = timezone.now()
 
         parsed_date_from, parsed_date_to = parse_timestamps(filter=self._filter, table="events.")
+        self._action_date_filter = "".join(parse_timestamps(filter=self._filter))
         self.params: Dict = {
             "team_id": self._team.pk,
             "events": [],  # purely a speed optimization, don't need this for filtering
@@ -5,7 +5,7 @@ from django.utils import timezone
 from ee.clickhouse.client import sync_execute
 from ee.clickhouse.models.property import parse_prop_clauses
 from ee.clickhouse.queries.util import parse_timestamps
-from ee.clickhouse.sql.events import EXTRACT_TAG_REGEX, EXTRACT_TEXT_REGEX
+from ee.clickhouse.sql.events import EXTRACT_TAG_NAME, EXTRACT_TEXT
 from ee.clickhouse.sql.paths.path import PATHS_QUERY_FINAL
 from posthog.constants import AUTOCAPTURE_EVENT, CUSTOM_EVENT, SCREEN_EVENT
 from posthog.models.filter import Filter
@@ -28,9 +28,7 @@ class ClickhousePaths(Paths):
                 path_type = "JSONExtractString(properties, '$screen_name')"
             elif requested_type == AUTOCAPTURE_EVENT:
                 event = AUTOCAPTURE_EVENT
-                path_type = "concat('<', {tag_regex}, '> ', {text_regex})".format(
-                    tag_regex=EXTRACT_TAG_REGEX, text_regex=EXTRACT_TEXT_REGEX
-                )
+                path_type = "concat('<', {tag_name}, '> ', {text})".format(tag_name=EXTRACT_TAG_NAME, text=EXTRACT_TEXT)
                 start_comparator = "elements_chain"
             elif requested_type == CUSTOM_EVENT:
                 event = None
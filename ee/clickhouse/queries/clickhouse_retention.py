@@ -44,8 +44,15 @@ class ClickhouseRetention(Retention):
             target_query = "AND e.event = %(target_event)s"
             target_params = {"target_event": target_entity.id}
 
-        target_query, target_params = self._get_condition(target_entity)
-        returning_query, returning_params = self._get_condition(returning_entity, "returning")
+        # First time retention looks for the first event of each person, which can be before the date range
+        date_filter = ""
+        if not is_first_time_retention:
+            date_filter = (
+                "AND toDateTime(timestamp) >= toDateTime(%(start_date)s) "
+                "AND toDateTime(timestamp) <= toDateTime(%(end_date)s)"
+            )
+        target_query, target_params = self._get_condition(target_entity, date_filter=date_filter)
+        returning_query, returning_params = self._get_condition(returning_entity, "returning", date_filter)
 
         target_query_formatted = (
             "AND {target_query}".format(target_query=target_query)
@@ -96,10 +103,10 @@ class ClickhouseRetention(Retention):
 
         return result_dict
 
-    def _get_condition(self, target_entity: Entity, prepend: str = "") -> Tuple[str, Dict]:
+    def _get_condition(self, target_entity: Entity, prepend: str = "", date_filter: str = "") -> Tuple[str, Dict]:
         if target_entity.type == TREND_FILTER_TYPE_ACTIONS:
             action = Action.objects.get(pk=target_entity.id)
-            action_query, params = format_action_filter(action, prepend=prepend, use_loop=True)
+            action_query, params = format_action_filter(action, prepend=prepend, use_loop=True, date_filter=date_filter)
             condition = "e.uuid IN ({})".format(action_query)
         elif target_entity.type == TREND_FILTER_TYPE_EVENTS:
             condition = "e.event = %({}_event)s".format(prepend)
@@ -1,19 +1,22 @@
 import datetime
-import json
-from typing import Any, Callable, List
+from typing import Any, Callable, List, Optional, Tuple
 
 from ee.clickhouse.client import sync_execute
+from posthog import json_codec
 from posthog.models import Team
 from posthog.queries.base import BaseQuery
 from posthog.queries.session_recording import SessionRecording as BaseSessionRecording
 from posthog.queries.session_recording import add_session_recording_ids as _add_session_recording_ids
 
 SINGLE_RECORDING_QUERY = """
-    SELECT snapshot_data
+    SELECT timestamp, snapshot_data
     FROM session_recording_events
     WHERE
         team_id = %(team_id)s
         AND session_id = %(session_id)s
+        {conditions}
+    ORDER BY timestamp
+    {limit}
 """
 
 SESSIONS_RECORING_LIST_QUERY = """
@@ -33,9 +36,29 @@ SESSIONS_RECORING_LIST_QUERY_COLUMNS = ["session_id", "distinct_id", "start_time
 
 
 class SessionRecording(BaseSessionRecording):
-    def query_recording_snapshots(self, team: Team, session_id: str) -> List[Any]:
-        response = sync_execute(SINGLE_RECORDING_QUERY, {"team_id": team.id, "session_id": session_id})
-        return [json.loads(row[0]) for row in response]
+    def query_recording_snapshots(
+        self,
+        team: Team,
+        session_id: str,
+        after: Optional[datetime.datetime] = None,
+        until: Optional[datetime.datetime] = None,
+        limit: Optional[int] = None,
+    ) -> List[Tuple[datetime.datetime, Any]]:
+        conditions = ""
+        params = {"team_id": team.id, "session_id": session_id}
+        if after is not None:
+            conditions += "AND timestamp > %(after)s "
+            params["after"] = after.strftime("%Y-%m-%d %H:%M:%S.%f")
+        if until is not None:
+            conditions += "AND timestamp <= %(until)s "
+            params["until"] = until.strftime("%Y-%m-%d %H:%M:%S.%f")
+        response = sync_execute(
+            SINGLE_RECORDING_QUERY.format(
+                conditions=conditions, limit="LIMIT {}".format(int(limit)) if limit is not None else ""
+            ),
+            params,
+        )
+        return [(timestamp, json_codec.loads(snapshot_data)) for timestamp, snapshot_data in response]
 
 
 def add_session_recording_ids(team: Team, sessions_results: List[Any]) -> List[Any]:
@@ -26,7 +26,7 @@ class ClickhouseStickiness(Stickiness):
         params = {**params, **prop_filter_params}
         if entity.type == TREND_FILTER_TYPE_ACTIONS:
             action = Action.objects.get(pk=entity.id)
-            action_query, action_params = format_action_filter(action)
+            action_query, action_params = format_action_filter(action, date_filter=parsed_date_from + parsed_date_to)
             if action_query == "":
                 return {}
 
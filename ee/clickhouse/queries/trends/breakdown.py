@@ -63,7 +63,7 @@ class ClickhouseTrendsBreakdown:
         action_params: Dict = {}
         if entity.type == TREND_FILTER_TYPE_ACTIONS:
             action = Action.objects.get(pk=entity.id)
-            action_query, action_params = format_action_filter(action)
+            action_query, action_params = format_action_filter(action, date_filter=parsed_date_from + parsed_date_to)
 
         null_sql = NULL_BREAKDOWN_SQL.format(
             interval=interval_annotation,
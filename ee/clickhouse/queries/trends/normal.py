@@ -44,7 +44,9 @@ class ClickhouseTrendsNormal:
         if entity.type == TREND_FILTER_TYPE_ACTIONS:
             try:
                 action = Action.objects.get(pk=entity.id)
-                action_query, action_params = format_action_filter(action)
+                action_query, action_params = format_action_filter(
+                    action, date_filter=parsed_date_from + parsed_date_to
+                )
                 params = {**params, **action_params}
                 content_sql = VOLUME_ACTIONS_SQL
                 content_sql_params = {**content_sql_params, "actions_query": action_query}
@@ -1,3 +1,5 @@
+from .clickhouse import STORAGE_POLICY, table_engine
+
 ACTION_QUERY = """
 SELECT
     events.uuid,
@@ -13,3 +15,67 @@ WHERE {action_filter}
 AND events.team_id = %(team_id)s
 ORDER BY events.timestamp DESC
 """
+
+ACTION_EVENTS_TABLE = "action_events"
+
+ACTION_EVENTS_TABLE_SQL = """
+CREATE TABLE {table_name}
+(
+    team_id Int64,
+    action_id Int64,
+    uuid UUID,
+    timestamp DateTime64(6, 'UTC'),
+    distinct_id VARCHAR,
+    _timestamp DateTime
+) ENGINE = {engine}
+PARTITION BY toYYYYMM(timestamp)
+ORDER BY (team_id, action_id, toDate(timestamp), distinct_id, uuid)
+{storage_policy}
+""".format(
+    table_name=ACTION_EVENTS_TABLE,
+    engine=table_engine(ACTION_EVENTS_TABLE, "_timestamp"),
+    storage_policy=STORAGE_POLICY,
+)
+
+DROP_ACTION_EVENTS_TABLE_SQL = "DROP TABLE action_events"
+
+# Lets calculations only read the parts of a team's events ingested since the last one
+EVENTS_INGESTED_AT_INDEX_SQL = "ALTER TABLE events ADD INDEX _timestamp_minmax _timestamp TYPE minmax GRANULARITY 1"
+
+INSERT_ACTION_EVENTS_SQL = """
+INSERT INTO action_events (team_id, action_id, uuid, timestamp, distinct_id, _timestamp)
+SELECT team_id, %(action_id)s, uuid, timestamp, distinct_id, now()
+FROM events
+WHERE team_id = %(team_id)s
+AND _timestamp <= %(calculated_until)s
+{ingested_after_filter}
+AND {action_filter}
+"""
+
+# Limits an incremental calculation to events ingested after `ingested_after`, skipping those matched by an earlier
+# calculation that overlapped with it. Matches are stored after the events they match were ingested.
+NEWLY_INGESTED_EVENTS_FILTER = """
+AND _timestamp > %(ingested_after)s
+AND uuid NOT IN (
+    SELECT uuid FROM action_events
+    WHERE team_id = %(team_id)s AND action_id = %(action_id)s AND _timestamp > %(ingested_after)s
+)
+"""
+
+DELETE_ACTION_EVENTS_SQL = """
+ALTER TABLE action_events DELETE WHERE team_id = %(team_id)s AND action_id = %(action_id)s
+"""
+
+# What ClickHouse has ingested of a team's events, as a unix timestamp (0 for none)
+LAST_INGESTED_AT_SQL = """
+SELECT toUnixTimestamp(max(_timestamp)) FROM events WHERE team_id = %(team_id)s {ingested_after_filter}
+"""
+
+# Stored matches plus events ingested since they were calculated, which are matched on the fly. `date_filter` limits
+# both to the date range of the query using them.
+ACTION_EVENTS_UUIDS_SQL = """
+SELECT uuid FROM action_events WHERE team_id = %(team_id)s AND action_id = %({prepend}action_id)s {date_filter}
+UNION ALL
+SELECT uuid FROM events
+WHERE team_id = %(team_id)s AND _timestamp > %({prepend}ingested_after)s {date_filter} AND {action_filter}
+"""
@@ -74,6 +74,41 @@ FROM kafka_{table_name}
     table_name=EVENTS_TABLE
 )
 
+# Elements of the chain, split like ee.clickhouse.models.element.split_chain_regex does
+_CHAIN_ELEMENTS = r"""extractAll(elements_chain, '(?:[^\\s;"]|"(?:\\\\.|[^"])*")+')"""
+
+
+def _chain_attribute(key: str) -> str:
+    # Values are kept escaped, like ee.clickhouse.models.element.chain_to_elements returns them
+    return r"""arrayMap(element -> extract(element, '(?::|"){}="(.*?[^\\\\])"'), {})""".format(key, _CHAIN_ELEMENTS)
+
+
+# Parallel arrays with an item per element of the chain, computed by ClickHouse when events are inserted. Filtering
+# on them avoids running regexes over elements_chain.
+EVENTS_ELEMENTS_COLUMNS_SQL = """
+ALTER TABLE events
+ADD COLUMN elements_tag_names Array(String) MATERIALIZED arrayMap(element -> extract(element, '^([^.:]*)'), {elements}),
+ADD COLUMN elements_classes Array(Array(String)) MATERIALIZED arrayMap(
+    element -> arrayFilter(name -> name != '', arrayPopFront(splitByChar('.', extract(element, '^(.*?)(?:$|:[-_a-zA-Z0-9]*=)')))),
+    {elements}
+),
+ADD COLUMN elements_texts Array(String) MATERIALIZED {texts},
+ADD COLUMN elements_hrefs Array(String) MATERIALIZED {hrefs},
+ADD COLUMN elements_attr_ids Array(String) MATERIALIZED {attr_ids}
+""".format(
+    elements=_CHAIN_ELEMENTS,
+    texts=_chain_attribute("text"),
+    hrefs=_chain_attribute("href"),
+    attr_ids=_chain_attribute("attr_id"),
+)
+
+EVENTS_ELEMENTS_INDEXES_SQL = """
+ALTER TABLE events
+ADD INDEX elements_tag_names_bloom_filter elements_tag_names TYPE bloom_filter GRANULARITY 4,
+ADD INDEX elements_texts_bloom_filter elements_texts TYPE bloom_filter GRANULARITY 4,
+ADD INDEX elements_hrefs_bloom_filter elements_hrefs TYPE bloom_filter GRANULARITY 4
+"""
+
 INSERT_EVENT_SQL = """
 INSERT INTO events SELECT %(uuid)s, %(event)s, %(properties)s, %(timestamp)s, %(team_id)s, %(distinct_id)s, %(elements_chain)s, %(created_at)s, now(), 0
 """
@@ -238,11 +273,12 @@ team_id = %(team_id)s
 {order_by}
 """
 
-EXTRACT_TAG_REGEX = "extract(elements_chain, '^(.*?)[.|:]')"
-EXTRACT_TEXT_REGEX = "extract(elements_chain, 'text=\"(.*?)\"')"
+# Tag name of the clicked element and the first text along its chain
+EXTRACT_TAG_NAME = "elements_tag_names[1]"
+EXTRACT_TEXT = "arrayFirst(text -> text != '', elements_texts)"
 
 ELEMENT_TAG_COUNT = """
-SELECT concat('<', {tag_regex}, '> ', {text_regex}) AS tag_name,
+SELECT concat('<', {tag_name}, '> ', {text}) AS tag_name,
        events.elements_chain,
        count(*) as tag_count
 FROM events
@@ -251,7 +287,7 @@ GROUP BY tag_name, elements_chain
 ORDER BY tag_count desc, tag_name
 LIMIT %(limit)s
 """.format(
-    tag_regex=EXTRACT_TAG_REGEX, text_regex=EXTRACT_TEXT_REGEX
+    tag_name=EXTRACT_TAG_NAME, text=EXTRACT_TEXT
 )
 
 GET_PROPERTIES_VOLUME = """
@@ -23,7 +23,7 @@ SESSION_RECORDING_EVENTS_TABLE_SQL = (
     + """PARTITION BY toYYYYMMDD(timestamp)
 ORDER BY (team_id, toHour(timestamp), session_id, timestamp, uuid)
 {ttl_period}
-SETTINGS index_granularity=512
+SETTINGS index_granularity=512, ttl_only_drop_parts=1
 """
 ).format(
     table_name=SESSION_RECORDING_EVENTS_TABLE,
@@ -61,4 +61,9 @@ INSERT_SESSION_RECORDING_EVENT_SQL = """
 INSERT INTO session_recording_events SELECT %(uuid)s, %(timestamp)s, %(team_id)s, %(distinct_id)s, %(session_id)s, %(snapshot_data)s, %(created_at)s, now(), 0
 """
 
+# Expired rows are removed by dropping whole daily partitions rather than by rewriting parts row by row
+SESSION_RECORDING_EVENTS_TTL_ONLY_DROP_PARTS_SQL = (
+    "ALTER TABLE session_recording_events MODIFY SETTING ttl_only_drop_parts=1"
+)
+
 DROP_SESSION_RECORDING_EVENTS_TABLE_SQL = "DROP TABLE session_recording_events"
@@ -0,0 +1,76 @@
+import threading
+from unittest.mock import MagicMock, patch
+
+from django.test import SimpleTestCase
+
+from ee.clickhouse.bulk_insert import BulkInserter
+
+
+@patch("ee.clickhouse.bulk_insert.sync_insert")
+class TestBulkInserter(SimpleTestCase):
+    def _inserter(self, **kwargs) -> BulkInserter:
+        return BulkInserter(
+            "events", ["uuid", "event"], **{"max_rows": 3, "max_wait_ms": 10000, "max_queue_rows": 10, **kwargs}
+        )
+
+    def test_flush_inserts_columns(self, sync_insert: MagicMock) -> None:
+        inserter = self._inserter()
+        inserter.insert(["a", "$pageview"])
+        inserter.insert(["b", "$autocapture"])
+        inserter.flush()
+        inserter.flush()
+
+        sync_insert.assert_called_once_with("events", ["uuid", "event"], [["a", "b"], ["$pageview", "$autocapture"]])
+
+    def test_flushes_when_max_rows_is_reached(self, sync_insert: MagicMock) -> None:
+        inserted = threading.Event()
+        sync_insert.side_effect = lambda *args: inserted.set()
+        inserter = self._inserter()
+        for index in range(3):
+            inserter.insert([str(index), "$pageview"])
+
+        self.assertTrue(inserted.wait(timeout=5))
+        sync_insert.assert_called_once_with("events", ["uuid", "event"], [["0", "1", "2"], ["$pageview"] * 3])
+
+    def test_flushes_after_max_wait(self, sync_insert: MagicMock) -> None:
+        inserted = threading.Event()
+        sync_insert.side_effect = lambda *args: inserted.set()
+        inserter = self._inserter(max_wait_ms=10)
+        inserter.insert(["a", "$pageview"])
+
+        self.assertTrue(inserted.wait(timeout=5))
+
+    def test_retries_failed_inserts(self, sync_insert: MagicMock) -> None:
+        sync_insert.side_effect = [Exception("ClickHouse is down"), None]
+        inserter = self._inserter(max_wait_ms=1)
+        inserter.insert(["a", "$pageview"])
+        inserter.flush()
+
+        self.assertEqual(sync_insert.call_count, 2)
+
+    @patch("ee.clickhouse.bulk_insert.STATSD_HOST", "localhost")
+    @patch("ee.clickhouse.bulk_insert.statsd")
+    def test_reports_dropped_rows(self, statsd: MagicMock, sync_insert: MagicMock) -> None:
+        sync_insert.side_effect = Exception("ClickHouse is down")
+        inserter = self._inserter(max_wait_ms=1)
+        inserter.insert(["a", "$pageview"])
+        inserter.insert(["b", "$pageview"])
+
+        with self.assertLogs("ee.clickhouse.bulk_insert", level="ERROR") as logs, self.assertRaises(Exception):
+            inserter.flush()
+
+        self.assertEqual(sync_insert.call_count, 3)
+        self.assertEqual(
+            logs.output, ["ERROR:ee.clickhouse.bulk_insert:Dropped 2 rows for events after 3 failed inserts"]
+        )
+        statsd.Counter.return_value.increment.assert_called_once_with("events.dropped_rows", 2)
+
+    def test_forked_process_starts_with_its_own_rows(self, sync_insert: MagicMock) -> None:
+        inserter = self._inserter()
+        inserter.insert(["a", "$pageview"])
+        # As if the inserter had been inherited from a parent process
+        inserter.thread_pid = -1
+        inserter.insert(["b", "$pageview"])
+        inserter.flush()
+
+        sync_insert.assert_called_once_with("events", ["uuid", "event"], [["b"], ["$pageview"]])
@@ -1,14 +1,17 @@
 import json
 from typing import Any, Dict, List, Optional, Union
+from unittest.mock import MagicMock, patch
 from uuid import UUID
 
 from dateutil import parser
+from django.utils import timezone
 
 from ee.clickhouse.client import sync_execute
 from ee.clickhouse.models.element import chain_to_elements
-from ee.clickhouse.process_event import process_event_ee
+from ee.clickhouse.process_event import process_event_ee, process_events_ee
 from ee.clickhouse.sql.session_recording_events import SESSION_RECORDING_EVENTS_TABLE
 from ee.clickhouse.util import ClickhouseTestMixin
+from posthog.api.test.base import BaseTest
 from posthog.models.element import Element
 from posthog.models.event import Event
 from posthog.models.session_recording_event import SessionRecordingEvent
@@ -58,3 +61,30 @@ class ClickhouseProcessEvent(
     test_process_event_factory(_process_event_ee, _get_events, get_session_recording_events, get_elements),  # type: ignore
 ):
     pass
+
+
+class TestProcessEventsEE(ClickhouseTestMixin, BaseTest):
+    @patch("ee.clickhouse.models.event.ClickhouseProducer")
+    def test_events_of_a_request_are_produced_together(self, patch_producer: MagicMock) -> None:
+        process_events_ee(
+            ip="127.0.0.1",
+            site_url="http://localhost",
+            events=[
+                ("a", {"event": "beep", "properties": {}}),
+                ("b", {"event": "boop", "properties": {}}),
+                ("a", {"event": "bop", "properties": {}}),
+            ],
+            team_id=self.team.pk,
+            now=timezone.now(),
+            sent_at=None,
+        )
+
+        patch_producer.return_value.produce_proto.assert_not_called()
+        # One batch per user, keyed like single events
+        self.assertEqual(
+            [
+                (call[1]["key"], [pb_event.event for pb_event in call[1]["data"]])
+                for call in patch_producer.return_value.produce_proto_batch.call_args_list
+            ],
+            [("{}:a".format(self.team.pk), ["beep", "bop"]), ("{}:b".format(self.team.pk), ["boop"])],
+        )
@@ -4,11 +4,18 @@ from clickhouse_driver.errors import ServerException
 from django.db import DEFAULT_DB_ALIAS
 
 from ee.clickhouse.client import sync_execute
+from ee.clickhouse.sql.actions import (
+    ACTION_EVENTS_TABLE_SQL,
+    DROP_ACTION_EVENTS_TABLE_SQL,
+    EVENTS_INGESTED_AT_INDEX_SQL,
+)
 from ee.clickhouse.sql.events import (
     DROP_EVENTS_TABLE_SQL,
     DROP_EVENTS_WITH_ARRAY_PROPS_TABLE_SQL,
     DROP_MAT_EVENTS_PROP_TABLE_SQL,
     DROP_MAT_EVENTS_WITH_ARRAY_PROPS_TABLE_SQL,
+    EVENTS_ELEMENTS_COLUMNS_SQL,
+    EVENTS_ELEMENTS_INDEXES_SQL,
     EVENTS_TABLE_SQL,
     EVENTS_WITH_PROPS_TABLE_SQL,
     MAT_EVENT_PROP_TABLE_SQL,
@@ -32,10 +39,12 @@ class ClickhouseTestMixin:
             self._destroy_event_tables()
             self._destroy_person_tables()
             self._destroy_session_recording_tables()
+            self._destroy_action_events_tables()
 
             self._create_event_tables()
             self._create_person_tables()
             self._create_session_recording_tables()
+            self._create_action_events_tables()
         except ServerException as e:
             print(e)
             pass
@@ -54,6 +63,12 @@ class ClickhouseTestMixin:
     def _create_session_recording_tables(self):
         sync_execute(SESSION_RECORDING_EVENTS_TABLE_SQL)
 
+    def _destroy_action_events_tables(self):
+        sync_execute(DROP_ACTION_EVENTS_TABLE_SQL)
+
+    def _create_action_events_tables(self):
+        sync_execute(ACTION_EVENTS_TABLE_SQL)
+
     def _destroy_event_tables(self):
         sync_execute(DROP_EVENTS_TABLE_SQL)
         sync_execute(DROP_EVENTS_WITH_ARRAY_PROPS_TABLE_SQL)
@@ -62,6 +77,9 @@ class ClickhouseTestMixin:
 
     def _create_event_tables(self):
         sync_execute(EVENTS_TABLE_SQL)
+        sync_execute(EVENTS_INGESTED_AT_INDEX_SQL)
+        sync_execute(EVENTS_ELEMENTS_COLUMNS_SQL)
+        sync_execute(EVENTS_ELEMENTS_INDEXES_SQL)
         sync_execute(EVENTS_WITH_PROPS_TABLE_SQL)
         sync_execute(MAT_EVENTS_WITH_PROPS_TABLE_SQL)
         sync_execute(MAT_EVENT_PROP_TABLE_SQL)
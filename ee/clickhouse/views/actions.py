@@ -17,6 +17,7 @@ from ee.clickhouse.models.property import parse_prop_clauses
 from ee.clickhouse.queries.util import parse_timestamps
 from ee.clickhouse.sql.person import GET_LATEST_PERSON_SQL, PEOPLE_SQL, PEOPLE_THROUGH_DISTINCT_SQL, PERSON_TREND_SQL
 from ee.clickhouse.sql.stickiness.stickiness_people import STICKINESS_PEOPLE_SQL
+from ee.tasks.calculate_action_events import calculate_action_events
 from posthog.api.action import ActionSerializer, ActionViewSet
 from posthog.constants import TREND_FILTER_TYPE_ACTIONS
 from posthog.models.action import Action
@@ -48,9 +49,11 @@ class ClickhouseActionSerializer(ActionSerializer):
 class ClickhouseActions(ActionViewSet):
     serializer_class = ClickhouseActionSerializer
 
-    # Don't calculate actions in Clickhouse as it's on the fly
+    # Events are matched on the fly until the stored matches have been recalculated
     def _calculate_action(self, action: Action) -> None:
-        pass
+        Action.objects.filter(pk=action.pk).update(events_calculated_until=None, updated_at=timezone.now())
+        action.events_calculated_until = None
+        calculate_action_events.delay(action_id=action.pk)
 
     def list(self, request: Request, *args: Any, **kwargs: Any) -> Response:
         actions = self.get_queryset()
@@ -110,11 +113,11 @@ class ClickhouseActions(ActionViewSet):
             }
         )
 
-    def _format_entity_filter(self, entity: Entity) -> Tuple[str, Dict]:
+    def _format_entity_filter(self, entity: Entity, date_filter: str = "") -> Tuple[str, Dict]:
         if entity.type == TREND_FILTER_TYPE_ACTIONS:
             try:
                 action = Action.objects.get(pk=entity.id)
-                action_query, params = format_action_filter(action)
+                action_query, params = format_action_filter(action, date_filter=date_filter)
                 entity_filter = "AND {}".format(action_query)
 
             except Action.DoesNotExist:
@@ -128,7 +131,9 @@ class ClickhouseActions(ActionViewSet):
     def _calculate_stickiness_entity_people(self, team: Team, entity: Entity, filter: Filter, stickiness_day: int):
         parsed_date_from, parsed_date_to = parse_timestamps(filter=filter)
         prop_filters, prop_filter_params = parse_prop_clauses(filter.properties, team.pk)
-        entity_sql, entity_params = self._format_entity_filter(entity=entity)
+        entity_sql, entity_params = self._format_entity_filter(
+            entity=entity, date_filter=parsed_date_from + parsed_date_to
+        )
 
         params: Dict = {
             "team_id": team.pk,
@@ -157,7 +162,9 @@ class ClickhouseActions(ActionViewSet):
 
     def _calculate_entity_people(self, team: Team, entity: Entity, filter: Filter):
         parsed_date_from, parsed_date_to = parse_timestamps(filter=filter)
-        entity_sql, entity_params = self._format_entity_filter(entity=entity)
+        entity_sql, entity_params = self._format_entity_filter(
+            entity=entity, date_filter=parsed_date_from + parsed_date_to
+        )
         person_filter = ""
         person_filter_params: Dict[str, Any] = {}
 
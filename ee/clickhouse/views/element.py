@@ -2,11 +2,11 @@ from rest_framework import authentication, request, response, serializers, views
 from rest_framework.decorators import action
 
 from ee.clickhouse.client import sync_execute
-from ee.clickhouse.models.element import chain_to_elements
+from ee.clickhouse.models.element import parse_chain
 from ee.clickhouse.models.property import parse_prop_clauses
 from ee.clickhouse.queries.util import parse_timestamps
 from ee.clickhouse.sql.element import GET_ELEMENTS, GET_VALUES
-from posthog.api.element import ElementSerializer, ElementViewSet
+from posthog.api.element import ElementViewSet
 from posthog.models.filter import Filter
 
 
@@ -27,7 +27,7 @@ class ClickhouseElement(ElementViewSet):
                 {
                     "count": elements[1],
                     "hash": None,
-                    "elements": [ElementSerializer(element).data for element in chain_to_elements(elements[0])],
+                    "elements": [element.to_dict() for element in parse_chain(elements[0])],
                 }
                 for elements in result
             ]
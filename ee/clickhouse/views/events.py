@@ -106,9 +106,4 @@ class ClickhouseEvents(EventViewSet):
     # ******************************************
     @action(methods=["GET"], detail=False)
     def session_recording(self, request: Request, *args: Any, **kwargs: Any) -> Response:
-        team = self.request.user.team
-        snapshots = SessionRecording().run(
-            team=team, filter=Filter(request=request), session_recording_id=request.GET.get("session_recording_id")
-        )
-
-        return Response({"result": snapshots})
+        return self._session_recording_page(request, SessionRecording())
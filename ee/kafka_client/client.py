@@ -1,15 +1,31 @@
+import atexit
 import io
 import json
-from typing import Any, Callable, Dict, Optional
+from typing import Any, Callable, Dict, List, Optional
 
 import kafka_helper
+import statsd
+from celery.signals import worker_process_shutdown
 from google.protobuf.internal.encoder import _VarintBytes  # type: ignore
 from google.protobuf.json_format import MessageToJson
 from kafka import KafkaProducer as KP
+from kafka.future import Future
+from sentry_sdk import capture_exception
 
+from ee.clickhouse.bulk_insert import BULK_INSERTERS
 from ee.clickhouse.client import async_execute, sync_execute
 from ee.settings import KAFKA_ENABLED
-from posthog.settings import IS_HEROKU, KAFKA_HOSTS, TEST
+from posthog.settings import (
+    CLICKHOUSE_BULK_INSERT,
+    IS_HEROKU,
+    KAFKA_HOSTS,
+    KAFKA_PRODUCER_BATCH_SIZE,
+    KAFKA_PRODUCER_COMPRESSION_TYPE,
+    KAFKA_PRODUCER_LINGER_MS,
+    STATSD_HOST,
+    STATSD_PREFIX,
+    TEST,
+)
 from posthog.utils import SingletonDecorator
 
 
@@ -17,8 +33,8 @@ class TestKafkaProducer:
     def __init__(self):
         pass
 
-    def send(self, topic: str, data: Any):
-        return
+    def send(self, topic: str, value: Any, key: Optional[bytes] = None) -> Future:
+        return Future().success(None)
 
     def flush(self):
         return
@@ -26,23 +42,58 @@ class TestKafkaProducer:
 
 class _KafkaProducer:
     def __init__(self):
+        config = {
+            "linger_ms": KAFKA_PRODUCER_LINGER_MS,
+            "batch_size": KAFKA_PRODUCER_BATCH_SIZE,
+            "compression_type": KAFKA_PRODUCER_COMPRESSION_TYPE,
+        }
         if TEST:
             self.producer = TestKafkaProducer()
         elif not IS_HEROKU:
-            self.producer = KP(bootstrap_servers=KAFKA_HOSTS)
+            self.producer = KP(bootstrap_servers=KAFKA_HOSTS, **config)
         else:
-            self.producer = kafka_helper.get_kafka_producer(value_serializer=lambda d: d)
+            self.producer = KP(
+                bootstrap_servers=kafka_helper.get_kafka_brokers(),
+                security_protocol="SSL",
+                ssl_context=kafka_helper.get_kafka_ssl_context(),
+                acks="all",
+                **config,
+            )
+        self.delivery_counter = (
+            statsd.Counter("%s_posthog_cloud_kafka" % (STATSD_PREFIX,)) if STATSD_HOST is not None else None
+        )
+
+        # Messages are sent in the background, so flush whatever is still buffered before the process exits.
+        # Celery's prefork children exit without running atexit handlers.
+        atexit.register(self.close)
+        worker_process_shutdown.connect(self._on_worker_shutdown, weak=False)
+
+    def _on_worker_shutdown(self, **kwargs) -> None:
+        self.close()
+
+    def _on_delivery_success(self, topic: str, record_metadata: Any) -> None:
+        if self.delivery_counter:
+            self.delivery_counter.increment("{}.delivered".format(topic))
+
+    def _on_delivery_error(self, topic: str, exception: Exception) -> None:
+        if self.delivery_counter:
+            self.delivery_counter.increment("{}.failed".format(topic))
+        capture_exception(exception)
 
     @staticmethod
     def json_serializer(d):
         b = json.dumps(d).encode("utf-8")
         return b
 
-    def produce(self, topic: str, data: Any, value_serializer: Optional[Callable[[Any], Any]] = None):
+    def produce(
+        self, topic: str, data: Any, value_serializer: Optional[Callable[[Any], Any]] = None, key: Optional[str] = None,
+    ):
         if not value_serializer:
             value_serializer = self.json_serializer
         b = value_serializer(data)
-        self.producer.send(topic, b)
+        future = self.producer.send(topic, value=b, key=key.encode("utf-8") if key is not None else None)
+        future.add_callback(self._on_delivery_success, topic)
+        future.add_errback(self._on_delivery_error, topic)
 
     def close(self):
         self.producer.flush()
@@ -50,6 +101,9 @@ class _KafkaProducer:
 
 KafkaProducer = SingletonDecorator(_KafkaProducer)
 
+# Stays below the 1MB default message size limit of both the producer and the brokers
+PROTO_BATCH_MAX_BYTES = 900 * 1024
+
 
 class ClickhouseProducer:
     def __init__(self):
@@ -67,9 +121,42 @@ class ClickhouseProducer:
         f.seek(0)
         return f.read()
 
-    def produce_proto(self, sql: str, topic: str, data: Any, sync: bool = True):
+    def produce_proto_batch(
+        self,
+        sql: str,
+        topic: str,
+        data: List[Any],
+        sync: bool = True,
+        key: Optional[str] = None,
+        max_message_bytes: int = PROTO_BATCH_MAX_BYTES,
+    ):
+        """
+        Packs many length-delimited protobuf messages into each Kafka message.
+        ClickHouse's Protobuf format reads every one of them as a row.
+        """
+        if not self.send_to_kafka:
+            for message in data:
+                self.produce_proto(sql=sql, topic=topic, data=message, sync=sync)
+            return
+
+        batch: List[bytes] = []
+        batch_bytes = 0
+        for message in data:
+            serialized = self.proto_length_serializer(message)
+            if batch and batch_bytes + len(serialized) > max_message_bytes:
+                self.producer.produce(topic=topic, data=b"".join(batch), value_serializer=lambda d: d, key=key)
+                batch, batch_bytes = [], 0
+            batch.append(serialized)
+            batch_bytes += len(serialized)
+        if batch:
+            self.producer.produce(topic=topic, data=b"".join(batch), value_serializer=lambda d: d, key=key)
+
+    def produce_proto(self, sql: str, topic: str, data: Any, sync: bool = True, key: Optional[str] = None):
         if self.send_to_kafka:
-            self.producer.produce(topic=topic, data=data, value_serializer=self.proto_length_serializer)
+            self.producer.produce(topic=topic, data=data, value_serializer=self.proto_length_serializer, key=key)
+        elif CLICKHOUSE_BULK_INSERT and topic in BULK_INSERTERS:
+            bulk_inserter, to_row = BULK_INSERTERS[topic]
+            bulk_inserter.insert(to_row(data))
         else:
             dict_data = json.loads(
                 MessageToJson(data, including_default_value_fields=True, preserving_proto_field_name=True)
@@ -79,9 +166,12 @@ class ClickhouseProducer:
             else:
                 async_execute(sql, dict_data)
 
-    def produce(self, sql: str, topic: str, data: Dict[str, Any], sync: bool = True):
+    def produce(self, sql: str, topic: str, data: Dict[str, Any], sync: bool = True, key: Optional[str] = None):
         if self.send_to_kafka:
-            self.producer.produce(topic=topic, data=data)
+            self.producer.produce(topic=topic, data=data, key=key)
+        elif CLICKHOUSE_BULK_INSERT and topic in BULK_INSERTERS:
+            bulk_inserter, to_row = BULK_INSERTERS[topic]
+            bulk_inserter.insert(to_row(data))
         else:
             if sync:
                 sync_execute(sql, data)
@@ -4,3 +4,4 @@ KAFKA_PERSON_UNIQUE_ID = "clickhouse_person_unique_id"
 KAFKA_SESSION_RECORDING_EVENTS = "clickhouse_session_recording_events"
 
 KAFKA_EVENTS_WAL = "events_write_ahead_log"
+KAFKA_SESSION_RECORDING_EVENTS_WAL = "session_recording_events_write_ahead_log"
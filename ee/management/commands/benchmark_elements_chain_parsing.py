@@ -0,0 +1,107 @@
+import re
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ee.clickhouse.client import sync_execute
+from ee.clickhouse.models.element import parse_chain
+from posthog.api.element import ElementSerializer
+from posthog.models.element import Element
+from posthog.settings import CLICKHOUSE, PRIMARY_DB
+
+parse_attributes_regex = re.compile(r"(?P<attribute>(?P<key>.*?)\=\"(?P<value>.*?[^\\])\")", re.MULTILINE,)
+split_chain_regex = re.compile(r'(?:[^\s;"]|"(?:\\.|[^"])*")+')
+split_class_attributes = re.compile(r"(.*?)($|:([a-zA-Z\-\_0-9]*=.*))")
+
+GET_CHAINS_SQL = """
+SELECT elements_chain FROM events
+WHERE event = '$autocapture' AND elements_chain != '' {team_filter}
+ORDER BY timestamp DESC
+LIMIT %(limit)s
+"""
+
+
+def _old_chain_to_elements(chain: str) -> List[Element]:
+    # chain_to_elements as it was before chains were parsed without regexes
+    elements = []
+    for idx, el_string in enumerate(re.findall(split_chain_regex, chain)):
+        el_string_split = re.findall(split_class_attributes, el_string)[0]
+        attributes = re.finditer(parse_attributes_regex, el_string_split[2]) if len(el_string_split) > 2 else []
+
+        element = Element(order=idx)
+
+        if el_string_split[0]:
+            tag_and_class = el_string_split[0].split(".", 1)
+            element.tag_name = tag_and_class[0]
+            if len(tag_and_class) > 1:
+                element.attr_class = [cl for cl in tag_and_class[1].split(".") if cl != ""]
+
+        for ii in attributes:
+            item = ii.groupdict()
+            if item["key"] == "href":
+                element.href = item["value"]
+            elif item["key"] == "nth-child":
+                element.nth_child = int(item["value"])
+            elif item["key"] == "nth-of-type":
+                element.nth_of_type = int(item["value"])
+            elif item["key"] == "text":
+                element.text = item["value"]
+            elif item["key"] == "attr_id":
+                element.attr_id = item["value"]
+            elif item["key"]:
+                element.attributes[item["key"]] = item["value"]
+
+        elements.append(element)
+    return elements
+
+
+class Command(BaseCommand):
+    help = "Benchmark parsing and serializing the elements of autocapture events, with regexes and with parse_chain"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chains", type=int, default=10000, help="Number of recent chains to parse")
+        parser.add_argument("--team-id", type=int, default=None, help="Only use chains of this team")
+        parser.add_argument("--iterations", type=int, default=3, help="Runs per variant")
+
+    def handle(self, *args, **options):
+        if PRIMARY_DB != CLICKHOUSE:
+            raise CommandError("Chains are read from ClickHouse, which is not the primary database")
+
+        team_filter = "AND team_id = %(team_id)s" if options["team_id"] is not None else ""
+        chains = [
+            row[0]
+            for row in sync_execute(
+                GET_CHAINS_SQL.format(team_filter=team_filter),
+                {"limit": options["chains"], "team_id": options["team_id"]},
+            )
+        ]
+        if not chains:
+            raise CommandError("No autocapture events found")
+        print("{} chains, {} distinct".format(len(chains), len(set(chains))))
+
+        def old(chain: str) -> List[Dict[str, Any]]:
+            return ElementSerializer(_old_chain_to_elements(chain), many=True).data
+
+        def uncached(chain: str) -> List[Dict[str, Any]]:
+            return [element.to_dict() for element in parse_chain.__wrapped__(chain)]  # type: ignore
+
+        def cached(chain: str) -> List[Dict[str, Any]]:
+            return [element.to_dict() for element in parse_chain(chain)]
+
+        mismatches = sum(1 for chain in set(chains) if old(chain) != uncached(chain))
+        print("{} distinct chains parse differently".format(mismatches))
+
+        parse_chain.cache_clear()
+        variants: List[Tuple[str, Callable[[str], List[Dict[str, Any]]]]] = [
+            ("regexes", old),
+            ("parse_chain, uncached", uncached),
+            ("parse_chain", cached),
+        ]
+        for name, run in variants:
+            start = time.perf_counter()
+            for _ in range(options["iterations"]):
+                for chain in chains:
+                    run(chain)
+            elapsed = (time.perf_counter() - start) / (options["iterations"] * len(chains))
+            print("  {:<24} {:>8.2f}µs per chain".format(name, elapsed * 1000000))
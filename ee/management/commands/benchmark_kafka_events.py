@@ -0,0 +1,84 @@
+import json
+import time
+from typing import Any, List
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from ee.clickhouse.client import sync_execute
+from ee.clickhouse.sql.events import INSERT_EVENT_SQL
+from ee.idl.gen import events_pb2
+from ee.kafka_client.client import ClickhouseProducer, KafkaProducer
+from ee.kafka_client.topics import KAFKA_EVENTS
+from ee.settings import KAFKA_ENABLED
+from posthog.models.utils import UUIDT
+
+
+class Command(BaseCommand):
+    help = "Compare producing one event per Kafka message with batched protobuf messages through kafka_events"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--events", type=int, default=100000, help="Number of events to produce per run")
+        parser.add_argument("--batch-size", type=int, default=500, help="Events per Kafka message when batching")
+        parser.add_argument(
+            "--team-id", type=int, default=0, help="Team the events are created for, preferably one not in use"
+        )
+        parser.add_argument(
+            "--wait-for-clickhouse",
+            action="store_true",
+            help="Measure until ClickHouse has consumed all events, not just until Kafka has acknowledged them",
+        )
+
+    def handle(self, *args, **options):
+        if not KAFKA_ENABLED:
+            raise CommandError("Kafka is not enabled")
+
+        producer = ClickhouseProducer()
+        events, batch_size = options["events"], options["batch_size"]
+
+        def produce_single(messages: List[Any]) -> None:
+            for message in messages:
+                producer.produce_proto(sql=INSERT_EVENT_SQL, topic=KAFKA_EVENTS, data=message)
+
+        def produce_batched(messages: List[Any]) -> None:
+            for index in range(0, len(messages), batch_size):
+                producer.produce_proto_batch(
+                    sql=INSERT_EVENT_SQL, topic=KAFKA_EVENTS, data=messages[index : index + batch_size]
+                )
+
+        for name, produce in (("per-message", produce_single), ("batched", produce_batched)):
+            messages = [self._event(options["team_id"], index) for index in range(events)]
+            count_before = self._count(options["team_id"]) if options["wait_for_clickhouse"] else 0
+
+            start = time.monotonic()
+            produce(messages)
+            KafkaProducer().close()
+            produced = time.monotonic() - start
+            if options["wait_for_clickhouse"]:
+                while self._count(options["team_id"]) < count_before + events:
+                    time.sleep(0.1)
+            elapsed = time.monotonic() - start
+
+            print(
+                "{}: {} events in {:.2f}s ({:.0f} events/s), produced in {:.2f}s".format(
+                    name, events, elapsed, events / elapsed, produced
+                )
+            )
+
+    @staticmethod
+    def _event(team_id: int, index: int) -> Any:
+        timestamp = timezone.now().strftime("%Y-%m-%d %H:%M:%S.%f")
+        pb_event = events_pb2.Event()
+        pb_event.uuid = str(UUIDT())
+        pb_event.event = "$pageview"
+        pb_event.properties = json.dumps({"$current_url": "https://posthog.com/benchmark/{}".format(index % 100)})
+        pb_event.timestamp = timestamp
+        pb_event.team_id = team_id
+        pb_event.distinct_id = "benchmark_{}".format(index % 1000)
+        pb_event.elements_chain = ""
+        pb_event.created_at = timestamp
+        return pb_event
+
+    @staticmethod
+    def _count(team_id: int) -> int:
+        return sync_execute("SELECT count(1) FROM events WHERE team_id = %(team_id)s", {"team_id": team_id})[0][0]
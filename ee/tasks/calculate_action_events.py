@@ -0,0 +1,27 @@
+from datetime import timedelta
+
+from celery import shared_task
+from django.db.models import Q
+from django.utils import timezone
+
+from ee.clickhouse.models.action import update_action_events
+from posthog.celery import CLICKHOUSE_ACTION_EVENTS_INTERVAL_SECONDS
+from posthog.models import Action
+
+# A calculation of all events running for longer than this is assumed to have died
+MAX_CALCULATION_SECONDS = 60 * 60
+
+
+def calculate_action_events_scheduler() -> None:
+    actions = Action.objects.filter(deleted=False).filter(
+        Q(is_calculating=False) | Q(last_calculated_at__lt=timezone.now() - timedelta(seconds=MAX_CALCULATION_SECONDS))
+    )
+    for action_id in actions.values_list("pk", flat=True):
+        calculate_action_events.apply_async(
+            kwargs={"action_id": action_id}, expires=CLICKHOUSE_ACTION_EVENTS_INTERVAL_SECONDS
+        )
+
+
+@shared_task(ignore_result=True)
+def calculate_action_events(action_id: int) -> None:
+    update_action_events(Action.objects.get(pk=action_id))
@@ -7,13 +7,15 @@ import { sessionsTableLogic } from 'scenes/sessions/sessionsTableLogic'
 
 export default function SessionsPlayer({ events }: { events: eventWithTime[] }): JSX.Element {
     const target = useRef<HTMLDivElement | null>(null)
+    const player = useRef<rrwebPlayer | null>(null)
+    const addedEventsCount = useRef(0)
 
     const { sessionsPlayerSpeed } = useValues(sessionsTableLogic)
     const { setPlayerSpeed } = useActions(sessionsTableLogic)
 
     useEffect(() => {
         if (target.current && events) {
-            const player = new rrwebPlayer({
+            const newPlayer = new rrwebPlayer({
                 target: target.current,
                 // eslint-disable-next-line
                 // @ts-ignore
@@ -23,15 +25,26 @@ export default function SessionsPlayer({ events }: { events: eventWithTime[] }):
                     autoPlay: true,
                 },
             })
-            player.setSpeed(sessionsPlayerSpeed)
+            newPlayer.setSpeed(sessionsPlayerSpeed)
 
-            player.getReplayer().on('state-change', () => {
-                setPlayerSpeed(player.getReplayer().config.speed)
+            newPlayer.getReplayer().on('state-change', () => {
+                setPlayerSpeed(newPlayer.getReplayer().config.speed)
             })
+            player.current = newPlayer
+            addedEventsCount.current = events.length
 
-            return () => player.pause()
+            return () => newPlayer.pause()
         }
     }, [])
 
+    useEffect(() => {
+        // Later pages of long recordings are added to the replay as they load
+        if (player.current && events && events.length > addedEventsCount.current) {
+            const replayer = player.current.getReplayer()
+            events.slice(addedEventsCount.current).forEach((event) => replayer.addEvent(event))
+            addedEventsCount.current = events.length
+        }
+    }, [events])
+
     return <div ref={target} id="sessions-player" className="ph-no-capture" />
 }
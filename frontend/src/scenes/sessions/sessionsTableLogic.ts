@@ -66,6 +66,8 @@ export const sessionsTableLogic = kea<
             loadSessionPlayer: async (sessionRecordingId: SessionRecordingId): Promise<eventWithTime[]> => {
                 const params = toParams({ session_recording_id: sessionRecordingId })
                 const response = await api.get(`api/event/session_recording?${params}`)
+                // Long recordings come in pages, the player starts with the first one while the rest load
+                actions.setSessionPlayerDataNext(response.next || null)
                 return response.result
             },
         },
@@ -78,6 +80,8 @@ export const sessionsTableLogic = kea<
         nextDay: true,
         setFilters: (properties: Array<PropertyFilter>, selectedDate: Moment | null) => ({ properties, selectedDate }),
         closeSessionPlayer: true,
+        setSessionPlayerDataNext: (next: string | null) => ({ next }),
+        appendSessionPlayerData: (snapshots: eventWithTime[]) => ({ snapshots }),
         setPlayerSpeed: (speed: number) => ({ speed }),
     }),
     reducers: {
@@ -110,6 +114,14 @@ export const sessionsTableLogic = kea<
         sessionPlayerData: [
             null as null | eventWithTime[],
             {
+                appendSessionPlayerData: (state, { snapshots }) => [...(state || []), ...snapshots],
+                closeSessionPlayer: () => null,
+            },
+        ],
+        sessionPlayerDataNext: [
+            null as string | null,
+            {
+                setSessionPlayerDataNext: (_, { next }) => next,
                 closeSessionPlayer: () => null,
             },
         ],
@@ -165,6 +177,19 @@ export const sessionsTableLogic = kea<
             }
             actions.appendNewSessions(response.result)
         },
+        loadSessionPlayerSuccess: async (_, breakpoint) => {
+            const { sessionRecordingId } = values
+            let next = values.sessionPlayerDataNext
+            while (next) {
+                const response = await api.get(next)
+                breakpoint()
+                if (values.sessionRecordingId !== sessionRecordingId) {
+                    return
+                }
+                actions.appendSessionPlayerData(response.result)
+                next = response.next
+            }
+        },
         setFilters: () => {
             actions.setNextOffset(null)
             actions.loadSessions(true)
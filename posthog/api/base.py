@@ -1,6 +1,38 @@
 from rest_framework.pagination import CursorPagination as RestCursorPagination
+from rest_framework.renderers import JSONRenderer
+
+from posthog.json_codec import orjson
 
 
 class CursorPagination(RestCursorPagination):
     ordering = "-created_at"
     page_size = 100
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer that encodes with orjson when it's installed. Datetimes, decimals, lazy strings and the rest are
+    still handed to DRF's encoder, so responses look exactly like the stock renderer's.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        if (
+            orjson is None
+            or self.ensure_ascii
+            or not self.compact
+            or self.get_indent(accepted_media_type, renderer_context or {}) is not None
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(
+                data,
+                default=self.encoder_class().default,
+                option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME,
+            )
+        except TypeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # Same as DRF, keep the output a strict javascript subset
+        return ret.replace("\u2028".encode(), b"\\u2028").replace("\u2029".encode(), b"\\u2029")
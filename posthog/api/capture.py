@@ -1,22 +1,24 @@
 import re
 from datetime import datetime
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 import statsd
-from dateutil import parser
 from django.conf import settings
 from django.http import JsonResponse
 from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
 
+from posthog import capture_spool
 from posthog.auth import PersonalAPIKeyAuthentication
 from posthog.celery import app as celery_app
 from posthog.ee import is_ee_enabled
+from posthog.helpers.session_recording import compress_and_chunk_snapshots
 from posthog.models import Team
-from posthog.utils import cors_response, get_ip_address, load_data_from_request
+from posthog.utils import RequestParsingError, cors_response, get_ip_address, load_data_from_request, parse_iso_datetime
 
 if settings.EE_AVAILABLE:
-    from ee.clickhouse.process_event import log_event, process_event_ee
+    from ee.clickhouse.process_event import log_event, process_events_ee, process_session_recording_events_ee
+    from ee.kafka_client.topics import KAFKA_SESSION_RECORDING_EVENTS_WAL
 
 
 def _datetime_from_seconds_or_millis(timestamp: str) -> datetime:
@@ -41,7 +43,7 @@ def _get_sent_at(data, request) -> Optional[datetime]:
     if re.match(r"^[0-9]+$", sent_at):
         return _datetime_from_seconds_or_millis(sent_at)
 
-    return parser.isoparse(sent_at)
+    return parse_iso_datetime(sent_at)
 
 
 def _get_token(data, request) -> Optional[str]:
@@ -58,6 +60,13 @@ def _get_token(data, request) -> Optional[str]:
     return None
 
 
+def _send_task(name: str, queue: str, args: List[Any]) -> None:
+    if settings.CAPTURE_SPOOL_DIR:
+        capture_spool.send_or_spool(name=name, queue=queue, args=args)
+    else:
+        celery_app.send_task(name=name, queue=queue, args=args)
+
+
 def _get_distinct_id(data: Dict[str, Any]) -> str:
     try:
         return str(data["$distinct_id"])[0:200]
@@ -76,6 +85,8 @@ def get_event(request):
     try:
         data_from_request = load_data_from_request(request)
         data = data_from_request["data"]
+    except RequestParsingError as e:
+        return cors_response(request, JsonResponse({"code": "validation", "message": str(e)}, status=400),)
     except TypeError:
         return cors_response(
             request,
@@ -141,6 +152,10 @@ def get_event(request):
     else:
         events = [data]
 
+    # Validate the whole payload before enqueueing anything, so a bad event in a batch doesn't leave the earlier
+    # events half-ingested
+    validated_events: List[Tuple[str, Dict[str, Any]]] = []
+    snapshot_events: List[Tuple[str, Dict[str, Any]]] = []
     for event in events:
         try:
             distinct_id = _get_distinct_id(event)
@@ -164,48 +179,78 @@ def get_event(request):
                     status=400,
                 ),
             )
+        if event["event"] == "$snapshot":
+            snapshot_events.append((distinct_id, event))
+        else:
+            validated_events.append((distinct_id, event))
+
+    ip = get_ip_address(request)
+    site_url = request.build_absolute_uri("/")[:-1]
+
+    # Session recordings need no person processing, so they skip the regular pipeline and queue. Teams using plugins
+    # still get them through the plugin server, like any other event.
+    snapshot_events = compress_and_chunk_snapshots(snapshot_events)
+    if is_ee_enabled():
+        if snapshot_events:
+            process_session_recording_events_ee(team_id=team.id, events=snapshot_events, now=now, sent_at=sent_at)
+    elif team.plugins_opt_in:
+        validated_events = snapshot_events + validated_events
+    elif snapshot_events:
+        _send_task(
+            name="posthog.tasks.process_event.process_session_recording_events",
+            queue=settings.SESSION_RECORDING_CELERY_QUEUE,
+            args=[team.id, snapshot_events, now.isoformat(), sent_at,],
+        )
+
+    if is_ee_enabled():
+        if validated_events:
+            process_events_ee(
+                ip=ip, site_url=site_url, events=validated_events, team_id=team.id, now=now, sent_at=sent_at,
+            )
+    elif team.plugins_opt_in:
+        # The plugin server consumes single events only
+        for distinct_id, event in validated_events:
+            _send_task(
+                name="posthog.tasks.process_event.process_event_with_plugins",
+                queue=settings.PLUGINS_CELERY_QUEUE,
+                args=[distinct_id, ip, site_url, event, team.id, now.isoformat(), sent_at,],
+            )
+    elif len(validated_events) == 1:
+        distinct_id, event = validated_events[0]
+        _send_task(
+            name="posthog.tasks.process_event.process_event",
+            queue=settings.CELERY_DEFAULT_QUEUE,
+            args=[distinct_id, ip, site_url, event, team.id, now.isoformat(), sent_at,],
+        )
+    elif validated_events:
+        _send_task(
+            name="posthog.tasks.process_event.process_event_batch",
+            queue=settings.CELERY_DEFAULT_QUEUE,
+            args=[ip, site_url, validated_events, team.id, now.isoformat(), sent_at,],
+        )
 
-        if is_ee_enabled():
-            process_event_ee(
+    if is_ee_enabled() and settings.LOG_TO_WAL:
+        for distinct_id, event in validated_events:
+            # log the event to kafka write ahead log for processing
+            log_event(
                 distinct_id=distinct_id,
-                ip=get_ip_address(request),
-                site_url=request.build_absolute_uri("/")[:-1],
+                ip=ip,
+                site_url=site_url,
                 data=event,
                 team_id=team.id,
                 now=now,
                 sent_at=sent_at,
             )
-        else:
-            task_name = "posthog.tasks.process_event.process_event"
-            celery_queue = settings.CELERY_DEFAULT_QUEUE
-            if team.plugins_opt_in:
-                task_name += "_with_plugins"
-                celery_queue = settings.PLUGINS_CELERY_QUEUE
-
-            celery_app.send_task(
-                name=task_name,
-                queue=celery_queue,
-                args=[
-                    distinct_id,
-                    get_ip_address(request),
-                    request.build_absolute_uri("/")[:-1],
-                    event,
-                    team.id,
-                    now.isoformat(),
-                    sent_at,
-                ],
-            )
-
-        if is_ee_enabled() and settings.LOG_TO_WAL:
-            # log the event to kafka write ahead log for processing
+        for distinct_id, event in snapshot_events:
             log_event(
                 distinct_id=distinct_id,
-                ip=get_ip_address(request),
-                site_url=request.build_absolute_uri("/")[:-1],
+                ip=ip,
+                site_url=site_url,
                 data=event,
                 team_id=team.id,
                 now=now,
                 sent_at=sent_at,
+                topic=KAFKA_SESSION_RECORDING_EVENTS_WAL,
             )
     timer.stop("event_endpoint")
     return cors_response(request, JsonResponse({"status": 1}))
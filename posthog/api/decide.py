@@ -8,8 +8,9 @@ from django.http import HttpRequest, JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 
 from posthog.auth import PersonalAPIKeyAuthentication
+from posthog.compression import SUPPORTED_COMPRESSION
 from posthog.models import FeatureFlag, Team
-from posthog.utils import base64_to_json, cors_response, load_data_from_request
+from posthog.utils import RequestParsingError, base64_to_json, cors_response, load_data_from_request
 
 
 def _get_token(data, request):
@@ -95,7 +96,7 @@ def get_decide(request: HttpRequest):
         "config": {"enable_collect_everything": True},
         "editorParams": {},
         "isAuthenticated": False,
-        "supportedCompression": ["gzip", "lz64"],
+        "supportedCompression": SUPPORTED_COMPRESSION,
     }
 
     if request.COOKIES.get(settings.TOOLBAR_COOKIE_NAME):
@@ -116,7 +117,7 @@ def get_decide(request: HttpRequest):
     if request.method == "POST":
         try:
             data_from_request = load_data_from_request(request)
-        except (json.decoder.JSONDecodeError, TypeError):
+        except (json.decoder.JSONDecodeError, TypeError, RequestParsingError):
             return cors_response(
                 request,
                 JsonResponse(
@@ -22,7 +22,9 @@ from posthog.models import (
 )
 from posthog.queries.session_recording import SessionRecording
 from posthog.queries.sessions import Sessions
-from posthog.utils import convert_property_value
+from posthog.utils import convert_property_value, parse_iso_datetime
+
+SESSION_RECORDING_PAGE_SIZE = 1000
 
 
 class ElementSerializer(serializers.ModelSerializer):
@@ -273,12 +275,30 @@ class EventViewSet(viewsets.ModelViewSet):
     # /event/session_recording
     # params:
     # - session_recording_id: (string) id of the session recording
+    # - limit: (int) max number of snapshot rows per page, at most SESSION_RECORDING_PAGE_SIZE
+    # - after: (string) timestamp to continue from, as returned in "next"
     # ******************************************
     @action(methods=["GET"], detail=False)
     def session_recording(self, request: request.Request, *args: Any, **kwargs: Any) -> response.Response:
+        return self._session_recording_page(request, SessionRecording())
+
+    def _session_recording_page(
+        self, request: request.Request, session_recording: SessionRecording
+    ) -> response.Response:
         team = self.request.user.team
-        snapshots = SessionRecording().run(
-            team=team, filter=Filter(request=request), session_recording_id=request.GET.get("session_recording_id")
+        try:
+            limit = min(int(request.GET.get("limit", SESSION_RECORDING_PAGE_SIZE)), SESSION_RECORDING_PAGE_SIZE)
+            after = parse_iso_datetime(request.GET["after"]) if request.GET.get("after") else None
+        except ValueError:
+            raise exceptions.ValidationError("Invalid limit or after")
+
+        snapshots, next_after = session_recording.run_page(
+            team, request.GET.get("session_recording_id", ""), after=after, limit=max(limit, 1)
         )
 
-        return response.Response({"result": snapshots})
+        next_url: Optional[str] = None
+        if next_after is not None:
+            params = request.GET.copy()
+            params["after"] = next_after.isoformat()
+            next_url = request.build_absolute_uri("{}?{}".format(request.path, params.urlencode()))
+        return response.Response({"next": next_url, "result": snapshots})
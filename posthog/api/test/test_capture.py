@@ -6,7 +6,9 @@ from typing import Any
 from unittest.mock import patch
 from urllib.parse import quote
 
+import brotli
 import lzstring
+import zstandard
 from django.utils import timezone
 from freezegun import freeze_time
 
@@ -41,7 +43,7 @@ class TestCapture(BaseTest):
             "sent_at": sent_at,
         }
 
-    @patch("posthog.models.team.TEAM_CACHE", {})
+    @patch("posthog.models.team.TEAM_CACHE._entries", {})
     @patch("posthog.api.capture.celery_app.send_task")
     def test_capture_event(self, patch_process_event_with_plugins):
         data = {
@@ -78,7 +80,20 @@ class TestCapture(BaseTest):
             },
         )
 
-    @patch("posthog.models.team.TEAM_CACHE", {})
+    @patch("posthog.capture_spool._broker_unavailable_until", 0.0)
+    @patch("posthog.capture_spool.get_spool")
+    @patch("posthog.api.capture.celery_app.send_task", side_effect=ConnectionError())
+    def test_capture_event_spooled_when_broker_unavailable(self, patch_send_task, patch_get_spool):
+        data = {"event": "$pageview", "properties": {"distinct_id": 2, "token": self.team.api_token}}
+        with self.settings(CAPTURE_SPOOL_DIR="/tmp/capture-spool"):
+            response = self.client.get("/e/?data=%s" % quote(self._dict_to_json(data)))
+
+        self.assertEqual(response.status_code, 200)
+        spooled_task = patch_get_spool.return_value.append.call_args[0][0]
+        self.assertEqual(spooled_task["name"], "posthog.tasks.process_event.process_event")
+        self.assertEqual(spooled_task["args"][3], data)
+
+    @patch("posthog.models.team.TEAM_CACHE._entries", {})
     @patch("posthog.api.capture.celery_app.send_task")
     def test_personal_api_key(self, patch_process_event_with_plugins):
         key = PersonalAPIKey(label="X", user=self.user, team=self.team)
@@ -117,7 +132,7 @@ class TestCapture(BaseTest):
             },
         )
 
-    @patch("posthog.models.team.TEAM_CACHE", {})
+    @patch("posthog.models.team.TEAM_CACHE._entries", {})
     @patch("posthog.api.capture.celery_app.send_task")
     def test_multiple_events(self, patch_process_event_with_plugins):
         self.client.post(
@@ -132,9 +147,129 @@ class TestCapture(BaseTest):
                 "api_key": self.team.api_token,
             },
         )
+        self.assertEqual(patch_process_event_with_plugins.call_count, 1)
+        self.assertEqual(
+            patch_process_event_with_plugins.call_args[1]["name"], "posthog.tasks.process_event.process_event_batch"
+        )
+        ip, site_url, events, team_id, now, sent_at = patch_process_event_with_plugins.call_args[1]["args"]
+        self.assertEqual([distinct_id for distinct_id, _ in events], ["eeee", "aaaa"])
+        self.assertEqual([event["event"] for _, event in events], ["beep", "boop"])
+        self.assertEqual(team_id, self.team.pk)
+
+    @patch("posthog.models.team.TEAM_CACHE._entries", {})
+    @patch("posthog.api.capture.is_ee_enabled", return_value=True)
+    @patch("posthog.api.capture.process_events_ee")
+    def test_multiple_events_ee(self, patch_process_events_ee, patch_is_ee_enabled):
+        self.client.post(
+            "/track/",
+            data={
+                "data": json.dumps(
+                    [
+                        {"event": "beep", "properties": {"distinct_id": "eeee", "token": self.team.api_token,},},
+                        {"event": "boop", "properties": {"distinct_id": "aaaa", "token": self.team.api_token,},},
+                    ]
+                ),
+                "api_key": self.team.api_token,
+            },
+        )
+        self.assertEqual(patch_process_events_ee.call_count, 1)
+        events = patch_process_events_ee.call_args[1]["events"]
+        self.assertEqual(
+            [(distinct_id, event["event"]) for distinct_id, event in events], [("eeee", "beep"), ("aaaa", "boop")]
+        )
+        self.assertEqual(patch_process_events_ee.call_args[1]["team_id"], self.team.pk)
+
+    @patch("posthog.models.team.TEAM_CACHE._entries", {})
+    @patch("posthog.api.capture.celery_app.send_task")
+    def test_snapshot_events_use_their_own_queue(self, patch_process_event_with_plugins):
+        snapshot = {
+            "event": "$snapshot",
+            "properties": {
+                "distinct_id": "eeee",
+                "token": self.team.api_token,
+                "$session_id": "abc",
+                "$snapshot_data": {"timestamp": 123},
+            },
+        }
+        self.client.post(
+            "/s/",
+            data={
+                "data": json.dumps(
+                    [
+                        snapshot,
+                        snapshot,
+                        {"event": "beep", "properties": {"distinct_id": "eeee", "token": self.team.api_token}},
+                    ]
+                ),
+                "api_key": self.team.api_token,
+            },
+        )
+
         self.assertEqual(patch_process_event_with_plugins.call_count, 2)
+        snapshot_call, event_call = patch_process_event_with_plugins.call_args_list
+        self.assertEqual(snapshot_call[1]["name"], "posthog.tasks.process_event.process_session_recording_events")
+        self.assertEqual(snapshot_call[1]["queue"], "posthog-session-recordings")
+        team_id, events, now, sent_at = snapshot_call[1]["args"]
+        self.assertEqual(team_id, self.team.pk)
+        self.assertEqual(events, [("eeee", snapshot), ("eeee", snapshot)])
 
-    @patch("posthog.models.team.TEAM_CACHE", {})
+        self.assertEqual(event_call[1]["name"], "posthog.tasks.process_event.process_event")
+        self.assertEqual(event_call[1]["args"][3]["event"], "beep")
+
+    @patch("posthog.models.team.TEAM_CACHE._entries", {})
+    @patch("posthog.api.capture.celery_app.send_task")
+    def test_snapshot_events_with_plugins(self, patch_process_event_with_plugins):
+        self.team.plugins_opt_in = True
+        self.team.save()
+        snapshot = {
+            "event": "$snapshot",
+            "properties": {
+                "distinct_id": "eeee",
+                "token": self.team.api_token,
+                "$session_id": "abc",
+                "$snapshot_data": {"timestamp": 123},
+            },
+        }
+        self.client.post(
+            "/s/",
+            data={
+                "data": json.dumps(
+                    [snapshot, {"event": "beep", "properties": {"distinct_id": "eeee", "token": self.team.api_token}}]
+                ),
+                "api_key": self.team.api_token,
+            },
+        )
+
+        self.assertEqual(
+            [call[1]["name"] for call in patch_process_event_with_plugins.call_args_list],
+            ["posthog.tasks.process_event.process_event_with_plugins"] * 2,
+        )
+        self.assertEqual(
+            [call[1]["args"][3]["event"] for call in patch_process_event_with_plugins.call_args_list],
+            ["$snapshot", "beep"],
+        )
+
+    @patch("posthog.models.team.TEAM_CACHE._entries", {})
+    @patch("posthog.api.capture.is_ee_enabled", return_value=True)
+    @patch("posthog.api.capture.process_events_ee")
+    @patch("posthog.api.capture.process_session_recording_events_ee")
+    def test_no_snapshot_events_ee(
+        self, patch_process_session_recording_events_ee, patch_process_events_ee, patch_is_ee_enabled
+    ):
+        self.client.post(
+            "/track/",
+            data={
+                "data": json.dumps(
+                    {"event": "beep", "properties": {"distinct_id": "eeee", "token": self.team.api_token}}
+                ),
+                "api_key": self.team.api_token,
+            },
+        )
+
+        patch_process_session_recording_events_ee.assert_not_called()
+        self.assertEqual(patch_process_events_ee.call_count, 1)
+
+    @patch("posthog.models.team.TEAM_CACHE._entries", {})
     @patch("posthog.api.capture.celery_app.send_task")
     def test_emojis_in_text(self, patch_process_event_with_plugins):
         self.team.api_token = "xp9qT2VLY76JJg"
@@ -153,7 +288,7 @@ class TestCapture(BaseTest):
             "💻 Writing code",
         )
 
-    @patch("posthog.models.team.TEAM_CACHE", {})
+    @patch("posthog.models.team.TEAM_CACHE._entries", {})
     @patch("posthog.api.capture.celery_app.send_task")
     def test_incorrect_padding(self, patch_process_event_with_plugins):
         response = self.client.get(
@@ -164,7 +299,7 @@ class TestCapture(BaseTest):
         self.assertEqual(response.json()["status"], 1)
         self.assertEqual(patch_process_event_with_plugins.call_args[1]["args"][3]["event"], "whatevefr")
 
-    @patch("posthog.models.team.TEAM_CACHE", {})
+    @patch("posthog.models.team.TEAM_CACHE._entries", {})
     @patch("posthog.api.capture.celery_app.send_task")
     def test_empty_request_returns_an_error(self, patch_process_event_with_plugins):
         """
@@ -181,7 +316,7 @@ class TestCapture(BaseTest):
         self.assertEqual(response.status_code, 400)
         self.assertEqual(patch_process_event_with_plugins.call_count, 0)
 
-    @patch("posthog.models.team.TEAM_CACHE", {})
+    @patch("posthog.models.team.TEAM_CACHE._entries", {})
     @patch("posthog.api.capture.celery_app.send_task")
     def test_batch(self, patch_process_event_with_plugins):
         data = {"type": "capture", "event": "user signed up", "distinct_id": "2"}
@@ -202,7 +337,7 @@ class TestCapture(BaseTest):
             },
         )
 
-    @patch("posthog.models.team.TEAM_CACHE", {})
+    @patch("posthog.models.team.TEAM_CACHE._entries", {})
     @patch("posthog.api.capture.celery_app.send_task")
     def test_batch_gzip_header(self, patch_process_event_with_plugins):
         data = {
@@ -232,7 +367,7 @@ class TestCapture(BaseTest):
             },
         )
 
-    @patch("posthog.models.team.TEAM_CACHE", {})
+    @patch("posthog.models.team.TEAM_CACHE._entries", {})
     @patch("posthog.api.capture.celery_app.send_task")
     def test_batch_gzip_param(self, patch_process_event_with_plugins):
         data = {
@@ -261,7 +396,50 @@ class TestCapture(BaseTest):
             },
         )
 
-    @patch("posthog.models.team.TEAM_CACHE", {})
+    @patch("posthog.models.team.TEAM_CACHE._entries", {})
+    @patch("posthog.api.capture.celery_app.send_task")
+    def test_batch_zstd_and_brotli(self, patch_process_event_with_plugins):
+        data = {
+            "api_key": self.team.api_token,
+            "batch": [{"type": "capture", "event": "user signed up", "distinct_id": "2"}],
+        }
+
+        for compression, compress in (
+            ("zstd", zstandard.ZstdCompressor().compress),
+            ("br", brotli.compress),
+        ):
+            patch_process_event_with_plugins.reset_mock()
+            response = self.client.post(
+                "/batch/",
+                data=compress(json.dumps(data).encode()),
+                content_type="application/json",
+                HTTP_CONTENT_ENCODING=compression,
+            )
+
+            self.assertEqual(response.status_code, 200)
+            arguments = self._to_arguments(patch_process_event_with_plugins)
+            self.assertEqual(arguments["data"], data["batch"][0])
+
+    @patch("posthog.api.capture.celery_app.send_task")
+    def test_batch_gzip_too_large(self, patch_process_event_with_plugins):
+        data = {
+            "api_key": self.team.api_token,
+            "batch": [{"type": "capture", "event": "user signed up", "distinct_id": "2"}],
+        }
+
+        with self.settings(MAX_DECOMPRESSED_REQUEST_SIZE=50):
+            response = self.client.post(
+                "/batch/",
+                data=gzip.compress(json.dumps(data).encode()),
+                content_type="application/json",
+                HTTP_CONTENT_ENCODING="gzip",
+            )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["code"], "validation")
+        self.assertEqual(patch_process_event_with_plugins.call_count, 0)
+
+    @patch("posthog.models.team.TEAM_CACHE._entries", {})
     @patch("posthog.api.capture.celery_app.send_task")
     def test_batch_lzstring(self, patch_process_event_with_plugins):
         data = {
@@ -344,7 +522,47 @@ class TestCapture(BaseTest):
         self.assertEqual(response.status_code, 400)
         self.assertEqual(response.json()["message"], "You need to set user distinct ID field `distinct_id`.")
 
-    @patch("posthog.models.team.TEAM_CACHE", {})
+    @patch("posthog.api.capture.celery_app.send_task")
+    def test_batch_with_invalid_event_enqueues_nothing(self, patch_process_event_with_plugins):
+        response = self.client.post(
+            "/batch/",
+            data={
+                "api_key": self.team.api_token,
+                "batch": [
+                    {"type": "capture", "event": "user signed up", "distinct_id": "2"},
+                    {"type": "capture", "distinct_id": "2"},
+                ],
+            },
+            content_type="application/json",
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["message"], "You need to set event name field `event`.")
+        self.assertEqual(patch_process_event_with_plugins.call_count, 0)
+
+    @patch("posthog.api.capture.celery_app.send_task")
+    def test_batch_with_plugins_enqueues_single_events(self, patch_process_event_with_plugins):
+        self.team.plugins_opt_in = True
+        self.team.save()
+        self.client.post(
+            "/batch/",
+            data={
+                "api_key": self.team.api_token,
+                "batch": [
+                    {"type": "capture", "event": "user signed up", "distinct_id": "2"},
+                    {"type": "capture", "event": "user logged in", "distinct_id": "2"},
+                ],
+            },
+            content_type="application/json",
+        )
+
+        self.assertEqual(patch_process_event_with_plugins.call_count, 2)
+        self.assertEqual(
+            patch_process_event_with_plugins.call_args[1]["name"],
+            "posthog.tasks.process_event.process_event_with_plugins",
+        )
+
+    @patch("posthog.models.team.TEAM_CACHE._entries", {})
     @patch("posthog.api.capture.celery_app.send_task")
     def test_engage(self, patch_process_event_with_plugins):
         response = self.client.get(
@@ -373,7 +591,7 @@ class TestCapture(BaseTest):
             {"distinct_id": "3", "ip": "127.0.0.1", "site_url": "http://testserver", "team_id": self.team.pk,},
         )
 
-    @patch("posthog.models.team.TEAM_CACHE", {})
+    @patch("posthog.models.team.TEAM_CACHE._entries", {})
     @patch("posthog.api.capture.celery_app.send_task")
     def test_python_library(self, patch_process_event_with_plugins):
         self.client.post(
@@ -386,7 +604,7 @@ class TestCapture(BaseTest):
         arguments = self._to_arguments(patch_process_event_with_plugins)
         self.assertEqual(arguments["team_id"], self.team.pk)
 
-    @patch("posthog.models.team.TEAM_CACHE", {})
+    @patch("posthog.models.team.TEAM_CACHE._entries", {})
     @patch("posthog.api.capture.celery_app.send_task")
     def test_base64_decode_variations(self, patch_process_event_with_plugins):
         base64 = "eyJldmVudCI6IiRwYWdldmlldyIsInByb3BlcnRpZXMiOnsiZGlzdGluY3RfaWQiOiJlZWVlZWVlZ8+lZWVlZWUifX0="
@@ -412,7 +630,7 @@ class TestCapture(BaseTest):
         self.assertEqual(arguments["team_id"], self.team.pk)
         self.assertEqual(arguments["distinct_id"], "eeeeeeegϥeeeee")
 
-    @patch("posthog.models.team.TEAM_CACHE", {})
+    @patch("posthog.models.team.TEAM_CACHE._entries", {})
     @patch("posthog.api.capture.celery_app.send_task")
     def test_js_library_underscore_sent_at(self, patch_process_event_with_plugins):
         now = timezone.now()
@@ -442,7 +660,7 @@ class TestCapture(BaseTest):
         self.assertLess(abs(timediff), 1)
         self.assertEqual(arguments["data"]["timestamp"], tomorrow.isoformat())
 
-    @patch("posthog.models.team.TEAM_CACHE", {})
+    @patch("posthog.models.team.TEAM_CACHE._entries", {})
     @patch("posthog.api.capture.celery_app.send_task")
     def test_long_distinct_id(self, patch_process_event_with_plugins):
         now = timezone.now()
@@ -463,7 +681,7 @@ class TestCapture(BaseTest):
         arguments = self._to_arguments(patch_process_event_with_plugins)
         self.assertEqual(len(arguments["distinct_id"]), 200)
 
-    @patch("posthog.models.team.TEAM_CACHE", {})
+    @patch("posthog.models.team.TEAM_CACHE._entries", {})
     @patch("posthog.api.capture.celery_app.send_task")
     def test_sent_at_field(self, patch_process_event_with_plugins):
         now = timezone.now()
@@ -119,7 +119,7 @@ class TestDecide(BaseTest):
             response = self._post_decide()
         self.assertEqual(response["featureFlags"][0], "beta-feature")
 
-        with self.assertNumQueries(4):
+        with self.assertNumQueries(3):  # team is cached now
             response = self._post_decide({"token": self.team.api_token, "distinct_id": "another_id"})
         self.assertEqual(len(response["featureFlags"]), 0)
 
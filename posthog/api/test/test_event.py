@@ -4,7 +4,7 @@ from dateutil.relativedelta import relativedelta
 from django.utils import timezone
 from freezegun import freeze_time
 
-from posthog.models import Action, ActionStep, Element, Event, Person, Team
+from posthog.models import Action, ActionStep, Element, Event, Person, SessionRecordingEvent, Team
 
 from .base import BaseTest, TransactionBaseTest
 
@@ -253,4 +253,29 @@ def _create_action(**kwargs):
 
 
 class TestEvent(test_event_api_factory(Event.objects.create, Person.objects.create, _create_action)):  # type: ignore
-    pass
+    def test_session_recording_pages(self):
+        with freeze_time("2020-09-13T12:26:40.000Z"):
+            for seconds in range(5):
+                SessionRecordingEvent.objects.create(
+                    team=self.team,
+                    distinct_id="user",
+                    session_id="1",
+                    timestamp=timezone.now() + relativedelta(seconds=seconds),
+                    snapshot_data={"timestamp": seconds},
+                )
+
+            response = self.client.get("/api/event/session_recording/?session_recording_id=1&limit=2").json()
+            snapshots = response["result"]
+            while response["next"]:
+                response = self.client.get(response["next"]).json()
+                self.assertLessEqual(len(response["result"]), 2)
+                snapshots += response["result"]
+
+            self.assertEqual(snapshots, [{"timestamp": seconds} for seconds in range(5)])
+
+    def test_session_recording_without_limit(self):
+        SessionRecordingEvent.objects.create(
+            team=self.team, distinct_id="user", session_id="1", snapshot_data={"timestamp": 1},
+        )
+        response = self.client.get("/api/event/session_recording/?session_recording_id=1").json()
+        self.assertEqual(response, {"next": None, "result": [{"timestamp": 1}]})
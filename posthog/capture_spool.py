@@ -0,0 +1,264 @@
+"""
+Local disk spool for capture tasks, for when the Celery broker (Redis) is down or far behind.
+
+With CAPTURE_SPOOL_DIR set, capture appends its tasks to an append-only segment file of its own process instead of
+enqueueing them, whenever the broker failed recently or the queue is deeper than CAPTURE_SPOOL_MAX_QUEUE_DEPTH. That
+keeps capture latency flat during broker incidents, where requests would otherwise pile up waiting on Redis. A daemon
+thread in every web worker process, started along with it, closes segments and replays them in batches, oldest first,
+once the broker is healthy again. That includes segments left behind by processes that have exited.
+
+Replay is at least once: if a process dies while replaying a segment, the segment is replayed again from its start.
+"""
+import glob
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, BinaryIO, Callable, Dict, List, Optional
+
+import statsd
+from django.conf import settings
+
+from posthog import json_codec
+from posthog.celery import app as celery_app
+from posthog.utils import get_redis_queue_depth
+
+logger = logging.getLogger(__name__)
+
+# After a failed enqueue, tasks go straight to the spool for this long
+BROKER_RETRY_SECONDS = 5
+# Queue depth readings are reused for this long, to keep Redis round trips off most requests
+QUEUE_DEPTH_CACHE_SECONDS = 1
+DRAIN_INTERVAL_SECONDS = 5
+# Tasks replayed between broker health checks
+DRAIN_BATCH_SIZE = 500
+
+OPEN_SUFFIX = ".open"
+CLOSED_SUFFIX = ".spool"
+DRAINING_SUFFIX = ".draining"
+
+
+class CaptureSpool:
+    """
+    Segments are named `<time_ns>-<pid>.open` while written to, so they sort chronologically. Full or old enough
+    segments are closed by renaming them to `.spool`, and a drainer claims one by renaming it to `.<pid>.draining`.
+    Renames are atomic, so any number of processes can share a directory.
+    """
+
+    def __init__(self, directory: str, segment_bytes: int) -> None:
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self._lock = threading.Lock()
+        self._segment: Optional[BinaryIO] = None
+        self._segment_path: Optional[str] = None
+        self._segment_opened_at = 0.0
+
+    def append(self, task: Dict[str, Any]) -> None:
+        line = json_codec.dumps_bytes(task, default=_json_default) + b"\n"
+        with self._lock:
+            if self._segment is None:
+                self._open_segment()
+            assert self._segment is not None
+            self._segment.write(line)
+            # Hand it to the OS, so it survives the process dying. Not fsynced: that would cost more than
+            # waiting on the broker.
+            self._segment.flush()
+            if self._segment.tell() >= self.segment_bytes:
+                self._close_segment()
+
+    def rotate(self, min_age_seconds: float = 0) -> None:
+        """Closes the current segment if it was opened at least `min_age_seconds` ago, making it drainable"""
+        with self._lock:
+            if self._segment is not None and time.monotonic() - self._segment_opened_at >= min_age_seconds:
+                self._close_segment()
+
+    def drain(self, send: Callable[[Dict[str, Any]], None], should_continue: Callable[[], bool] = lambda: True) -> int:
+        """
+        Replays closed segments oldest first, checking `should_continue` every DRAIN_BATCH_SIZE tasks. Stops at the
+        first task `send` fails on, putting the rest of its segment back. Returns the number of tasks replayed.
+        """
+        self._recover_abandoned_segments()
+        replayed = 0
+        for path in sorted(glob.glob(os.path.join(self.directory, "*" + CLOSED_SUFFIX))):
+            claimed_path = "{}.{}{}".format(path[: -len(CLOSED_SUFFIX)], os.getpid(), DRAINING_SUFFIX)
+            try:
+                os.rename(path, claimed_path)
+            except FileNotFoundError:
+                continue  # claimed by another process
+            with open(claimed_path, "rb") as segment:
+                lines = segment.readlines()
+
+            for index, line in enumerate(lines):
+                if index > 0 and index % DRAIN_BATCH_SIZE == 0 and not should_continue():
+                    self._put_back(claimed_path, path, lines[index:])
+                    return replayed
+                try:
+                    task = json_codec.loads(line)
+                except json_codec.JSONDecodeError:
+                    # Only the last line of a segment can be cut short, by its process dying mid-write
+                    logger.warning("Skipping malformed task in capture spool segment %s", path)
+                    continue
+                try:
+                    send(task)
+                except Exception:
+                    logger.exception("Failed to replay capture spool segment %s", path)
+                    self._put_back(claimed_path, path, lines[index:])
+                    return replayed
+                replayed += 1
+            os.unlink(claimed_path)
+        return replayed
+
+    def _open_segment(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        name = "{:020d}-{}{}".format(time.time_ns(), os.getpid(), OPEN_SUFFIX)
+        self._segment_path = os.path.join(self.directory, name)
+        self._segment = open(self._segment_path, "ab")
+        self._segment_opened_at = time.monotonic()
+
+    def _close_segment(self) -> None:
+        assert self._segment is not None and self._segment_path is not None
+        self._segment.close()
+        os.rename(self._segment_path, self._segment_path[: -len(OPEN_SUFFIX)] + CLOSED_SUFFIX)
+        self._segment = None
+        self._segment_path = None
+
+    def _put_back(self, claimed_path: str, path: str, lines: List[bytes]) -> None:
+        temporary_path = claimed_path + ".tmp"
+        with open(temporary_path, "wb") as segment:
+            segment.writelines(lines)
+        os.rename(temporary_path, path)
+        os.unlink(claimed_path)
+
+    def _recover_abandoned_segments(self) -> None:
+        """Closes segments left open and releases segments left claimed, by processes that have since exited"""
+        with self._lock:
+            for path in glob.glob(os.path.join(self.directory, "*" + OPEN_SUFFIX)):
+                pid = int(os.path.basename(path)[: -len(OPEN_SUFFIX)].split("-")[1])
+                # Process ids get reused, e.g. after a container restart, so open segments other than ours
+                # are abandoned even if their process id is our own
+                if path != self._segment_path and (pid == os.getpid() or not _is_running(pid)):
+                    _rename_if_exists(path, path[: -len(OPEN_SUFFIX)] + CLOSED_SUFFIX)
+
+        for path in glob.glob(os.path.join(self.directory, "*" + DRAINING_SUFFIX)):
+            name, drainer_pid = path[: -len(DRAINING_SUFFIX)].rsplit(".", 1)
+            # Segments are drained by one thread per process, which isn't draining anything right now
+            if int(drainer_pid) == os.getpid() or not _is_running(int(drainer_pid)):
+                _rename_if_exists(path, name + CLOSED_SUFFIX)
+
+
+_spool: Optional[CaptureSpool] = None
+_spool_pid: Optional[int] = None
+_spool_lock = threading.Lock()
+_broker_unavailable_until = 0.0
+_queue_depth = 0
+_queue_depth_checked_at = float("-inf")
+_counter = statsd.Counter("%s_posthog_cloud" % (settings.STATSD_PREFIX,)) if settings.STATSD_HOST is not None else None
+
+
+def send_or_spool(name: str, queue: str, args: List[Any]) -> None:
+    """Sends a Celery task, or appends it to the spool if the broker is unavailable or too far behind"""
+    task = {"name": name, "queue": queue, "args": args}
+    if not _should_spool():
+        try:
+            send_task(task)
+            return
+        except Exception:
+            logger.exception("Failed to send capture task, spooling it")
+            _mark_broker_unavailable()
+
+    get_spool().append(task)
+    if _counter is not None:
+        _counter.increment("capture_spool.spooled")
+
+
+def get_spool() -> CaptureSpool:
+    """Spool of the current process, started along with its drainer on first use (and again after a fork)"""
+    global _spool, _spool_pid
+    with _spool_lock:
+        if _spool is None or _spool_pid != os.getpid():
+            assert settings.CAPTURE_SPOOL_DIR
+            _spool = CaptureSpool(settings.CAPTURE_SPOOL_DIR, settings.CAPTURE_SPOOL_SEGMENT_BYTES)
+            _spool_pid = os.getpid()
+            threading.Thread(target=_drain_forever, args=(_spool,), name="capture-spool-drainer", daemon=True).start()
+        return _spool
+
+
+def start_drainer() -> None:
+    """Starts the drainer ahead of the first spooled task, so leftover segments are replayed even if none ever is"""
+    get_spool()
+
+
+def drain_once(spool: CaptureSpool) -> int:
+    spool.rotate(min_age_seconds=DRAIN_INTERVAL_SECONDS)
+    if _should_spool():
+        return 0
+    replayed = spool.drain(_send_or_mark_unavailable, should_continue=lambda: not _should_spool())
+    if replayed and _counter is not None:
+        _counter.increment("capture_spool.replayed", replayed)
+    return replayed
+
+
+def _drain_forever(spool: CaptureSpool) -> None:
+    while True:
+        time.sleep(DRAIN_INTERVAL_SECONDS)
+        try:
+            drain_once(spool)
+        except Exception:
+            logger.exception("Failed to drain capture spool")
+
+
+def _should_spool() -> bool:
+    global _queue_depth, _queue_depth_checked_at
+    if time.monotonic() < _broker_unavailable_until:
+        return True
+    if time.monotonic() - _queue_depth_checked_at >= QUEUE_DEPTH_CACHE_SECONDS:
+        try:
+            _queue_depth = get_redis_queue_depth()
+        except Exception:
+            _mark_broker_unavailable()
+            return True
+        _queue_depth_checked_at = time.monotonic()
+    return _queue_depth > settings.CAPTURE_SPOOL_MAX_QUEUE_DEPTH
+
+
+def send_task(task: Dict[str, Any]) -> None:
+    # Fail fast rather than retrying the connection, the spool is the fallback
+    celery_app.send_task(name=task["name"], queue=task["queue"], args=task["args"], retry=False)
+
+
+def _send_or_mark_unavailable(task: Dict[str, Any]) -> None:
+    try:
+        send_task(task)
+    except Exception:
+        _mark_broker_unavailable()
+        raise
+
+
+def _mark_broker_unavailable() -> None:
+    global _broker_unavailable_until
+    _broker_unavailable_until = time.monotonic() + BROKER_RETRY_SECONDS
+
+
+def _json_default(obj: Any) -> Any:
+    # Tasks receive datetimes as ISO strings either way, Celery's JSON serializer does the same
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError("Object of type {} is not JSON serializable".format(type(obj).__name__))
+
+
+def _is_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _rename_if_exists(source: str, destination: str) -> None:
+    try:
+        os.rename(source, destination)
+    except FileNotFoundError:
+        pass
@@ -32,6 +32,12 @@ app.conf.broker_pool_limit = 0
 # How frequently do we want to calculate action -> event relationships if async is enabled
 ACTION_EVENT_MAPPING_INTERVAL_MINUTES = 10
 
+# How frequently do we want to store matches of newly ingested events to actions in ClickHouse
+CLICKHOUSE_ACTION_EVENTS_INTERVAL_SECONDS = 60
+
+# How frequently do we want to write newly seen event names and properties to their teams
+EVENT_NAMES_AND_PROPERTIES_FLUSH_INTERVAL_SECONDS = 15
+
 if settings.STATSD_HOST is not None:
     statsd.Connection.set_defaults(host=settings.STATSD_HOST, port=settings.STATSD_PORT)
 
@@ -68,9 +74,21 @@ def setup_periodic_tasks(sender, **kwargs):
         # ee enabled scheduled tasks
         sender.add_periodic_task(120, clickhouse_lag.s(), name="clickhouse table lag")
         sender.add_periodic_task(120, clickhouse_row_count.s(), name="clickhouse events table row count")
+        sender.add_periodic_task(
+            CLICKHOUSE_ACTION_EVENTS_INTERVAL_SECONDS,
+            calculate_clickhouse_action_events.s(),
+            name="calculate clickhouse action events",
+            expires=CLICKHOUSE_ACTION_EVENTS_INTERVAL_SECONDS,
+        )
 
     sender.add_periodic_task(60, calculate_cohort.s(), name="recalculate cohorts")
 
+    sender.add_periodic_task(
+        EVENT_NAMES_AND_PROPERTIES_FLUSH_INTERVAL_SECONDS,
+        flush_event_names_and_properties.s(),
+        name="flush event names and properties",
+    )
+
     if settings.ASYNC_EVENT_ACTION_MAPPING:
         sender.add_periodic_task(
             (60 * ACTION_EVENT_MAPPING_INTERVAL_MINUTES),
@@ -167,6 +185,21 @@ def calculate_event_action_mappings():
     calculate_actions_from_last_calculation()
 
 
+@app.task(ignore_result=True)
+def calculate_clickhouse_action_events():
+    if is_ee_enabled() and settings.EE_AVAILABLE:
+        from ee.tasks.calculate_action_events import calculate_action_events_scheduler
+
+        calculate_action_events_scheduler()
+
+
+@app.task(ignore_result=True)
+def flush_event_names_and_properties():
+    from posthog.tasks.update_event_names_and_properties import flush_event_names_and_properties
+
+    flush_event_names_and_properties()
+
+
 @app.task(ignore_result=True)
 def calculate_cohort():
     from posthog.tasks.calculate_cohort import calculate_cohorts
@@ -0,0 +1,162 @@
+"""
+Decoders for the compressed payloads sent to capture and /decide.
+
+Every decoder stops once the decompressed data grows past `max_size`, so small requests can't expand into
+gigabytes in memory.
+"""
+import zlib
+from typing import Any, List, Optional
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+SUPPORTED_COMPRESSION: List[str] = [
+    "gzip",
+    "lz64",
+    *(["zstd"] if zstandard is not None else []),
+    *(["br"] if brotli is not None else []),
+]
+
+_BASE64_ALPHABET = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/"
+# Each base64 character as the 6 bits it stands for. "=" only pads, so it contributes zeros.
+_BASE64_TO_BITS = {
+    **{ord(char): format(value, "06b") for value, char in enumerate(_BASE64_ALPHABET)},
+    ord("="): "000000",
+}
+
+
+class DecompressionError(Exception):
+    pass
+
+
+def decompress_lz64(data: str, max_size: int) -> Optional[str]:
+    """
+    Equivalent of LZString.decompressFromBase64, used by posthog-js for "lz64" compression.
+
+    LZ-string packs variable-width codes into base64 characters, least significant bit first. Instead of reading the
+    stream bit by bit, all of it is translated into a string of "0"s and "1"s once, and every code is read with a
+    single slice, reversed and parsed with int(). Returns None for input that isn't valid LZ-string.
+    """
+    if not data:
+        return ""
+
+    bits = data.translate(_BASE64_TO_BITS)
+    if len(bits) != 6 * len(data):
+        raise DecompressionError("Invalid character in lz64 data")
+    total_bits = len(bits)
+    # Reads past the end see zeros, like the reference implementation
+    bits += "0" * 32
+
+    def read(position: int, width: int) -> int:
+        return int(bits[position : position + width][::-1], 2)
+
+    code = read(0, 2)
+    position = 2
+    if code == 0:
+        entry = chr(read(position, 8))
+        position += 8
+    elif code == 1:
+        entry = chr(read(position, 16))
+        position += 16
+    else:
+        return ""
+
+    # Codes 0-2 are instructions, so the dictionary starts at 3
+    dictionary: List[Any] = [None, None, None, entry]
+    enlarge_in = 4
+    num_bits = 3
+    previous = entry
+    result = [entry]
+    size = len(entry)
+    while True:
+        if position >= total_bits:
+            return ""
+
+        code = int(bits[position : position + num_bits][::-1], 2)
+        position += num_bits
+        if code == 0 or code == 1:
+            width = 8 if code == 0 else 16
+            dictionary.append(chr(int(bits[position : position + width][::-1], 2)))
+            position += width
+            code = len(dictionary) - 1
+            enlarge_in -= 1
+        elif code == 2:
+            return "".join(result)
+
+        if enlarge_in == 0:
+            enlarge_in = 1 << num_bits
+            num_bits += 1
+
+        if code < len(dictionary):
+            entry = dictionary[code]
+        elif code == len(dictionary):
+            entry = previous + previous[0]
+        else:
+            return None
+        result.append(entry)
+        size += len(entry)
+        if size > max_size:
+            raise DecompressionError("Decompressed data is larger than {} characters".format(max_size))
+
+        dictionary.append(previous + entry[0])
+        enlarge_in -= 1
+        previous = entry
+
+        if enlarge_in == 0:
+            enlarge_in = 1 << num_bits
+            num_bits += 1
+
+
+def decompress_gzip(data: bytes, max_size: int) -> bytes:
+    """Decompresses (possibly concatenated) gzip members incrementally, without ever holding more than max_size"""
+    result = bytearray()
+    while data:
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            result += decompressor.decompress(data, max_size - len(result) + 1)
+        except zlib.error as e:
+            raise DecompressionError(str(e))
+        if len(result) > max_size:
+            raise DecompressionError("Decompressed data is larger than {} bytes".format(max_size))
+        if not decompressor.eof:
+            raise DecompressionError("Incomplete gzip data")
+        data = decompressor.unused_data
+    return bytes(result)
+
+
+def decompress_zstd(data: bytes, max_size: int) -> bytes:
+    if zstandard is None:
+        raise DecompressionError("zstd is not supported")
+    try:
+        # -1 when the frame header doesn't say. decompress() then fails once the output would exceed max_output_size.
+        if zstandard.frame_content_size(data) > max_size:
+            raise DecompressionError("Decompressed data is larger than {} bytes".format(max_size))
+        # Unlike a stream reader, this fails on incomplete frames
+        return zstandard.ZstdDecompressor().decompress(data, max_output_size=max_size)
+    except zstandard.ZstdError as e:
+        raise DecompressionError(str(e))
+
+
+def decompress_brotli(data: bytes, max_size: int) -> bytes:
+    if brotli is None:
+        raise DecompressionError("brotli is not supported")
+    decompressor = brotli.Decompressor()
+    result = bytearray()
+    # The decompressor can't limit its output, so feed it small chunks and stop once we're over the limit
+    for offset in range(0, len(data), 1024):
+        try:
+            result += decompressor.process(data[offset : offset + 1024])
+        except brotli.error as e:
+            raise DecompressionError(str(e))
+        if len(result) > max_size:
+            raise DecompressionError("Decompressed data is larger than {} bytes".format(max_size))
+    if not decompressor.is_finished():
+        raise DecompressionError("Incomplete brotli data")
+    return bytes(result)
@@ -0,0 +1,95 @@
+"""
+Session recording snapshots are stored compressed and split into chunks.
+
+At ingestion, every `$snapshot` event with a large `$snapshot_data` is replaced by one or more events whose
+`$snapshot_data` holds a piece of the compressed, base64 encoded data. Rows stay small enough for Kafka messages and
+a full page snapshot takes a fraction of the space. Reading reassembles and decompresses them, while snapshots stored
+before this (and small ones, which aren't worth compressing) are returned as is.
+"""
+import base64
+import gzip
+import uuid
+from collections import defaultdict
+from typing import Any, Dict, List, Tuple
+
+from posthog import json_codec
+from posthog.compression import DecompressionError, decompress_gzip, decompress_zstd, zstandard
+
+# Snapshots smaller than this gain nothing from compression
+COMPRESSION_MIN_BYTES = 1024
+# Base64 characters per chunk, keeping each row well under Kafka's default 1MB message limit
+CHUNK_SIZE = 512 * 1024
+MAX_SNAPSHOT_SIZE = 100 * 1024 * 1024
+
+
+def compress_and_chunk_snapshots(
+    events: List[Tuple[str, Dict[str, Any]]], chunk_size: int = CHUNK_SIZE
+) -> List[Tuple[str, Dict[str, Any]]]:
+    """Replaces (distinct_id, `$snapshot` event) pairs with events that have compressed, chunked snapshot data"""
+    result: List[Tuple[str, Dict[str, Any]]] = []
+    for distinct_id, event in events:
+        serialized = json_codec.dumps_bytes(event["properties"]["$snapshot_data"])
+        if len(serialized) < COMPRESSION_MIN_BYTES:
+            result.append((distinct_id, event))
+            continue
+
+        compression, compressed = _compress(serialized)
+        data = base64.b64encode(compressed).decode("ascii")
+        chunk_id = str(uuid.uuid4())
+        chunk_count = (len(data) + chunk_size - 1) // chunk_size
+        for chunk_index in range(chunk_count):
+            result.append(
+                (
+                    distinct_id,
+                    {
+                        **event,
+                        "properties": {
+                            **event["properties"],
+                            "$snapshot_data": {
+                                "chunk_id": chunk_id,
+                                "chunk_index": chunk_index,
+                                "chunk_count": chunk_count,
+                                "compression": compression,
+                                "data": data[chunk_index * chunk_size : (chunk_index + 1) * chunk_size],
+                            },
+                        },
+                    },
+                )
+            )
+    return result
+
+
+def decompress_chunked_snapshot_data(all_snapshots: List[Any]) -> List[Any]:
+    """
+    Reassembles the snapshots in rows of `snapshot_data`, in any order. Snapshots with chunks missing, e.g. because
+    they're still being ingested, are skipped.
+    """
+    snapshots: List[Any] = []
+    chunks: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for snapshot_data in all_snapshots:
+        if "chunk_id" in snapshot_data:
+            chunks[snapshot_data["chunk_id"]].append(snapshot_data)
+        else:
+            snapshots.append(snapshot_data)
+
+    for snapshot_chunks in chunks.values():
+        if len(snapshot_chunks) != snapshot_chunks[0]["chunk_count"]:
+            continue
+        snapshot_chunks.sort(key=lambda chunk: chunk["chunk_index"])
+        compressed = base64.b64decode("".join(chunk["data"] for chunk in snapshot_chunks))
+        snapshots.append(json_codec.loads(_decompress(snapshot_chunks[0]["compression"], compressed)))
+    return snapshots
+
+
+def _compress(data: bytes) -> Tuple[str, bytes]:
+    if zstandard is not None:
+        return "zstd-base64", zstandard.ZstdCompressor().compress(data)
+    return "gzip-base64", gzip.compress(data, compresslevel=6)
+
+
+def _decompress(compression: str, data: bytes) -> bytes:
+    if compression == "zstd-base64":
+        return decompress_zstd(data, MAX_SNAPSHOT_SIZE)
+    if compression == "gzip-base64":
+        return decompress_gzip(data, MAX_SNAPSHOT_SIZE)
+    raise DecompressionError("Unknown snapshot compression {}".format(compression))
@@ -0,0 +1,43 @@
+"""
+JSON encoding and decoding for hot paths (capture parsing, ClickHouse query cache, event and person properties).
+
+Uses orjson when it's installed and falls back to the standard library otherwise. Output is always compact and
+UTF-8 (no ASCII escaping), so it can differ byte-wise from a plain `json.dumps`. It decodes to the same values, except
+for non-finite floats: orjson writes NaN and Infinity as null, which unlike the standard library's NaN and Infinity is
+valid JSON. The standard library fallback still writes them as NaN and Infinity, and loads accepts both.
+"""
+import json
+from typing import Any, Callable, Optional, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Exceptions are the same regardless of backend: orjson's are subclasses of these
+JSONDecodeError = json.JSONDecodeError
+
+
+def dumps_bytes(obj: Any, default: Optional[Callable[[Any], Any]] = None) -> bytes:
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, default=default, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # orjson is stricter than the standard library, e.g. about integers over 64 bits
+            pass
+    return json.dumps(obj, default=default, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def dumps(obj: Any, default: Optional[Callable[[Any], Any]] = None) -> str:
+    return dumps_bytes(obj, default=default).decode("utf-8")
+
+
+def loads(data: Union[str, bytes, bytearray]) -> Any:
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # NaN, Infinity and lone surrogates are rejected by orjson but accepted by the standard library. Invalid
+            # JSON raises json.JSONDecodeError from here just like it used to.
+            pass
+    return json.loads(data)
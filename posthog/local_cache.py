@@ -0,0 +1,130 @@
+"""
+Process-local caches for the ingestion hot path, and their invalidation across processes through Redis pub/sub.
+"""
+import math
+import os
+import threading
+import time
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generic,
+    Hashable,
+    Iterable,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+from django.conf import settings
+from sentry_sdk import capture_exception
+
+from posthog.redis import get_client
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class LocalCache(Generic[K, V]):
+    """
+    Thread-safe LRU cache of at most `max_size` entries, which expire `ttl_seconds` after being set (or never).
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: Optional[float] = None) -> None:
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: Dict[K, Tuple[float, V]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: K) -> Optional[V]:
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: Iterable[K]) -> Dict[K, V]:
+        """The values of those of `keys` that are cached and haven't expired"""
+        now = time.time()
+        found: Dict[K, V] = {}
+        with self._lock:
+            for key in keys:
+                entry = self._entries.pop(key, None)
+                if entry is not None and entry[0] >= now:
+                    self._entries[key] = entry  # re-inserted to mark it as most recently used
+                    found[key] = entry[1]
+        return found
+
+    def set(self, key: K, value: V) -> None:
+        self.set_many({key: value})
+
+    def set_many(self, values: Dict[K, V]) -> None:
+        expires_at = time.time() + self.ttl_seconds if self.ttl_seconds is not None else math.inf
+        with self._lock:
+            for key, value in values.items():
+                self._entries.pop(key, None)
+                self._entries[key] = (expires_at, value)
+            while len(self._entries) > self.max_size:
+                self._entries.pop(next(iter(self._entries)))
+
+    def delete(self, keys: Iterable[K]) -> None:
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def delete_where(self, predicate: Callable[[K, V], bool]) -> None:
+        with self._lock:
+            for key, (_, value) in list(self._entries.items()):
+                if predicate(key, value):
+                    del self._entries[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class CacheInvalidationListener:
+    """
+    Invalidates a process-local cache in every process. `publish` sends a message on a Redis pub/sub channel, and a
+    daemon thread in each process that called `start` passes the messages it receives to `invalidate`. `on_subscribe`
+    is called whenever the thread (re)subscribes, as messages may have been missed in the meantime.
+    """
+
+    def __init__(
+        self, channel: str, name: str, invalidate: Callable[[str], None], on_subscribe: Callable[[], None]
+    ) -> None:
+        self.channel = channel
+        self.name = name
+        self.invalidate = invalidate
+        self.on_subscribe = on_subscribe
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        # Tests run in a single process, where the local cache is invalidated directly
+        if settings.TEST or self._pid == os.getpid():
+            return
+        with self._lock:
+            # Tracked per pid, as gunicorn and celery workers are forked after import
+            if self._pid == os.getpid():
+                return
+            threading.Thread(target=self._listen, name=self.name, daemon=True).start()
+            self._pid = os.getpid()
+
+    def publish(self, message: Any) -> None:
+        get_client().publish(self.channel, message)
+
+    def _listen(self) -> None:
+        while True:
+            try:
+                pubsub = get_client().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                self.on_subscribe()
+                for message in pubsub.listen():
+                    self.invalidate(message["data"].decode("utf-8"))
+            except Exception as e:
+                capture_exception(e)
+                time.sleep(1)
@@ -0,0 +1,91 @@
+import gzip
+import json
+import time
+from typing import Callable, List, Tuple
+
+import lzstring
+from django.core.management.base import BaseCommand
+
+from posthog.compression import (
+    SUPPORTED_COMPRESSION,
+    brotli,
+    decompress_brotli,
+    decompress_gzip,
+    decompress_lz64,
+    decompress_zstd,
+    zstandard,
+)
+
+MAX_SIZE = 100 * 1024 * 1024
+
+
+def _event(index: int) -> dict:
+    return {
+        "event": "$autocapture" if index % 3 else "$pageview",
+        "properties": {
+            "$os": "Mac OS X",
+            "$browser": "Chrome",
+            "$device_type": "Desktop",
+            "$current_url": "https://app.posthog.com/insights?interval=day&display=ActionsLineGraph&events=%5B{}%5D".format(
+                index
+            ),
+            "$host": "app.posthog.com",
+            "$pathname": "/insights",
+            "$browser_version": 86,
+            "$screen_height": 1080,
+            "$screen_width": 1920,
+            "$lib": "web",
+            "$lib_version": "1.7.2",
+            "$insert_id": "{:016x}".format(index * 7919),
+            "$time": 1606225387.123 + index,
+            "distinct_id": "175f9c0aab4418-0b0b7b6ec3a3c7-1a1d2f13-1fa400-175f9c0aab5a1c",
+            "$device_id": "175f9c0aab4418-0b0b7b6ec3a3c7-1a1d2f13-1fa400-175f9c0aab5a1c",
+            "$initial_referrer": "$direct",
+            "$referrer": "https://app.posthog.com/events",
+            "token": "sTMFPsFhdP1Ssg",
+            "$event_type": "click",
+            "$ce_version": 1,
+            "$elements": [
+                {"tag_name": "span", "$el_text": "Save", "attr__class": "ant-btn-primary", "nth_child": 2},
+                {"tag_name": "button", "attr__class": "ant-btn", "nth_child": 1, "nth_of_type": 1},
+                {"tag_name": "div", "attr__class": "toolbar", "nth_child": 3, "nth_of_type": 2},
+            ],
+        },
+        "timestamp": "2020-11-24T13:43:07.{:03d}Z".format(index % 1000),
+    }
+
+
+class Command(BaseCommand):
+    help = "Benchmark decoding compressed capture payloads, old decoders against the ones in posthog.compression"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=20, help="Decodes per payload and decoder")
+
+    def handle(self, *args, **options):
+        print("Supported compression: {}".format(", ".join(SUPPORTED_COMPRESSION)))
+        for events in (1, 10, 50, 100, 500):
+            payload = json.dumps([_event(index) for index in range(events)])
+            lz64 = lzstring.LZString().compressToBase64(payload)
+            gzipped = gzip.compress(payload.encode())
+
+            decoders: List[Tuple[str, Callable[[], object]]] = [
+                ("lz64 (lzstring)", lambda: lzstring.LZString().decompressFromBase64(lz64)),
+                ("lz64", lambda: decompress_lz64(lz64, MAX_SIZE)),
+                ("gzip (gzip.decompress)", lambda: gzip.decompress(gzipped)),
+                ("gzip", lambda: decompress_gzip(gzipped, MAX_SIZE)),
+            ]
+            if zstandard is not None:
+                zstd_compressed = zstandard.ZstdCompressor().compress(payload.encode())
+                decoders.append(("zstd", lambda: decompress_zstd(zstd_compressed, MAX_SIZE)))
+            if brotli is not None:
+                brotli_compressed = brotli.compress(payload.encode())
+                decoders.append(("br", lambda: decompress_brotli(brotli_compressed, MAX_SIZE)))
+            decoders.append(("json.loads", lambda: json.loads(payload)))
+
+            print("\n{} events, {} bytes of JSON".format(events, len(payload)))
+            for name, decode in decoders:
+                start = time.perf_counter()
+                for _ in range(options["iterations"]):
+                    decode()
+                elapsed = (time.perf_counter() - start) / options["iterations"]
+                print("  {:<24} {:>10.3f}ms".format(name, elapsed * 1000))
@@ -0,0 +1,93 @@
+import json
+import random
+import time
+from typing import Any, Dict, List, Tuple
+
+from django.core.management.base import BaseCommand
+
+from posthog import json_codec
+from posthog.helpers.session_recording import compress_and_chunk_snapshots, decompress_chunked_snapshot_data
+
+
+def _node(depth: int, index: int) -> Dict[str, Any]:
+    node: Dict[str, Any] = {
+        "type": 2,
+        "tagName": random.choice(["div", "span", "a", "li", "button", "p"]),
+        "attributes": {"class": "ant-col ant-col-{} ph-{}".format(index % 24, index % 7), "style": "margin: 0px"},
+        "id": depth * 1000 + index,
+    }
+    if depth < 3:
+        node["childNodes"] = [_node(depth + 1, child) for child in range(8)]
+    else:
+        node["childNodes"] = [{"type": 3, "textContent": "Item {} of the list".format(index), "id": index}]
+    return node
+
+
+def _session(incremental_events: int) -> List[Dict[str, Any]]:
+    snapshots: List[Dict[str, Any]] = [
+        {"type": 4, "data": {"href": "https://app.posthog.com/insights", "width": 1920, "height": 1080}},
+        {"type": 2, "data": {"node": _node(0, 0), "initialOffset": {"left": 0, "top": 0}}},
+    ]
+    for index in range(incremental_events):
+        snapshots.append(
+            {
+                "type": 3,
+                "data": {
+                    "source": 1,
+                    "positions": [
+                        {"x": random.randint(0, 1920), "y": random.randint(0, 1080), "id": 12, "timeOffset": 0}
+                    ],
+                },
+            }
+        )
+    for index, snapshot in enumerate(snapshots):
+        snapshot["timestamp"] = 1_606_225_387_000 + index * 50
+    return snapshots
+
+
+class Command(BaseCommand):
+    help = "Benchmark storage size and read time of session recordings, raw against compressed and chunked"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--incremental-events", type=int, default=500, help="Incremental snapshots per session")
+        parser.add_argument("--iterations", type=int, default=20, help="Reads per storage format")
+
+    def handle(self, *args, **options):
+        snapshots = _session(options["incremental_events"])
+        events: List[Tuple[str, Dict[str, Any]]] = [
+            ("user", {"event": "$snapshot", "properties": {"$session_id": "abc", "$snapshot_data": snapshot}})
+            for snapshot in snapshots
+        ]
+
+        start = time.perf_counter()
+        stored_events = compress_and_chunk_snapshots(events)
+        ingest_time = time.perf_counter() - start
+
+        # What ends up in the snapshot_data column, one string per row
+        raw_rows = [json.dumps(snapshot) for snapshot in snapshots]
+        stored_rows = [json.dumps(event["properties"]["$snapshot_data"]) for _, event in stored_events]
+
+        print("{} snapshots, full snapshot of {} bytes".format(len(snapshots), len(raw_rows[1])))
+        print("  {:<22} {:>8} rows {:>12} bytes".format("raw", len(raw_rows), sum(map(len, raw_rows))))
+        print(
+            "  {:<22} {:>8} rows {:>12} bytes".format(
+                "compressed, chunked", len(stored_rows), sum(map(len, stored_rows))
+            )
+        )
+        full_snapshot_rows = [row for row in stored_rows if "chunk_id" in row]
+        print("  full snapshot stored as {} bytes".format(sum(map(len, full_snapshot_rows))))
+        print("  compressing at ingestion took {:.2f}ms".format(ingest_time * 1000))
+
+        for name, rows, read in (
+            ("raw", raw_rows, lambda rows: [json_codec.loads(row) for row in rows]),
+            (
+                "compressed, chunked",
+                stored_rows,
+                lambda rows: decompress_chunked_snapshot_data([json_codec.loads(row) for row in rows]),
+            ),
+        ):
+            start = time.perf_counter()
+            for _ in range(options["iterations"]):
+                read(rows)
+            elapsed = (time.perf_counter() - start) / options["iterations"]
+            print("  reading {:<22} {:>8.2f}ms".format(name, elapsed * 1000))
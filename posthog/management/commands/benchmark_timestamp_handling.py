@@ -0,0 +1,65 @@
+import datetime
+import time
+from typing import Callable, List, Optional, Tuple
+
+from dateutil import parser
+from dateutil.relativedelta import relativedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from posthog.tasks.process_event import handle_timestamp
+from posthog.utils import parse_iso_datetime
+
+
+def _old_handle_timestamp(data: dict, now: str, sent_at: Optional[str]) -> datetime.datetime:
+    # handle_timestamp as it was before timestamps were parsed with parse_iso_datetime
+    if data.get("timestamp"):
+        if sent_at:
+            try:
+                return parser.isoparse(now) + (parser.isoparse(data["timestamp"]) - parser.isoparse(sent_at))
+            except TypeError:
+                pass
+        return parser.isoparse(data["timestamp"])
+    now_datetime = parser.parse(now)
+    if data.get("offset"):
+        return now_datetime - relativedelta(microseconds=data["offset"] * 1000)
+    return now_datetime
+
+
+class Command(BaseCommand):
+    help = "Benchmark per-event timestamp handling in ingestion, before and after parse_iso_datetime"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--events", type=int, default=100, help="Events per batch, all sharing one sent_at")
+        parser.add_argument("--iterations", type=int, default=200, help="Batches per variant")
+
+    def handle(self, *args, **options):
+        now = timezone.now().isoformat()
+        sent_at = "2020-11-24T13:43:08.000Z"
+        batches = {
+            "timestamp + sent_at": [
+                {"timestamp": "2020-11-24T13:43:07.{:03d}Z".format(index % 1000)} for index in range(options["events"])
+            ],
+            "offset": [{"offset": index} for index in range(options["events"])],
+        }
+
+        def old(events: List[dict]) -> None:
+            for data in events:
+                _old_handle_timestamp(data, now, sent_at)
+
+        def new(events: List[dict]) -> None:
+            # process_event_batch parses now and sent_at once per batch
+            now_datetime = parse_iso_datetime(now)
+            sent_at_datetime = parse_iso_datetime(sent_at)
+            for data in events:
+                handle_timestamp(data, now_datetime, sent_at_datetime)
+
+        variants: List[Tuple[str, Callable[[List[dict]], None]]] = [("before", old), ("after", new)]
+        for name, events in batches.items():
+            print("\n{} ({} events per batch)".format(name, len(events)))
+            for variant, run in variants:
+                start = time.perf_counter()
+                for _ in range(options["iterations"]):
+                    run(events)
+                elapsed = (time.perf_counter() - start) / (options["iterations"] * len(events))
+                print("  {:<8} {:>8.2f}µs per event".format(variant, elapsed * 1000000))
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from posthog.capture_spool import CaptureSpool, send_task
+
+
+class Command(BaseCommand):
+    help = "Replay capture tasks spooled to local disk, e.g. before retiring a host whose web workers spooled some"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dir", type=str, default=settings.CAPTURE_SPOOL_DIR, help="Spool directory")
+
+    def handle(self, *args, **options):
+        if not options["dir"]:
+            raise CommandError("You need to set CAPTURE_SPOOL_DIR or pass --dir to run this command")
+
+        replayed = CaptureSpool(options["dir"], settings.CAPTURE_SPOOL_SEGMENT_BYTES).drain(send_task)
+        self.stdout.write("Replayed {} tasks".format(replayed))
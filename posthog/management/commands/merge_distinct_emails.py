@@ -1,7 +1,7 @@
 from django.core.management.base import BaseCommand
 from django.db import connection
 
-from posthog.models import CohortPeople, Person, PersonDistinctId, Team
+from posthog.models import Person, Team
 
 
 class Command(BaseCommand):
@@ -24,22 +24,19 @@ class Command(BaseCommand):
         with connection.cursor() as cursor:
             cursor.execute(
                 """
-                select properties->>'email', team_id, count(*)
+                select properties->>'email', array_agg(id order by id)
                 from posthog_person
                 where properties->>'email' is not null and properties->>'email' != '' and team_id = %s
-                group by properties->>'email', team_id
+                group by properties->>'email'
                 HAVING count(*) > 1
                 order by count(*) desc;
                 """,
                 [team_id],
             )
+            rows = cursor.fetchall()
 
-            for row in cursor.fetchall():
-                email = row[0]
-                print("Merging email: {}".format(email))
+        for email, person_ids in rows:
+            print("Merging email: {}".format(email))
 
-                people = Person.objects.filter(team=team, properties__email=email).order_by("pk")
-                first_person = people[0]
-                other_people = people[1:]
-
-                first_person.merge_people(other_people)
+            first_person = Person.objects.get(pk=person_ids[0])
+            first_person.merge_people_by_id(person_ids[1:])
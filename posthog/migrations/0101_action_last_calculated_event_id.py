@@ -0,0 +1,16 @@
+# Generated by Django 3.0.6 on 2020-11-16 10:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("posthog", "0100_action_step_max_length"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="action", name="last_calculated_event_id", field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,16 @@
+# Generated by Django 3.0.6 on 2020-11-17 09:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("posthog", "0101_action_last_calculated_event_id"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="action", name="events_calculated_until", field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
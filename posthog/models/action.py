@@ -6,6 +6,14 @@ from django.utils import timezone
 from rest_hooks.signals import raw_hook_event
 from sentry_sdk import capture_exception
 
+# Events created more recently than this may belong to transactions that haven't committed yet
+EVENT_COMMIT_DELAY = datetime.timedelta(minutes=1)
+
+INSERT_ACTION_EVENTS_SQL = """INSERT INTO "posthog_action_events" ("action_id", "event_id")
+                        {}
+                    ON CONFLICT DO NOTHING
+                 """
+
 
 class Action(models.Model):
     class Meta:
@@ -27,12 +35,20 @@ class Action(models.Model):
         self.save()
         from .event import Event
 
+        # A full recalculation covers every committed event, incremental calculation continues after these
+        if recalculate_all:
+            self.last_calculated_event_id = Event.objects.last_id_created_before(calculated_at - EVENT_COMMIT_DELAY)
+
         try:
             if recalculate_all:
-                event_query, params = Event.objects.query_db_by_action(self).only("pk").query.sql_with_params()
+                event_query, params = (
+                    Event.objects.query_db_by_action(self, order_by=None).only("pk").query.sql_with_params()
+                )
             else:
                 event_query, params = (
-                    Event.objects.query_db_by_action(self, start=start, end=end).only("pk").query.sql_with_params()
+                    Event.objects.query_db_by_action(self, order_by=None, start=start, end=end)
+                    .only("pk")
+                    .query.sql_with_params()
                 )
 
         except EmptyResultSet:
@@ -42,35 +58,27 @@ class Action(models.Model):
             self.events.all().delete()
             return
 
-        query = """DELETE FROM "posthog_action_events" WHERE "action_id" = {}""".format(self.pk)
+        query = """DELETE FROM "posthog_action_events" WHERE "action_id" = %s"""
+        query_params = [self.pk]
 
-        period_delete_query = """AND "event_id" in
+        period_delete_query = """ AND "event_id" in
                        (SELECT id
                         FROM posthog_event
-                        WHERE "created_at" >= '{}'
-                        AND "created_at" < '{}');
-                """.format(
-            start.isoformat(), end.isoformat()
-        )
-
-        insert_query = """INSERT INTO "posthog_action_events" ("action_id", "event_id")
-                        {}
-                    ON CONFLICT DO NOTHING
-                 """.format(
-            event_query.replace("SELECT ", "SELECT {}, ".format(self.pk), 1)
-        )
+                        WHERE "created_at" >= %s
+                        AND "created_at" < %s)
+                """
 
         if not recalculate_all:
             query += period_delete_query
-        else:
-            query += ";"
+            query_params += [start, end]
 
-        query += insert_query
+        query += ";" + INSERT_ACTION_EVENTS_SQL.format(event_query.replace("SELECT ", "SELECT %s, ", 1))
+        query_params += [self.pk, *params]
 
         cursor = connection.cursor()
         with transaction.atomic():
             try:
-                cursor.execute(query, params)
+                cursor.execute(query, query_params)
             except:
                 capture_exception()
 
@@ -78,6 +86,29 @@ class Action(models.Model):
         self.last_calculated_at = calculated_at
         self.save()
 
+    def calculate_events_in_range(self, after_event_id: int, until_event_id: int) -> int:
+        """
+        Adds the events with `after_event_id < id <= until_event_id` that match this action and returns how many were
+        added. Existing rows are kept, so a range can safely be calculated more than once.
+        """
+        from .event import Event
+
+        try:
+            event_query, params = (
+                Event.objects.filter(pk__gt=after_event_id, pk__lte=until_event_id)
+                .query_db_by_action(self, order_by=None)
+                .only("pk")
+                .query.sql_with_params()
+            )
+        except EmptyResultSet:
+            return 0
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                INSERT_ACTION_EVENTS_SQL.format(event_query.replace("SELECT ", "SELECT %s, ", 1)), [self.pk, *params]
+            )
+            return cursor.rowcount
+
     def on_perform(self, event):
         from posthog.api.event import EventViewSet
 
@@ -101,6 +132,10 @@ class Action(models.Model):
     is_calculating: models.BooleanField = models.BooleanField(default=False)
     updated_at: models.DateTimeField = models.DateTimeField(auto_now=True)
     last_calculated_at: models.DateTimeField = models.DateTimeField(default=timezone.now, blank=True)
+    # Events with ids up to this one have been matched to this action
+    last_calculated_event_id: models.IntegerField = models.IntegerField(null=True, blank=True)
+    # ClickHouse: matches of events ingested up to this time are stored, null until they're calculated for the steps
+    events_calculated_until: models.DateTimeField = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
         return self.name
@@ -0,0 +1,453 @@
+"""
+Matching of newly ingested events to actions, in memory.
+
+The actions of a team are compiled once into Python predicates, covering the event name, URL and property filters and
+element filters (selectors included) of their steps. The compiled actions are cached per process, expire after
+ACTION_MATCHER_TTL_SECONDS and are invalidated across processes through Redis pub/sub whenever an action or step is
+saved. Steps with filters that can't be evaluated in memory (regexes using constructs that mean something different
+in Python, property keys that are nested paths) fall back to querying the event in Postgres.
+
+Predicates mirror the SQL generated by `EventManager.query_db_by_action`, including its quirks, so that events are
+mapped the same way they'd be by a recalculation.
+"""
+import json
+import re
+from collections import defaultdict
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Pattern,
+    Tuple,
+    cast,
+)
+
+from django.conf import settings
+from django.db import models
+from django.dispatch import receiver
+
+from posthog.local_cache import CacheInvalidationListener, LocalCache
+
+from .action import Action
+from .action_step import ActionStep
+from .element import Element
+from .filter import Filter
+from .person import Person
+from .property import Property
+
+ACTION_MATCHER_TTL_SECONDS = 60
+ACTION_MATCHER_CACHE_MAX_SIZE = 1000
+ACTION_MATCHER_CACHE: LocalCache[int, "TeamActionMatcher"] = LocalCache(
+    ACTION_MATCHER_CACHE_MAX_SIZE, ACTION_MATCHER_TTL_SECONDS
+)
+# Whether the elements with a hash match a selector. Hashes are of the elements themselves, so entries never go stale.
+SELECTOR_MATCH_CACHE_MAX_SIZE = 10000
+SELECTOR_MATCH_CACHE: LocalCache[Tuple[str, str], bool] = LocalCache(SELECTOR_MATCH_CACHE_MAX_SIZE)
+
+# Escapes and (?...) groups that mean the same in Python and Postgres regexes
+_SHARED_REGEX_ESCAPES = frozenset("dDsSwWAZfnrtvuU")
+_SHARED_REGEX_GROUPS = (":", "=", "!", "<=", "<!")
+
+# jsonb sorts values of different types as Object > Array > Boolean > Number > String > Null
+_JSONB_TYPE_ORDER = {type(None): 0, str: 1, int: 2, float: 2, bool: 3, list: 4, dict: 5}
+
+
+class UnsupportedFilter(Exception):
+    pass
+
+
+class EventContext:
+    """An event being matched, with what's needed of its elements and person loaded on first use"""
+
+    def __init__(self, event: Any, elements: Optional[List[Element]] = None) -> None:
+        self.event = event
+        self._elements = elements
+        self._person: Optional[Tuple[Optional[int], Dict[str, Any]]] = None
+
+    @property
+    def elements(self) -> List[Element]:
+        if self._elements is None:
+            if self.event.elements_hash:
+                self._elements = list(
+                    Element.objects.filter(
+                        group__team_id=self.event.team_id, group__hash=self.event.elements_hash
+                    ).order_by("order")
+                )
+            else:
+                self._elements = []
+        return self._elements
+
+    @property
+    def person_id(self) -> Optional[int]:
+        return self._load_person()[0]
+
+    @property
+    def person_properties(self) -> Dict[str, Any]:
+        return self._load_person()[1]
+
+    def _load_person(self) -> Tuple[Optional[int], Dict[str, Any]]:
+        if self._person is None:
+            person = (
+                Person.objects.filter(
+                    team_id=self.event.team_id,
+                    persondistinctid__team_id=self.event.team_id,
+                    persondistinctid__distinct_id=self.event.distinct_id,
+                )
+                .values_list("id", "properties")
+                .first()
+            )
+            self._person = cast(Tuple[Optional[int], Dict[str, Any]], person or (None, {}))
+        return self._person
+
+
+Predicate = Callable[[EventContext], bool]
+
+
+class CompiledStep:
+    def __init__(self, step: ActionStep) -> None:
+        self.predicates: List[Predicate] = []
+        # Set when some filter of the step can only be evaluated in Postgres
+        self.needs_database = False
+        try:
+            if step.event:
+                self.predicates.append(_event_name_predicate(step.event))
+            if step.url:
+                self.predicates.append(_url_predicate(step.url, step.url_matching))
+            self.predicates.extend(
+                _element_predicates(
+                    {"tag_name": step.tag_name, "text": step.text, "href": step.href, "selector": step.selector}
+                )
+            )
+            self.predicates.extend(_property_predicates(Filter(data={"properties": step.properties}).properties))
+        except UnsupportedFilter:
+            self.predicates = []
+            self.needs_database = True
+
+    def matches(self, context: EventContext) -> bool:
+        return all(predicate(context) for predicate in self.predicates)
+
+
+class CompiledAction:
+    def __init__(self, action: Action, position: int = 0) -> None:
+        self.action = action
+        self.position = position
+        self.steps = [CompiledStep(step) for step in action.steps.all()]
+
+    def matches(self, context: EventContext) -> bool:
+        if any(not step.needs_database and step.matches(context) for step in self.steps):
+            return True
+        if any(step.needs_database for step in self.steps):
+            from .event import Event
+
+            return Event.objects.filter(pk=context.event.pk).query_db_by_action(self.action, order_by=None).exists()
+        return False
+
+
+class TeamActionMatcher:
+    def __init__(self, actions: List[Action]) -> None:
+        # Only actions with a step for the event's name are candidates, as well as actions with a step without an
+        # event name, which matches any event. The latter are listed under None.
+        self.actions_by_event: Dict[Optional[str], List[CompiledAction]] = defaultdict(list)
+        for position, action in enumerate(actions):
+            compiled = CompiledAction(action, position)
+            for event_name in {step.event or None for step in action.steps.all()}:
+                self.actions_by_event[event_name].append(compiled)
+
+    def match(self, event: Any, elements: Optional[List[Element]] = None) -> List[Action]:
+        candidates = self.actions_by_event.get(event.event, [])
+        if None in self.actions_by_event:
+            # Merged in the order of the actions, each once
+            candidates = sorted(
+                set(candidates) | set(self.actions_by_event[None]), key=lambda compiled: compiled.position
+            )
+        if not candidates:
+            return []
+        context = EventContext(event, elements)
+        return [compiled.action for compiled in candidates if compiled.matches(context)]
+
+
+def get_action_matcher(team_id: int) -> TeamActionMatcher:
+    cached = ACTION_MATCHER_CACHE.get(team_id)
+    if cached is not None:
+        return cached
+
+    _action_matcher_invalidation.start()
+    actions = (
+        Action.objects.filter(team_id=team_id, deleted=False)
+        .order_by("id")
+        .prefetch_related(models.Prefetch("steps", queryset=ActionStep.objects.order_by("id")))
+    )
+    matcher = TeamActionMatcher(list(actions))
+    ACTION_MATCHER_CACHE.set(team_id, matcher)
+    return matcher
+
+
+def matching_actions(event: Any, elements: Optional[List[Element]] = None) -> List[Action]:
+    """Actions the event matches, ordered by id. Pass the event's elements if they're at hand, to save a query."""
+    return get_action_matcher(event.team_id).match(event, elements)
+
+
+def invalidate_action_matcher(team_id: int) -> None:
+    ACTION_MATCHER_CACHE.delete([team_id])
+
+
+_action_matcher_invalidation = CacheInvalidationListener(
+    settings.ACTION_MATCHER_PUBSUB_CHANNEL,
+    name="action-matcher-invalidation",
+    invalidate=lambda message: invalidate_action_matcher(int(message)),
+    on_subscribe=ACTION_MATCHER_CACHE.clear,
+)
+
+
+@receiver(models.signals.post_save, sender=Action)
+@receiver(models.signals.post_delete, sender=Action)
+def action_saved(sender, instance: Action, **kwargs) -> None:
+    _publish_invalidation(instance.team_id)
+
+
+@receiver(models.signals.post_save, sender=ActionStep)
+@receiver(models.signals.post_delete, sender=ActionStep)
+def action_step_saved(sender, instance: ActionStep, **kwargs) -> None:
+    team_id = Action.objects.filter(pk=instance.action_id).values_list("team_id", flat=True).first()
+    if team_id is not None:
+        _publish_invalidation(team_id)
+
+
+def _publish_invalidation(team_id: int) -> None:
+    invalidate_action_matcher(team_id)
+    _action_matcher_invalidation.publish(team_id)
+
+
+def _event_name_predicate(event_name: str) -> Predicate:
+    return lambda context: context.event.event == event_name
+
+
+def _url_predicate(url: str, url_matching: Optional[str]) -> Predicate:
+    if url_matching == ActionStep.EXACT:
+        return lambda context: _json_text(context.event.properties.get("$current_url")) == url
+    if url_matching == ActionStep.REGEX:
+        pattern = _compile_postgres_regex(url)
+    else:
+        # LIKE '%url%', where any % or _ in the url are wildcards too
+        pattern = _compile_regex(_like_to_regex("%{}%".format(url)), re.DOTALL)
+    return lambda context: _regex_matches(pattern, _json_text(context.event.properties.get("$current_url")))
+
+
+def _element_predicates(filters: Dict[str, Optional[str]]) -> List[Predicate]:
+    predicates: List[Predicate] = []
+    selector = filters.get("selector")
+    if selector:
+        predicates.append(_selector_predicate(selector))
+    # All of these have to match on the same element
+    conditions = [(key, filters[key]) for key in ["tag_name", "text", "href"] if filters.get(key)]
+    if conditions:
+        predicates.append(
+            lambda context: any(
+                all(getattr(element, key) == value for key, value in conditions) for element in context.elements
+            )
+        )
+    return predicates
+
+
+def _selector_predicate(selector: str) -> Predicate:
+    from .event import Selector
+
+    parsed = Selector(selector)
+
+    def predicate(context: EventContext) -> bool:
+        elements_hash = context.event.elements_hash
+        if not elements_hash:
+            return parsed.matches(context.elements)
+        key = (selector, elements_hash)
+        matches = SELECTOR_MATCH_CACHE.get(key)
+        if matches is None:
+            matches = parsed.matches(context.elements)
+            SELECTOR_MATCH_CACHE.set(key, matches)
+        return matches
+
+    return predicate
+
+
+def _property_predicates(properties: List[Property]) -> List[Predicate]:
+    predicates: List[Predicate] = []
+    element_filters: Dict[str, Optional[str]] = {}
+    for property in properties:
+        if property.type == "event":
+            predicates.append(_properties_predicate(property, lambda context: context.event.properties))
+        elif property.type == "person":
+            predicates.append(_person_properties_predicate(property))
+        elif property.type == "element":
+            element_filters[property.key] = property.value
+        elif property.type == "cohort" and property.key == "id":
+            predicates.append(_cohort_predicate(int(property.value)))
+    predicates.extend(_element_predicates(element_filters))
+    return predicates
+
+
+def _person_properties_predicate(property: Property) -> Predicate:
+    properties_predicate = _properties_predicate(property, lambda context: context.person_properties)
+
+    def predicate(context: EventContext) -> bool:
+        return context.person_id is not None and properties_predicate(context)
+
+    return predicate
+
+
+def _cohort_predicate(cohort_id: int) -> Predicate:
+    def predicate(context: EventContext) -> bool:
+        from .cohort import CohortPeople
+
+        person_id = context.person_id
+        return person_id is not None and CohortPeople.objects.filter(cohort_id=cohort_id, person_id=person_id).exists()
+
+    return predicate
+
+
+def _properties_predicate(property: Property, get_properties: Callable[[EventContext], Dict[str, Any]]) -> Predicate:
+    """Evaluates `Property.property_to_Q` against a properties dict"""
+    if "__" in property.key:
+        # The ORM treats these as paths into nested values
+        raise UnsupportedFilter(property.key)
+    key, operator, value = property.key, property.operator, property._parse_value(property.value)
+    missing = object()
+
+    def get(context: EventContext) -> Any:
+        return get_properties(context).get(key, missing)
+
+    if operator is None or operator == "exact":
+        return lambda context: _json_equal(get(context), value)
+    if operator == "is_not":
+        return lambda context: not _json_equal(get(context), value)
+    if operator == "is_set":
+        return lambda context: get(context) is not missing
+    if operator == "is_not_set":
+        return lambda context: get(context) is missing
+
+    negated = operator.startswith("not_")
+    text_matches = _text_predicate(operator[4:] if negated else operator, value)
+
+    def predicate(context: EventContext) -> bool:
+        found = get(context)
+        if negated:
+            # NOT (text matches) OR key missing OR JSON null
+            return found is missing or found is None or not text_matches(found)
+        return found is not missing and text_matches(found)
+
+    return predicate
+
+
+def _text_predicate(operator: str, value: Any) -> Callable[[Any], bool]:
+    if operator == "icontains":
+        needle = str(value).lower()
+        return lambda found: found is not None and needle in str(_json_text(found)).lower()
+    if operator == "regex":
+        pattern = _compile_postgres_regex(str(value))
+        return lambda found: _regex_matches(pattern, _json_text(found))
+    if operator == "gt":
+        return lambda found: _jsonb_compare(found, value) > 0
+    if operator == "lt":
+        return lambda found: _jsonb_compare(found, value) < 0
+    raise UnsupportedFilter(operator)
+
+
+def _json_equal(found: Any, value: Any) -> bool:
+    # Unlike in Python, true isn't equal to 1 in JSON
+    return found == value and isinstance(found, bool) == isinstance(value, bool)
+
+
+def _json_text(value: Any) -> Optional[str]:
+    """The value as `->>` returns it"""
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value)
+
+
+def _jsonb_compare(found: Any, value: Any) -> int:
+    found_order, value_order = _JSONB_TYPE_ORDER.get(type(found), -1), _JSONB_TYPE_ORDER.get(type(value), -1)
+    if found_order != value_order:
+        return found_order - value_order
+    try:
+        return (found > value) - (found < value)
+    except TypeError:
+        return 0
+
+
+def _compile_regex(pattern: str, flags: int = 0) -> Pattern:
+    try:
+        return re.compile(pattern, flags)
+    except re.error:
+        raise UnsupportedFilter(pattern)
+
+
+def _compile_postgres_regex(pattern: str) -> Pattern:
+    r"""
+    Compiles a Postgres regex (advanced regular expression, as matched by `~`) for Python, when it only uses
+    constructs that mean the same in both. Anything else, like [[:alpha:]] classes, \m, \y or \b (a backspace in
+    Postgres) and (?...) groups other than lookarounds, is left to Postgres.
+    """
+    translated = ""
+    index = 0
+    while index < len(pattern):
+        character = pattern[index]
+        if character == "\\":
+            escaped = pattern[index + 1 : index + 2]
+            if escaped.isalnum() and escaped not in _SHARED_REGEX_ESCAPES:
+                raise UnsupportedFilter(pattern)
+            translated += character + escaped
+            index += 2
+        elif character == "[":
+            # A ] right at the start of a bracket expression is a literal in both
+            end = index + 1
+            if pattern[end : end + 1] == "^":
+                end += 1
+            if pattern[end : end + 1] == "]":
+                end += 1
+            while end < len(pattern) and pattern[end] != "]":
+                if pattern[end] == "[" and pattern[end + 1 : end + 2] in (":", ".", "="):
+                    raise UnsupportedFilter(pattern)
+                if pattern[end] == "\\":
+                    escaped = pattern[end + 1 : end + 2]
+                    if escaped.isalnum() and escaped not in _SHARED_REGEX_ESCAPES:
+                        raise UnsupportedFilter(pattern)
+                    end += 1
+                end += 1
+            translated += pattern[index : end + 1]
+            index = end + 1
+        elif character == "(" and pattern[index + 1 : index + 2] == "?":
+            if not pattern.startswith(_SHARED_REGEX_GROUPS, index + 2):
+                raise UnsupportedFilter(pattern)
+            translated += character
+            index += 1
+        elif character == "$":
+            # Python's $ also matches before a trailing newline
+            translated += "\\Z"
+            index += 1
+        else:
+            translated += character
+            index += 1
+    # In Postgres . matches newlines too
+    return _compile_regex(translated, re.DOTALL)
+
+
+def _regex_matches(pattern: Pattern, text: Optional[str]) -> bool:
+    return text is not None and pattern.search(text) is not None
+
+
+def _like_to_regex(pattern: str) -> str:
+    regex = ""
+    escaped = False
+    for character in pattern:
+        if escaped:
+            regex += re.escape(character)
+            escaped = False
+        elif character == "\\":
+            escaped = True
+        elif character == "%":
+            regex += ".*"
+        elif character == "_":
+            regex += "."
+        else:
+            regex += re.escape(character)
+    return "^" + regex + "$"
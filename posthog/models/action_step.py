@@ -1,5 +1,9 @@
 from django.contrib.postgres.fields import JSONField
 from django.db import connection, models, transaction
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .action import Action
 
 
 class ActionStep(models.Model):
@@ -23,3 +27,10 @@ class ActionStep(models.Model):
     name: models.CharField = models.CharField(max_length=400, null=True, blank=True)
     event: models.CharField = models.CharField(max_length=400, null=True, blank=True)
     properties: JSONField = JSONField(default=list, null=True, blank=True)
+
+
+@receiver(models.signals.post_save, sender=ActionStep)
+@receiver(models.signals.post_delete, sender=ActionStep)
+def action_step_changed(sender, instance: ActionStep, **kwargs) -> None:
+    # Matches stored for the old steps are outdated
+    Action.objects.filter(pk=instance.action_id).update(events_calculated_until=None, updated_at=timezone.now())
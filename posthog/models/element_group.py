@@ -1,43 +1,112 @@
 import hashlib
 import json
-from typing import Any, Dict, List
+import threading
+from typing import Any, Dict, List, Optional, Tuple
 
 from django.db import models, transaction
-from django.forms.models import model_to_dict
 
 from .element import Element
 from .team import Team
 
+# LRU cache of group ids by team and hash, so elements seen before don't need any queries. Groups are only deleted
+# together with their team, so entries never go stale.
+ELEMENT_GROUP_CACHE: Dict[Tuple[int, str], int] = {}
+ELEMENT_GROUP_CACHE_MAX_SIZE = 10000
 
-def hash_elements(elements: List) -> str:
-    elements_list: List[Dict] = []
-    for element in elements:
-        el_dict = model_to_dict(element)
-        [el_dict.pop(key) for key in ["event", "id", "group"]]
-        elements_list.append(el_dict)
+_element_group_cache_lock = threading.Lock()
+
+
+def hash_elements(elements: List[Element]) -> str:
+    # Same as hashing model_to_dict of each element without event, id and group, which existing hashes were made with
+    elements_list = [
+        {
+            "attr_class": element.attr_class,
+            "attr_id": element.attr_id,
+            "attributes": element.attributes,
+            "href": element.href,
+            "nth_child": element.nth_child,
+            "nth_of_type": element.nth_of_type,
+            "order": element.order,
+            "tag_name": element.tag_name,
+            "text": element.text,
+        }
+        for element in elements
+    ]
     return hashlib.md5(json.dumps(elements_list, sort_keys=True, default=str).encode("utf-8")).hexdigest()
 
 
+def get_cached_group_id(team_id: int, elements_hash: str) -> Optional[int]:
+    key = (team_id, elements_hash)
+    with _element_group_cache_lock:
+        group_id = ELEMENT_GROUP_CACHE.pop(key, None)
+        if group_id is not None:
+            # Re-inserted to mark it as most recently used
+            ELEMENT_GROUP_CACHE[key] = group_id
+    return group_id
+
+
+def cache_group_id(team_id: int, elements_hash: str, group_id: int) -> None:
+    def add_to_cache() -> None:
+        with _element_group_cache_lock:
+            ELEMENT_GROUP_CACHE[(team_id, elements_hash)] = group_id
+            while len(ELEMENT_GROUP_CACHE) > ELEMENT_GROUP_CACHE_MAX_SIZE:
+                ELEMENT_GROUP_CACHE.pop(next(iter(ELEMENT_GROUP_CACHE)))
+
+    # Groups created in a transaction that's rolled back must not be cached
+    transaction.on_commit(add_to_cache)
+
+
 class ElementGroupManager(models.Manager):
     def create(self, *args: Any, **kwargs: Any):
         elements = kwargs.pop("elements")
+        team_id = kwargs["team"].pk if kwargs.get("team") else kwargs["team_id"]
+        for index, element in enumerate(elements):
+            element.order = index
+        kwargs["hash"] = hash_elements(elements)
+        group_id = get_cached_group_id(team_id, kwargs["hash"])
+        if group_id is not None:
+            return ElementGroup(pk=group_id, team_id=team_id, hash=kwargs["hash"])
         with transaction.atomic():
-            for index, element in enumerate(elements):
-                element.order = index
-            kwargs["hash"] = hash_elements(elements)
             try:
                 with transaction.atomic():
                     group = super().create(*args, **kwargs)
             except:
-                return ElementGroup.objects.get(
-                    hash=kwargs["hash"], team_id=kwargs["team"].pk if kwargs.get("team") else kwargs["team_id"],
-                )
+                group = ElementGroup.objects.get(hash=kwargs["hash"], team_id=team_id)
+                cache_group_id(team_id, group.hash, group.pk)
+                return group
             for index, element in enumerate(elements):
                 element.group = group
                 setattr(element, "pk", None)
             Element.objects.bulk_create(elements)
+            cache_group_id(team_id, group.hash, group.pk)
             return group
 
+    def get_or_create_hashes(self, team: Team, elements_lists: List[Optional[List[Element]]]) -> List[Optional[str]]:
+        """
+        Returns the group hash for each list of elements (None for empty lists),
+        looking up groups that aren't cached with one query and only creating the missing ones.
+        """
+        hashes: List[Optional[str]] = []
+        groups: Dict[str, List[Element]] = {}
+        for elements in elements_lists:
+            if not elements:
+                hashes.append(None)
+                continue
+            for index, element in enumerate(elements):
+                element.order = index
+            elements_hash = hash_elements(elements)
+            hashes.append(elements_hash)
+            if get_cached_group_id(team.pk, elements_hash) is None:
+                groups[elements_hash] = elements
+        if groups:
+            existing = dict(self.filter(team=team, hash__in=list(groups.keys())).values_list("hash", "id"))
+            for elements_hash, elements in groups.items():
+                if elements_hash in existing:
+                    cache_group_id(team.pk, elements_hash, existing[elements_hash])
+                else:
+                    self.create(team=team, elements=elements)
+        return hashes
+
 
 class ElementGroup(models.Model):
     class Meta:
@@ -1,37 +1,31 @@
 import copy
 import datetime
+import json
 import re
-from collections import defaultdict
 from typing import Any, Dict, List, Optional, Tuple, Union
 
 import celery
 from django.conf import settings
 from django.contrib.postgres.fields import JSONField
-from django.db import connection, models, transaction
-from django.db.models import Exists, F, OuterRef, Prefetch, Q, QuerySet, Subquery
+from django.db import models, transaction
+from django.db.models import Exists, F, OuterRef, Q, QuerySet, Subquery
 from django.forms.models import model_to_dict
 from django.utils import timezone
 
 from posthog.ee import is_ee_enabled
 
 from .action import Action
+from .action_matcher import matching_actions
 from .action_step import ActionStep
 from .element import Element
 from .element_group import ElementGroup
 from .filter import Filter
 from .person import Person, PersonDistinctId
 from .team import Team
-from .utils import namedtuplefetchall
 
 attribute_regex = r"([a-zA-Z]*)\[(.*)=[\'|\"](.*)[\'|\"]\]"
 
 
-LAST_UPDATED_TEAM_ACTION: Dict[int, datetime.datetime] = {}
-TEAM_EVENT_ACTION_QUERY_CACHE: Dict[int, Dict[str, tuple]] = defaultdict(dict)
-# TEAM_EVENT_ACTION_QUERY_CACHE looks like team_id -> event ex('$pageview') -> query
-TEAM_ACTION_QUERY_CACHE: Dict[int, str] = {}
-
-
 class SelectorPart(object):
     direct_descendant = False
     unique_order = 0
@@ -82,6 +76,26 @@ class SelectorPart(object):
             params.append(value)
         return {"where": where, "params": params}
 
+    def matches(self, element: Element) -> bool:
+        """Evaluates `extra_query` against an element in memory"""
+        for key, value in self.data.items():
+            if "attr__" in key:
+                attribute = (element.attributes or {}).get("attr__{}".format(key.split("attr__")[1]))
+                if attribute is None or (attribute if isinstance(attribute, str) else json.dumps(attribute)) != value:
+                    return False
+            elif key == "attr_class__contains":
+                if element.attr_class is None or not set(value).issubset(element.attr_class):
+                    return False
+            elif key == "nth_child":
+                try:
+                    if element.nth_child != int(str(value)):
+                        return False
+                except ValueError:
+                    return False
+            elif getattr(element, key) != value:
+                return False
+        return True
+
 
 class Selector(object):
     parts: List[SelectorPart] = []
@@ -102,6 +116,33 @@ class Selector(object):
             part.unique_order = len([p for p in self.parts if p.data == part.data])
             self.parts.append(copy.deepcopy(part))
 
+    def matches(self, elements: List[Element]) -> bool:
+        """
+        Matches the elements of an event in memory, the same way as the subqueries of `EventManager._element_subquery`.
+        Each part picks its `unique_order`-th matching element, which then has to be the parent (for direct
+        descendants) or any ancestor of the element picked by the previous part.
+        """
+        positions = sorted(
+            (
+                (element.order if element.order is not None else index, element)
+                for index, element in enumerate(elements)
+            ),
+            key=lambda position: position[0],
+        )
+        previous_order: Optional[int] = None
+        for part in self.parts:
+            orders = [order for order, element in positions if part.matches(element)]
+            if len(orders) <= part.unique_order:
+                return False
+            order = orders[part.unique_order]
+            if previous_order is not None:
+                if part.direct_descendant and order != previous_order + 1:
+                    return False
+                if not part.direct_descendant and order <= previous_order:
+                    return False
+            previous_order = order
+        return True
+
 
 class EventManager(models.QuerySet):
     def _element_subquery(self, selector: Selector) -> Tuple[Dict[str, Subquery], Dict[str, Union[F, bool]]]:
@@ -171,6 +212,13 @@ class EventManager(models.QuerySet):
             return {"created_at__gte": start}
         return {"created_at__gte": start, "created_at__lte": end}
 
+    def last_id_created_before(self, time: datetime.datetime) -> Optional[int]:
+        """
+        Events are inserted in short transactions, so ids up to the returned one have all been committed, while ids
+        of events created right before a query may still appear out of order.
+        """
+        return self.filter(created_at__lt=time).order_by("-id").values_list("id", flat=True).first()
+
     def add_person_id(self, team_id: int):
         return self.annotate(
             person_id=Subquery(
@@ -222,37 +270,60 @@ class EventManager(models.QuerySet):
 
     def create(self, site_url: Optional[str] = None, *args: Any, **kwargs: Any):
         with transaction.atomic():
+            elements: Optional[List[Element]] = None
             if kwargs.get("elements"):
+                elements = kwargs.pop("elements")
                 if kwargs.get("team"):
-                    kwargs["elements_hash"] = ElementGroup.objects.create(
-                        team=kwargs["team"], elements=kwargs.pop("elements")
-                    ).hash
+                    kwargs["elements_hash"] = ElementGroup.objects.create(team=kwargs["team"], elements=elements).hash
                 else:
                     kwargs["elements_hash"] = ElementGroup.objects.create(
-                        team_id=kwargs["team_id"], elements=kwargs.pop("elements")
+                        team_id=kwargs["team_id"], elements=elements
                     ).hash
             event = super().create(*args, **kwargs)
-
-            # Matching actions to events can get very expensive to do as events are streaming in
-            # In a few cases we have had it OOM Postgres with the query it is running
-            # Short term solution is to have this be configurable to be run in batch
-            if not settings.ASYNC_EVENT_ACTION_MAPPING:
-                should_post_webhook = False
-                relations = []
-                for action in event.actions:
-                    relations.append(action.events.through(action_id=action.pk, event_id=event.pk))
-                    action.on_perform(event)
-                    if action.post_to_slack:
-                        should_post_webhook = True
-                Action.events.through.objects.bulk_create(relations, ignore_conflicts=True)
-                team = kwargs.get("team", event.team)
-                if (
-                    should_post_webhook and team and team.slack_incoming_webhook and not is_ee_enabled()
-                ):  # ee will handle separately
-                    celery.current_app.send_task("posthog.tasks.webhooks.post_event_to_webhook", (event.pk, site_url))
-
+            self._map_actions(event, kwargs.get("team", event.team), site_url, elements)
             return event
 
+    def bulk_create_with_elements(
+        self,
+        team: Team,
+        events: List["Event"],
+        elements_lists: List[Optional[List[Element]]],
+        site_url: Optional[str] = None,
+    ) -> List["Event"]:
+        """
+        Creates events in one INSERT, resolving all their element groups with set-based queries.
+        `elements_lists` is aligned with `events`.
+        """
+        with transaction.atomic():
+            hashes = ElementGroup.objects.get_or_create_hashes(team=team, elements_lists=elements_lists)
+            for event, elements_hash in zip(events, hashes):
+                event.elements_hash = elements_hash
+            created = self.bulk_create(events)
+            for event, elements in zip(created, elements_lists):
+                self._map_actions(event, team, site_url, elements or [])
+            return created
+
+    def _map_actions(
+        self, event: "Event", team: Optional[Team], site_url: Optional[str], elements: Optional[List[Element]] = None,
+    ) -> None:
+        # Matching actions to events can get very expensive to do as events are streaming in
+        # In a few cases we have had it OOM Postgres with the query it is running
+        # Short term solution is to have this be configurable to be run in batch
+        if settings.ASYNC_EVENT_ACTION_MAPPING:
+            return
+        should_post_webhook = False
+        relations = []
+        for action in matching_actions(event, elements):
+            relations.append(action.events.through(action_id=action.pk, event_id=event.pk))
+            action.on_perform(event)
+            if action.post_to_slack:
+                should_post_webhook = True
+        Action.events.through.objects.bulk_create(relations, ignore_conflicts=True)
+        if (
+            should_post_webhook and team and team.slack_incoming_webhook and not is_ee_enabled()
+        ):  # ee will handle separately
+            celery.current_app.send_task("posthog.tasks.webhooks.post_event_to_webhook", (event.pk, site_url))
+
 
 class Event(models.Model):
     class Meta:
@@ -261,96 +332,16 @@ class Event(models.Model):
             models.Index(fields=["timestamp", "team_id", "event"]),
         ]
 
-    def _can_use_cached_query(self, last_updated_action_ts):
-        if not self.team_id in LAST_UPDATED_TEAM_ACTION:
-            return False
-
-        if not self.team_id in TEAM_EVENT_ACTION_QUERY_CACHE:
-            return False
-
-        if not self.event in TEAM_EVENT_ACTION_QUERY_CACHE[self.team_id]:
-            return False
-
-        if not self.team_id in TEAM_ACTION_QUERY_CACHE:
-            return False
-
-        # Cache is expired because actions were updated
-        if last_updated_action_ts > LAST_UPDATED_TEAM_ACTION[self.team_id]:
-            return False
-        return True
-
     @property
     def person(self):
         return Person.objects.get(
             team_id=self.team_id, persondistinctid__team_id=self.team_id, persondistinctid__distinct_id=self.distinct_id
         )
 
-    # This (ab)uses query_db_by_action to find which actions match this event
-    # We can't use filter_by_action here, as we use this function when we create an event so
-    # the event won't be in the Action-Event relationship yet.
-    # We use query caching to reduce the time spent on generating redundant queries
+    # Actions are matched in memory, without querying the event, so this can be used when events are created
     @property
     def actions(self) -> List:
-        last_updated_action_ts = Action.objects.filter(team_id=self.team_id).aggregate(models.Max("updated_at"))[
-            "updated_at__max"
-        ]
-
-        actions = (
-            Action.objects.filter(
-                team_id=self.team_id, steps__event=self.event, deleted=False,  # filter by event name to narrow down
-            )
-            .distinct("id")
-            .prefetch_related(Prefetch("steps", queryset=ActionStep.objects.order_by("id")))
-        )
-        if not self._can_use_cached_query(last_updated_action_ts):
-            TEAM_ACTION_QUERY_CACHE[self.team_id], _ = actions.query.sql_with_params()
-            if len(actions) == 0:
-                return []
-            events: models.QuerySet[Any] = Event.objects.filter(pk=self.pk)
-            for action in actions:
-                events = events.annotate(
-                    **{
-                        "action_{}".format(action.pk): Event.objects.filter(pk=self.pk)
-                        .query_db_by_action(action)
-                        .values("id")[:1]
-                    }
-                )
-            # This block is a little cryptic so bear with me
-            # We grab the query and the params from the ORM here
-            q, p = events.query.sql_with_params()
-
-            # We then take the parameters and replace the event id's with a placeholder
-            # We use this later to sub back in future event id's
-            # The rest of the parameters are shared between action types
-            qp = tuple(["%s" if i == self.pk else i for i in p])
-
-            # Create a cache item and add it to the cache keyed on team_id and event id
-            qcache = {self.event: (q, qp)}
-            TEAM_EVENT_ACTION_QUERY_CACHE[self.team_id].update(qcache)
-
-            # Update the last updated team action timestamp for future reference
-            LAST_UPDATED_TEAM_ACTION[self.team_id] = last_updated_action_ts
-        else:
-
-            # If we have reached this block we are about to use the sql query cache
-            # Grab the actions using the cached action query
-            actions.raw(TEAM_ACTION_QUERY_CACHE[self.team_id])
-
-            # Grab the cached query and query params, we will need to replace some params
-            q, p = TEAM_EVENT_ACTION_QUERY_CACHE[self.team_id][self.event]
-
-            # Replace the query param placeholders with the event id (opposite of what we did above)
-            qp = tuple([self.pk if i == "%s" else i for i in p])
-
-            with connection.cursor() as cursor:
-                # Format and execute the cached query using the mostly cached params
-                qstring = cursor.mogrify(q, qp)
-                cursor.execute(qstring)
-                events = namedtuplefetchall(cursor)
-
-        event = [event for event in events][0]
-        filtered_actions = [action for action in actions if getattr(event, "action_{}".format(action.pk), None)]
-        return filtered_actions
+        return matching_actions(self)
 
     created_at: models.DateTimeField = models.DateTimeField(auto_now_add=True, null=True, blank=True)
     objects: EventManager = EventManager.as_manager()  # type: ignore
@@ -1,10 +1,93 @@
-from typing import Any, List
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 
 from django.apps import apps
 from django.contrib.postgres.fields import JSONField
-from django.db import models, transaction
+from django.db import IntegrityError, connection, models, transaction
+from django.dispatch import receiver
+from psycopg2.extras import Json
 
+from posthog.local_cache import LocalCache
 from posthog.models.utils import UUIDT
+from posthog.redis import get_client
+
+# Process-local LRU cache of (team_id, distinct_id) -> person_id for ingestion, backed by a Redis hash per team that's
+# shared between processes. None marks a distinct_id without a person. Those are only cached locally, as people can be
+# created without going through the ORM (e.g. bulk_create), and creating one then fails with an IntegrityError instead.
+# Local entries may go stale for up to PERSON_ID_CACHE_TTL_SECONDS when another process merges people, so callers
+# need to handle a person_id that no longer exists.
+PERSON_ID_CACHE_TTL_SECONDS = 30
+PERSON_ID_CACHE_MAX_SIZE = 10000
+PERSON_ID_CACHE: LocalCache[Tuple[int, str], Optional[int]] = LocalCache(
+    PERSON_ID_CACHE_MAX_SIZE, PERSON_ID_CACHE_TTL_SECONDS
+)
+PERSON_ID_REDIS_KEY = "person_ids:{}"
+PERSON_ID_REDIS_TTL_SECONDS = 60 * 60 * 24
+
+# Sets the target (first id) to the union of everyone's properties, keys of earlier people winning, and the oldest
+# created_at of them all
+MERGE_PEOPLE_SQL = """
+UPDATE posthog_person
+SET
+    properties = COALESCE((
+        SELECT jsonb_object_agg(key, value)
+        FROM (
+            SELECT DISTINCT ON (key) key, value
+            FROM unnest(%(person_ids)s::integer[]) WITH ORDINALITY AS people(id, priority)
+            JOIN posthog_person ON posthog_person.id = people.id
+            CROSS JOIN jsonb_each(posthog_person.properties)
+            ORDER BY key, priority
+        ) AS merged_properties
+    ), '{}'::jsonb),
+    created_at = (SELECT MIN(created_at) FROM posthog_person WHERE id = ANY(%(person_ids)s::integer[]))
+WHERE id = %(target_id)s
+RETURNING properties, created_at
+"""
+
+
+def _get_cached_person_ids(team_id: int, distinct_ids: Iterable[str]) -> Dict[str, Optional[int]]:
+    cached = PERSON_ID_CACHE.get_many((team_id, distinct_id) for distinct_id in distinct_ids)
+    return {distinct_id: person_id for (_, distinct_id), person_id in cached.items()}
+
+
+def _cache_person_ids(team_id: int, person_ids: Dict[str, Optional[int]]) -> None:
+    PERSON_ID_CACHE.set_many({(team_id, distinct_id): person_id for distinct_id, person_id in person_ids.items()})
+
+
+def invalidate_person_id_cache(team_id: int, distinct_ids: Iterable[str]) -> None:
+    distinct_ids = list(distinct_ids)
+    if not distinct_ids:
+        return
+    PERSON_ID_CACHE.delete((team_id, distinct_id) for distinct_id in distinct_ids)
+    get_client().hdel(PERSON_ID_REDIS_KEY.format(team_id), *distinct_ids)
+
+
+def invalidate_person_id_cache_on_commit(team_id: int, distinct_ids: Iterable[str]) -> None:
+    """
+    Invalidates the person ids of distinct_ids whose person is being changed in the current transaction. Until the
+    change is committed, a concurrent reader could still cache the old person, so the cache is only invalidated
+    everywhere after the commit. Local entries are dropped right away too, so this process doesn't read them meanwhile.
+    """
+    distinct_ids = list(distinct_ids)
+    if not distinct_ids:
+        return
+    PERSON_ID_CACHE.delete((team_id, distinct_id) for distinct_id in distinct_ids)
+    transaction.on_commit(lambda: invalidate_person_id_cache(team_id, distinct_ids))
+
+
+# Applies $set with jsonb concatenation, skipping the write when it wouldn't change anything. Values are compared per
+# key, as containment (@>) would also hold for a value narrowed to part of an array or object.
+UPDATE_PERSON_PROPERTIES_SQL = """
+UPDATE posthog_person
+SET properties = properties || %(properties)s, is_identified = is_identified OR %(is_identified)s
+WHERE id = %(person_id)s AND (
+    EXISTS (
+        SELECT 1 FROM jsonb_each(%(properties)s) AS new_properties
+        WHERE posthog_person.properties -> new_properties.key IS DISTINCT FROM new_properties.value
+    )
+    OR (%(is_identified)s AND NOT is_identified)
+)
+RETURNING *
+"""
 
 
 class PersonManager(models.Manager):
@@ -21,6 +104,87 @@ class PersonManager(models.Manager):
     def distinct_ids_exist(team_id: int, distinct_ids: List[str]) -> bool:
         return PersonDistinctId.objects.filter(team_id=team_id, distinct_id__in=distinct_ids).exists()
 
+    def update_properties(self, person_id: int, properties: Dict, is_identified: bool = False) -> bool:
+        """
+        Merges `properties` into the person's and optionally marks them as identified in a single UPDATE,
+        without reading the row first. Returns False if the person doesn't exist.
+        """
+        updated = list(
+            self.raw(
+                UPDATE_PERSON_PROPERTIES_SQL,
+                {"person_id": person_id, "properties": Json(properties), "is_identified": is_identified},
+            )
+        )
+        if not updated:
+            # Either nothing changed or the person is gone
+            return self.filter(pk=person_id).exists()
+        # Keeps ClickHouse in sync, as a save() would
+        models.signals.post_save.send(
+            sender=self.model,
+            instance=updated[0],
+            created=False,
+            update_fields=["properties", "is_identified"],
+            raw=False,
+            using=connection.alias,
+        )
+        return True
+
+    @staticmethod
+    def get_person_ids(team_id: int, distinct_ids: Iterable[str]) -> Dict[str, Optional[int]]:
+        """
+        Resolves distinct_ids to person ids, None for distinct_ids without a person.
+        Looks in the local cache first, then Redis, and queries Postgres once for the rest.
+        """
+        distinct_ids = list(dict.fromkeys(distinct_ids))
+        person_ids = _get_cached_person_ids(team_id, distinct_ids)
+        missing = [distinct_id for distinct_id in distinct_ids if distinct_id not in person_ids]
+        if not missing:
+            return person_ids
+
+        redis_key = PERSON_ID_REDIS_KEY.format(team_id)
+        from_redis = {
+            distinct_id: int(person_id)
+            for distinct_id, person_id in zip(missing, get_client().hmget(redis_key, missing))
+            if person_id is not None
+        }
+        missing = [distinct_id for distinct_id in missing if distinct_id not in from_redis]
+
+        from_db: Dict[str, Optional[int]] = {distinct_id: None for distinct_id in missing}
+        if missing:
+            from_db.update(
+                PersonDistinctId.objects.filter(team_id=team_id, distinct_id__in=missing).values_list(
+                    "distinct_id", "person_id"
+                )
+            )
+            found = {distinct_id: person_id for distinct_id, person_id in from_db.items() if person_id is not None}
+            if found:
+                pipeline = get_client().pipeline(transaction=False)
+                pipeline.hmset(redis_key, found)
+                pipeline.expire(redis_key, PERSON_ID_REDIS_TTL_SECONDS)
+                pipeline.execute()
+
+        _cache_person_ids(team_id, {**from_redis, **from_db})
+        return {**person_ids, **from_redis, **from_db}
+
+    def get_person_id(self, team_id: int, distinct_id: str) -> Optional[int]:
+        return self.get_person_ids(team_id, [distinct_id])[distinct_id]
+
+    def get_or_create_person_id(self, team_id: int, distinct_id: str) -> Tuple[int, bool]:
+        person_id = self.get_person_id(team_id, distinct_id)
+        if person_id is not None:
+            return person_id, False
+        try:
+            person = self.create(team_id=team_id, distinct_ids=[distinct_id])
+        # Catch race condition where in between getting and creating, another request already created this person
+        except IntegrityError:
+            invalidate_person_id_cache(team_id, [distinct_id])
+            person_id = self.get_person_id(team_id, distinct_id)
+            if person_id is None:
+                raise
+            return person_id, False
+        _cache_person_ids(team_id, {distinct_id: person.pk})
+        return person.pk, True
+
 
 class Person(models.Model):
     @property
@@ -36,33 +200,55 @@ class Person(models.Model):
         for distinct_id in distinct_ids:
             self.add_distinct_id(distinct_id)
 
-    def merge_people(self, people_to_merge: List["Person"]):
-        CohortPeople = apps.get_model(app_label="posthog", model_name="CohortPeople")
+    def merge_people(self, people_to_merge: Iterable["Person"]) -> None:
+        self.merge_people_by_id([person.pk for person in people_to_merge])
 
-        first_seen = self.created_at
+    def merge_people_by_id(self, person_ids: List[int]) -> None:
+        """
+        Merges the given people into this one with set-based queries, holding a row lock on all of them.
+        Properties of this person win over those of the merged people, which win in list order.
+        The oldest created_at is kept.
+        """
+        CohortPeople = apps.get_model(app_label="posthog", model_name="CohortPeople")
 
-        # merge the properties
-        for other_person in people_to_merge:
-            self.properties = {**other_person.properties, **self.properties}
-            if other_person.created_at < first_seen:
-                # Keep the oldest created_at (i.e. the first time we've seen this person)
-                first_seen = other_person.created_at
-        self.created_at = first_seen
-        self.save()
+        person_ids = [person_id for person_id in dict.fromkeys(person_ids) if person_id != self.pk]
+        if not person_ids:
+            return
 
-        # merge the distinct_ids
-        for other_person in people_to_merge:
-            other_person_distinct_ids = PersonDistinctId.objects.filter(person=other_person, team_id=self.team_id)
-            for person_distinct_id in other_person_distinct_ids:
-                person_distinct_id.person = self
-                person_distinct_id.save()
+        with transaction.atomic():
+            # Lock in a consistent order so concurrent merges of the same people can't deadlock
+            list(
+                Person.objects.select_for_update()
+                .filter(pk__in=[self.pk, *person_ids])
+                .order_by("pk")
+                .values_list("pk", flat=True)
+            )
+            with connection.cursor() as cursor:
+                cursor.execute(MERGE_PEOPLE_SQL, {"target_id": self.pk, "person_ids": [self.pk, *person_ids]})
+                self.properties, self.created_at = cursor.fetchone()
 
-            other_person_cohort_ids = CohortPeople.objects.filter(person=other_person)
-            for person_cohort_id in other_person_cohort_ids:
-                person_cohort_id.person = self
-                person_cohort_id.save()
+            distinct_ids = PersonDistinctId.objects.filter(team_id=self.team_id, person_id__in=person_ids)
+            moved_distinct_ids = list(distinct_ids.values_list("pk", "distinct_id"))
+            distinct_ids.update(person_id=self.pk)
+            CohortPeople.objects.filter(person_id__in=person_ids).update(person_id=self.pk)
+            Person.objects.filter(pk__in=person_ids).delete()
 
-            other_person.delete()
+            invalidate_person_id_cache_on_commit(self.team_id, [distinct_id for _, distinct_id in moved_distinct_ids])
+            # Updates skip model signals, which keep ClickHouse in sync. The person id cache is already invalidated
+            # for all moved distinct_ids at once above.
+            models.signals.post_save.send(
+                sender=Person, instance=self, created=False, update_fields=None, raw=False, using=connection.alias
+            )
+            for pk, distinct_id in moved_distinct_ids:
+                models.signals.post_save.send(
+                    sender=PersonDistinctId,
+                    instance=PersonDistinctId(pk=pk, team=self.team, person=self, distinct_id=distinct_id),
+                    created=False,
+                    update_fields=["person"],
+                    raw=False,
+                    using=connection.alias,
+                    person_id_cache_invalidated=True,
+                )
 
     objects = PersonManager()
     created_at: models.DateTimeField = models.DateTimeField(auto_now_add=True, blank=True)
@@ -80,3 +266,11 @@ class PersonDistinctId(models.Model):
     team: models.ForeignKey = models.ForeignKey("Team", on_delete=models.CASCADE)
     person: models.ForeignKey = models.ForeignKey(Person, on_delete=models.CASCADE)
     distinct_id: models.CharField = models.CharField(max_length=400)
+
+
+@receiver(models.signals.post_save, sender=PersonDistinctId)
+@receiver(models.signals.post_delete, sender=PersonDistinctId)
+def person_distinct_id_changed(sender, instance: PersonDistinctId, **kwargs) -> None:
+    if kwargs.get("person_id_cache_invalidated"):
+        return
+    invalidate_person_id_cache_on_commit(instance.team_id, [instance.distinct_id])
@@ -1,12 +1,16 @@
-from typing import Any, Dict, List, Optional
+import copy
+from typing import Any, Dict, List, Optional, Tuple
 
 import posthoganalytics
+from django.conf import settings
 from django.contrib.postgres.fields import ArrayField, JSONField
-from django.db import models
+from django.db import models, transaction
+from django.dispatch import receiver
 from django.utils import timezone
 
 from posthog.constants import TREND_FILTER_TYPE_EVENTS, TRENDS_LINEAR
 from posthog.helpers.dashboard_templates import create_dashboard_from_template
+from posthog.local_cache import CacheInvalidationListener, LocalCache
 
 from .action import Action
 from .action_step import ActionStep
@@ -15,7 +19,38 @@ from .dashboard_item import DashboardItem
 from .personal_api_key import PersonalAPIKey
 from .utils import UUIDT, generate_random_token, sane_repr
 
-TEAM_CACHE: Dict[str, "Team"] = {}
+# Process-local LRU cache of teams for the ingestion hot path, keyed by "token:<api_token>" and "pk:<id>".
+# Entries expire after TEAM_CACHE_TTL_SECONDS and are invalidated across processes through Redis pub/sub once a save
+# is committed. Every caller gets its own shallow copy of the cached team, so it mustn't mutate lists or dicts in place.
+TEAM_CACHE_TTL_SECONDS = 60
+TEAM_CACHE_MAX_SIZE = 1000
+TEAM_CACHE: LocalCache[str, "Team"] = LocalCache(TEAM_CACHE_MAX_SIZE, TEAM_CACHE_TTL_SECONDS)
+
+
+def _get_cached_team(key: str) -> Optional["Team"]:
+    team = TEAM_CACHE.get(key)
+    # The cached instance is shared between threads
+    return copy.copy(team) if team is not None else None
+
+
+def _cache_team(team: "Team") -> None:
+    _team_cache_invalidation.start()
+    cached = copy.copy(team)
+    TEAM_CACHE.set_many({"token:{}".format(team.api_token): cached, "pk:{}".format(team.pk): cached})
+
+
+def invalidate_team_cache(team_id: int, api_token: Optional[str] = None) -> None:
+    TEAM_CACHE.delete_where(
+        lambda key, team: team.pk == team_id or (api_token is not None and key == "token:{}".format(api_token))
+    )
+
+
+_team_cache_invalidation = CacheInvalidationListener(
+    settings.TEAM_CACHE_PUBSUB_CHANNEL,
+    name="team-cache-invalidation",
+    invalidate=lambda message: invalidate_team_cache(int(message)),
+    on_subscribe=TEAM_CACHE.clear,
+)
 
 
 class TeamManager(models.Manager):
@@ -71,12 +106,23 @@ class TeamManager(models.Manager):
 
         return team
 
+    def get_cached(self, team_id: int) -> "Team":
+        team = _get_cached_team("pk:{}".format(team_id))
+        if team is None:
+            team = self.get(pk=team_id)
+            _cache_team(team)
+        return team
+
     def get_team_from_token(self, token: str, is_personal_api_key: bool = False) -> Optional["Team"]:
         if not is_personal_api_key:
+            team = _get_cached_team("token:{}".format(token))
+            if team is not None:
+                return team
             try:
                 team = Team.objects.get(api_token=token)
             except Team.DoesNotExist:
                 return None
+            _cache_team(team)
         else:
             try:
                 personal_api_key = (
@@ -140,3 +186,18 @@ class Team(models.Model):
         return str(self.pk)
 
     __repr__ = sane_repr("uuid", "name", "api_token")
+
+
+@receiver(models.signals.post_save, sender=Team)
+@receiver(models.signals.post_delete, sender=Team)
+def team_saved(sender, instance: Team, **kwargs) -> None:
+    team_id, api_token = instance.pk, instance.api_token
+    # Until the transaction commits, other threads and processes can still load the old row and cache it, so the cache
+    # is invalidated everywhere once it has. Local entries are dropped right away too, so this thread doesn't read them.
+    invalidate_team_cache(team_id, api_token)
+
+    def invalidate_everywhere() -> None:
+        invalidate_team_cache(team_id, api_token)
+        _team_cache_invalidation.publish(team_id)
+
+    transaction.on_commit(invalidate_everywhere)
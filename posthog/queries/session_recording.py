@@ -1,21 +1,57 @@
 import datetime
-from typing import Any, Callable, Dict, List
+from typing import Any, Callable, Dict, List, Optional, Tuple, cast
 
 from django.db.models import F, Max, Min
 
+from posthog.helpers.session_recording import decompress_chunked_snapshot_data
 from posthog.models import Filter, SessionRecordingEvent, Team
 from posthog.queries.base import BaseQuery
 
 
 class SessionRecording(BaseQuery):
-    def query_recording_snapshots(self, team: Team, session_id: str) -> List[Any]:
+    def query_recording_snapshots(
+        self,
+        team: Team,
+        session_id: str,
+        after: Optional[datetime.datetime] = None,
+        until: Optional[datetime.datetime] = None,
+        limit: Optional[int] = None,
+    ) -> List[Tuple[datetime.datetime, Any]]:
+        """(timestamp, snapshot_data) of the session's rows with `after < timestamp <= until`, ordered by timestamp"""
         events = SessionRecordingEvent.objects.filter(team=team, session_id=session_id)
-        return [e.snapshot_data for e in events]
+        if after is not None:
+            events = events.filter(timestamp__gt=after)
+        if until is not None:
+            events = events.filter(timestamp__lte=until)
+        rows = events.order_by("timestamp").values_list("timestamp", "snapshot_data")[:limit]
+        return cast(List[Tuple[datetime.datetime, Any]], list(rows))
 
     def run(self, filter: Filter, team: Team, *args, **kwargs) -> List[Dict[str, Any]]:
-        return list(
-            sorted(self.query_recording_snapshots(team, kwargs["session_recording_id"]), key=lambda s: s["timestamp"])
-        )
+        rows = self.query_recording_snapshots(team, kwargs["session_recording_id"])
+        return _sorted_snapshots(rows)
+
+    def run_page(
+        self, team: Team, session_id: str, after: Optional[datetime.datetime], limit: int
+    ) -> Tuple[List[Dict[str, Any]], Optional[datetime.datetime]]:
+        """
+        Returns the snapshots of about `limit` rows after `after`, and the timestamp to fetch the next page after,
+        or None if this was the last page
+        """
+        rows = self.query_recording_snapshots(team, session_id, after=after, limit=limit)
+        if len(rows) < limit:
+            return _sorted_snapshots(rows), None
+
+        # Rows sharing the last timestamp, like the chunks of one snapshot, may continue past the limit.
+        # Fetch all of them, so they end up on the same page.
+        next_after = rows[-1][0]
+        rows = [row for row in rows if row[0] < next_after]
+        rows += self.query_recording_snapshots(team, session_id, after=rows[-1][0] if rows else after, until=next_after)
+        return _sorted_snapshots(rows), next_after
+
+
+def _sorted_snapshots(rows: List[Tuple[datetime.datetime, Any]]) -> List[Dict[str, Any]]:
+    snapshots = decompress_chunked_snapshot_data([snapshot_data for _, snapshot_data in rows])
+    return sorted(snapshots, key=lambda snapshot: snapshot["timestamp"])
 
 
 def query_sessions_in_range(team: Team, start_time: datetime.datetime, end_time: datetime.datetime) -> List[dict]:
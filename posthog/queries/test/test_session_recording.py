@@ -5,6 +5,7 @@ from django.utils.timezone import now
 from freezegun import freeze_time
 
 from posthog.api.test.base import BaseTest
+from posthog.helpers.session_recording import compress_and_chunk_snapshots
 from posthog.models import SessionRecordingEvent
 from posthog.queries.session_recording import SessionRecording, add_session_recording_ids
 
@@ -24,6 +25,51 @@ def session_recording_test_factory(session_recording, add_ids, event_factory):
                     [{"timestamp": 1_600_000_000}, {"timestamp": 1_600_000_010}, {"timestamp": 1_600_000_030},],
                 )
 
+        def test_query_run_with_chunked_snapshots(self):
+            with freeze_time("2020-09-13T12:26:40.000Z"):
+                snapshot = {"timestamp": 1_600_000_000, "data": [{"id": index} for index in range(500)]}
+                self.create_snapshot("user", "1", now() + relativedelta(seconds=10))
+                for _, event in compress_and_chunk_snapshots(
+                    [("user", {"event": "$snapshot", "properties": {"$session_id": "1", "$snapshot_data": snapshot}})],
+                    chunk_size=100,
+                ):
+                    event_factory(
+                        team_id=self.team.id,
+                        distinct_id="user",
+                        timestamp=now(),
+                        session_id="1",
+                        snapshot_data=event["properties"]["$snapshot_data"],
+                    )
+
+                snapshots = session_recording().run(team=self.team, filter=None, session_recording_id="1")
+                self.assertEqual(snapshots, [snapshot, {"timestamp": 1_600_000_010}])
+
+        def test_query_run_page(self):
+            with freeze_time("2020-09-13T12:26:40.000Z"):
+                snapshot = {"timestamp": 1_600_000_005, "data": [{"id": index} for index in range(500)]}
+                self.create_snapshot("user", "1", now())
+                # Chunks of one snapshot share their timestamp, so they can't be split across pages
+                for _, event in compress_and_chunk_snapshots(
+                    [("user", {"event": "$snapshot", "properties": {"$session_id": "1", "$snapshot_data": snapshot}})],
+                    chunk_size=100,
+                ):
+                    event_factory(
+                        team_id=self.team.id,
+                        distinct_id="user",
+                        timestamp=now() + relativedelta(seconds=5),
+                        session_id="1",
+                        snapshot_data=event["properties"]["$snapshot_data"],
+                    )
+                self.create_snapshot("user", "1", now() + relativedelta(seconds=10))
+                self.create_snapshot("user", "1", now() + relativedelta(seconds=20))
+
+                snapshots, after = session_recording().run_page(self.team, "1", after=None, limit=2)
+                self.assertEqual(snapshots, [{"timestamp": 1_600_000_000}, snapshot])
+                snapshots, after = session_recording().run_page(self.team, "1", after=after, limit=2)
+                self.assertEqual(snapshots, [{"timestamp": 1_600_000_010}, {"timestamp": 1_600_000_020}])
+                snapshots, after = session_recording().run_page(self.team, "1", after=after, limit=2)
+                self.assertEqual((snapshots, after), ([], None))
+
         def test_query_run_with_no_such_session(self):
             snapshots = session_recording().run(team=self.team, filter=None, session_recording_id="xxx")
             self.assertEqual(snapshots, [])
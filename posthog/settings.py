@@ -75,6 +75,9 @@ PLUGINS_CONFIGURE_VIA_API = PLUGINS_INSTALL_VIA_API or get_bool_from_env("PLUGIN
 PLUGINS_CELERY_QUEUE = os.environ.get("PLUGINS_CELERY_QUEUE", "posthog-plugins")
 PLUGINS_RELOAD_PUBSUB_CHANNEL = os.environ.get("PLUGINS_RELOAD_PUBSUB_CHANNEL", "reload-plugins")
 
+TEAM_CACHE_PUBSUB_CHANNEL = os.environ.get("TEAM_CACHE_PUBSUB_CHANNEL", "invalidate-team-cache")
+ACTION_MATCHER_PUBSUB_CHANNEL = os.environ.get("ACTION_MATCHER_PUBSUB_CHANNEL", "invalidate-action-matcher")
+
 # This is set as a cross-domain cookie with a random value.
 # Its existence is used by the toolbar to see that we are logged in.
 TOOLBAR_COOKIE_NAME = "phtoolbar"
@@ -113,6 +116,9 @@ ASYNC_EVENT_ACTION_MAPPING = False
 if get_bool_from_env("ASYNC_EVENT_ACTION_MAPPING", False):
     ASYNC_EVENT_ACTION_MAPPING = True
 
+# Max number of events the batch ingestion task writes to Postgres in a single INSERT
+EVENT_BATCH_SIZE = int(os.environ.get("EVENT_BATCH_SIZE", 500))
+
 
 # Clickhouse Settings
 CLICKHOUSE_TEST_DB = "posthog_test"
@@ -128,6 +134,14 @@ CLICKHOUSE_REPLICATION = get_bool_from_env("CLICKHOUSE_REPLICATION", False)
 CLICKHOUSE_ENABLE_STORAGE_POLICY = get_bool_from_env("CLICKHOUSE_ENABLE_STORAGE_POLICY", False)
 CLICKHOUSE_ASYNC = get_bool_from_env("CLICKHOUSE_ASYNC", False)
 
+# Without Kafka, events are buffered in-process and inserted into ClickHouse in bulk, whenever
+# CLICKHOUSE_BULK_INSERT_MAX_ROWS rows are buffered or every CLICKHOUSE_BULK_INSERT_MAX_WAIT_MS milliseconds.
+# Capturing blocks while CLICKHOUSE_BULK_INSERT_MAX_QUEUE_ROWS rows are waiting to be inserted.
+CLICKHOUSE_BULK_INSERT = get_bool_from_env("CLICKHOUSE_BULK_INSERT", not TEST)
+CLICKHOUSE_BULK_INSERT_MAX_ROWS = int(os.environ.get("CLICKHOUSE_BULK_INSERT_MAX_ROWS", 10000))
+CLICKHOUSE_BULK_INSERT_MAX_WAIT_MS = int(os.environ.get("CLICKHOUSE_BULK_INSERT_MAX_WAIT_MS", 1000))
+CLICKHOUSE_BULK_INSERT_MAX_QUEUE_ROWS = int(os.environ.get("CLICKHOUSE_BULK_INSERT_MAX_QUEUE_ROWS", 100000))
+
 _clickhouse_http_protocol = "http://"
 _clickhouse_http_port = "8123"
 if CLICKHOUSE_SECURE:
@@ -150,6 +164,12 @@ for host in _kafka_hosts:
     KAFKA_HOSTS_LIST.append(url.netloc)
 KAFKA_HOSTS = ",".join(KAFKA_HOSTS_LIST)
 
+# Producer batching: wait up to KAFKA_PRODUCER_LINGER_MS to fill batches of up to KAFKA_PRODUCER_BATCH_SIZE bytes
+# per partition, compressed with KAFKA_PRODUCER_COMPRESSION_TYPE (gzip, snappy, lz4 or zstd; empty for none)
+KAFKA_PRODUCER_LINGER_MS = int(os.environ.get("KAFKA_PRODUCER_LINGER_MS", 20))
+KAFKA_PRODUCER_BATCH_SIZE = int(os.environ.get("KAFKA_PRODUCER_BATCH_SIZE", 256 * 1024))
+KAFKA_PRODUCER_COMPRESSION_TYPE = os.environ.get("KAFKA_PRODUCER_COMPRESSION_TYPE", "lz4") or None
+
 POSTGRES = "postgres"
 CLICKHOUSE = "clickhouse"
 
@@ -244,6 +264,8 @@ CORS_ORIGIN_ALLOW_ALL = True
 
 # Max size of a POST body (for event ingestion)
 DATA_UPLOAD_MAX_MEMORY_SIZE = 20971520  # 20 MB
+# Largest payload a compressed capture or /decide request may expand to
+MAX_DECOMPRESSED_REQUEST_SIZE = int(os.environ.get("MAX_DECOMPRESSED_REQUEST_SIZE", 100 * 1024 * 1024))
 
 ROOT_URLCONF = "posthog.urls"
 
@@ -365,9 +387,22 @@ if not REDIS_URL:
         "https://posthog.com/docs/deployment/upgrading-posthog#upgrading-from-before-1011"
     )
 
-# Only listen to the default queue "celery", unless overridden via the cli
+# Session recording `$snapshot` events are ingested through their own queue, so bursts of them don't delay regular
+# events. Workers listen to it too by default; run dedicated ones with `celery -A posthog worker -Q <queue>`.
+SESSION_RECORDING_CELERY_QUEUE = os.environ.get("SESSION_RECORDING_CELERY_QUEUE", "posthog-session-recordings")
+
+# When set, capture appends tasks to segment files in this local directory, instead of waiting on Redis, while Redis
+# is unavailable or its queue is more than CAPTURE_SPOOL_MAX_QUEUE_DEPTH tasks deep. They're replayed once it recovers.
+CAPTURE_SPOOL_DIR = os.environ.get("CAPTURE_SPOOL_DIR") or None
+CAPTURE_SPOOL_MAX_QUEUE_DEPTH = int(os.environ.get("CAPTURE_SPOOL_MAX_QUEUE_DEPTH", 1000000))
+CAPTURE_SPOOL_SEGMENT_BYTES = int(os.environ.get("CAPTURE_SPOOL_SEGMENT_BYTES", 16 * 1024 * 1024))
+
+# Only listen to the default and session recording queues, unless overridden via the cli
 # NB! This is set to explicitly exclude the "posthog-plugins" queue, handled by a nodejs process
-CELERY_QUEUES = (Queue("celery", Exchange("celery"), "celery"),)
+CELERY_QUEUES = (
+    Queue("celery", Exchange("celery"), "celery"),
+    Queue(SESSION_RECORDING_CELERY_QUEUE, Exchange(SESSION_RECORDING_CELERY_QUEUE), SESSION_RECORDING_CELERY_QUEUE),
+)
 CELERY_DEFAULT_QUEUE = "celery"
 CELERY_IMPORTS = ["posthog.tasks.webhooks"]  # required to avoid circular import
 
@@ -433,6 +468,7 @@ REST_FRAMEWORK = {
     ],
     "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.LimitOffsetPagination",
     "DEFAULT_PERMISSION_CLASSES": ["rest_framework.permissions.IsAuthenticated"],
+    "DEFAULT_RENDERER_CLASSES": ["posthog.api.base.FastJSONRenderer", "rest_framework.renderers.BrowsableAPIRenderer"],
     "EXCEPTION_HANDLER": "exceptions_hog.exception_handler",
     "PAGE_SIZE": 100,
 }
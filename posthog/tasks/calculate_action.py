@@ -1,14 +1,26 @@
 import logging
 import time
+from typing import Optional
 
+import statsd
 from celery import shared_task
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
 
-from posthog.celery import app
+from posthog.celery import ACTION_EVENT_MAPPING_INTERVAL_MINUTES, app
 from posthog.ee import is_ee_enabled
-from posthog.models import Action
+from posthog.models import Action, Event
+from posthog.models.action import EVENT_COMMIT_DELAY
 
 logger = logging.getLogger(__name__)
 
+# Event ids matched against an action per query
+EVENT_IDS_PER_CHUNK = 100_000
+# Recalculation of a team stops after this long and the next scheduled run continues from where it stopped, so runs
+# don't pile up behind each other
+MAX_RUNTIME_SECONDS = 8 * 60
+
 
 @shared_task(ignore_result=True)
 def calculate_action(action_id: int) -> None:
@@ -19,9 +31,59 @@ def calculate_action(action_id: int) -> None:
 
 
 def calculate_actions_from_last_calculation() -> None:
-    actions = Action.objects.filter(deleted=False).only("pk")
+    until_event_id = Event.objects.last_id_created_before(timezone.now() - EVENT_COMMIT_DELAY)
+    if until_event_id is None:
+        return
+    team_ids = Action.objects.filter(deleted=False).values_list("team_id", flat=True).order_by().distinct()
+    for team_id in team_ids:
+        calculate_team_actions.apply_async(
+            kwargs={"team_id": team_id, "until_event_id": until_event_id},
+            expires=60 * ACTION_EVENT_MAPPING_INTERVAL_MINUTES,
+        )
+
+
+@shared_task(ignore_result=True)
+def calculate_team_actions(team_id: int, until_event_id: int) -> None:
+    """
+    Matches events with ids up to `until_event_id` to the actions of a team, continuing from each action's watermark
+    in chunks of EVENT_IDS_PER_CHUNK ids. The watermark is saved after every chunk.
+    """
+    deadline = time.monotonic() + MAX_RUNTIME_SECONDS
+    actions = Action.objects.filter(team_id=team_id, deleted=False, is_calculating=False).order_by("pk")
     for action in actions:
-        start_time = time.time()
+        if time.monotonic() > deadline:
+            break
+        calculate_action_incrementally(action, until_event_id, deadline)
+
+
+def calculate_action_incrementally(action: Action, until_event_id: int, deadline: Optional[float] = None) -> None:
+    start_time = time.time()
+    rows = 0
+
+    if action.last_calculated_event_id is None:
+        # Calculated before watermarks existed, catch up on the events since its last calculation once
         action.calculate_events(start=action.last_calculated_at)
+        _save_watermark(action, until_event_id)
+    else:
+        after_event_id = action.last_calculated_event_id
+        while after_event_id < until_event_id:
+            chunk_until_event_id = min(after_event_id + EVENT_IDS_PER_CHUNK, until_event_id)
+            rows += action.calculate_events_in_range(after_event_id, chunk_until_event_id)
+            _save_watermark(action, chunk_until_event_id)
+            after_event_id = chunk_until_event_id
+            if deadline is not None and time.monotonic() > deadline:
+                break
+
+    duration = time.time() - start_time
+    if settings.STATSD_HOST is not None:
+        statsd.Timer("%s_posthog_celery" % (settings.STATSD_PREFIX,)).send("calculate_action_duration", duration)
+        statsd.Counter("%s_posthog_celery" % (settings.STATSD_PREFIX,)).increment("calculate_action_rows", rows)
+    logger.info("Calculating action {} added {} events and took {:.2f} seconds".format(action.pk, rows, duration))
+
 
-        logger.info("Calculating action {} took {:.2f} seconds".format(action.pk, (time.time() - start_time)))
+def _save_watermark(action: Action, last_calculated_event_id: int) -> None:
+    # Never moves the watermark back, e.g. when a slow run overlaps with the next one
+    Action.objects.filter(pk=action.pk).filter(
+        Q(last_calculated_event_id__isnull=True) | Q(last_calculated_event_id__lt=last_calculated_event_id)
+    ).update(last_calculated_event_id=last_calculated_event_id, last_calculated_at=timezone.now())
+    action.last_calculated_event_id = last_calculated_event_id
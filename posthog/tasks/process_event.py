@@ -1,91 +1,136 @@
 import datetime
 from numbers import Number
-from typing import Dict, Optional, Tuple, Union
+from typing import Dict, List, Optional, Set, Tuple, Union
 
 import posthoganalytics
 from celery import shared_task
-from dateutil import parser
-from dateutil.relativedelta import relativedelta
+from django.conf import settings
 from django.db import IntegrityError
 from sentry_sdk import capture_exception
 
-from posthog.models import Element, Event, Person, SessionRecordingEvent, Team
+from posthog.local_cache import LocalCache
+from posthog.models import Element, Event, Person, PersonDistinctId, SessionRecordingEvent, Team
+from posthog.models.person import invalidate_person_id_cache
+from posthog.models.team import TEAM_CACHE_MAX_SIZE, TEAM_CACHE_TTL_SECONDS
+from posthog.tasks.update_event_names_and_properties import record_names_and_properties
+from posthog.utils import parse_iso_datetime
 
+KNOWN_NAMES_AND_PROPERTIES: LocalCache[int, Tuple[Set[str], Set[str], Set[str]]] = LocalCache(
+    TEAM_CACHE_MAX_SIZE, ttl_seconds=TEAM_CACHE_TTL_SECONDS
+)
 
-def _alias(previous_distinct_id: str, distinct_id: str, team_id: int, retry_if_failed: bool = True,) -> None:
-    old_person: Optional[Person] = None
-    new_person: Optional[Person] = None
 
-    try:
-        old_person = Person.objects.get(
-            team_id=team_id, persondistinctid__team_id=team_id, persondistinctid__distinct_id=previous_distinct_id
-        )
-    except Person.DoesNotExist:
-        pass
+def _alias(previous_distinct_id: str, distinct_id: str, team_id: int, retry_if_failed: bool = True,) -> None:
+    person_ids = Person.objects.get_person_ids(team_id, [previous_distinct_id, distinct_id])
+    old_person_id = person_ids[previous_distinct_id]
+    new_person_id = person_ids[distinct_id]
 
-    try:
-        new_person = Person.objects.get(
-            team_id=team_id, persondistinctid__team_id=team_id, persondistinctid__distinct_id=distinct_id
-        )
-    except Person.DoesNotExist:
-        pass
+    def retry() -> None:
+        # Cached person ids may be stale if another worker changed these people in the meantime
+        invalidate_person_id_cache(team_id, [previous_distinct_id, distinct_id])
+        if retry_if_failed:  # run everything again to merge the users if needed
+            _alias(previous_distinct_id, distinct_id, team_id, False)
 
-    if old_person and not new_person:
+    if old_person_id and not new_person_id:
         try:
-            old_person.add_distinct_id(distinct_id)
+            PersonDistinctId.objects.create(person_id=old_person_id, distinct_id=distinct_id, team_id=team_id)
         # Catch race case when somebody already added this distinct_id between .get and .add_distinct_id
         except IntegrityError:
-            if retry_if_failed:  # run everything again to merge the users if needed
-                _alias(previous_distinct_id, distinct_id, team_id, False)
+            retry()
         return
 
-    if not old_person and new_person:
+    if not old_person_id and new_person_id:
         try:
-            new_person.add_distinct_id(previous_distinct_id)
+            PersonDistinctId.objects.create(person_id=new_person_id, distinct_id=previous_distinct_id, team_id=team_id)
         # Catch race case when somebody already added this distinct_id between .get and .add_distinct_id
         except IntegrityError:
-            if retry_if_failed:  # run everything again to merge the users if needed
-                _alias(previous_distinct_id, distinct_id, team_id, False)
+            retry()
         return
 
-    if not old_person and not new_person:
+    if not old_person_id and not new_person_id:
         try:
             Person.objects.create(
                 team_id=team_id, distinct_ids=[str(distinct_id), str(previous_distinct_id)],
             )
         # Catch race condition where in between getting and creating, another request already created this user.
         except IntegrityError:
-            if retry_if_failed:
-                # try once more, probably one of the two persons exists now
-                _alias(previous_distinct_id, distinct_id, team_id, False)
+            # try once more, probably one of the two persons exists now
+            retry()
         return
 
-    if old_person and new_person and old_person != new_person:
-        new_person.merge_people([old_person])
+    if old_person_id and new_person_id and old_person_id != new_person_id:
+        people = Person.objects.in_bulk([old_person_id, new_person_id])
+        if len(people) < 2:
+            retry()
+            return
+        people[new_person_id].merge_people([people[old_person_id]])
 
 
 def store_names_and_properties(team: Team, event: str, properties: Dict) -> None:
-    # In _capture we only prefetch a couple of fields in Team to avoid fetching too much data
-    save = False
+    store_names_and_properties_batch(team, [(event, properties)])
+
+
+def _get_known_names_and_properties(team: Team) -> Tuple[Set[str], Set[str], Set[str]]:
+    # The team's names and properties, plus those recorded by this process since. Rebuilt from the team every
+    # TEAM_CACHE_TTL_SECONDS, so it catches up with flushes of what other processes recorded.
+    known = KNOWN_NAMES_AND_PROPERTIES.get(team.pk)
+    if known is None:
+        known = (set(team.event_names), set(team.event_properties), set(team.event_properties_numerical))
+        KNOWN_NAMES_AND_PROPERTIES.set(team.pk, known)
+    return known
+
+
+def store_names_and_properties_batch(team: Team, events: List[Tuple[str, Dict]]) -> None:
+    """
+    Records event names and property keys not seen on the team yet in Redis sets.
+    They're written to the team in bulk by `flush_event_names_and_properties`.
+    """
     if not team.ingested_event:
         # First event for the team captured
         for user in team.organization.members.all():
             posthoganalytics.capture(user.distinct_id, "first team event ingested", {"team": str(team.uuid)})
 
         team.ingested_event = True
-        save = True
-    if event not in team.event_names:
-        save = True
-        team.event_names.append(event)
-    for key, value in properties.items():
-        if key not in team.event_properties:
-            team.event_properties.append(key)
-            save = True
-        if isinstance(value, Number) and key not in team.event_properties_numerical:
-            team.event_properties_numerical.append(key)
-            save = True
-    if save:
-        team.save()
+        team.save(update_fields=["ingested_event"])
+
+    known_names, known_properties, known_numerical = _get_known_names_and_properties(team)
+    # Dicts rather than sets, to keep the order they're first seen in
+    new_names: Dict[str, None] = {}
+    new_properties: Dict[str, None] = {}
+    new_numerical: Dict[str, None] = {}
+    for event, properties in events:
+        if event not in known_names:
+            new_names[event] = None
+        for key, value in properties.items():
+            if key not in known_properties:
+                new_properties[key] = None
+            if isinstance(value, Number) and key not in known_numerical:
+                new_numerical[key] = None
+
+    if new_names or new_properties or new_numerical:
+        record_names_and_properties(team.pk, new_names, new_properties, new_numerical)
+        known_names.update(new_names)
+        known_properties.update(new_properties)
+        known_numerical.update(new_numerical)
+
+
+def _pop_elements(properties: Dict) -> Optional[List[Element]]:
+    elements = properties.pop("$elements", None)
+    if not elements:
+        return None
+    return [
+        Element(
+            text=el["$el_text"][0:400] if el.get("$el_text") else None,
+            tag_name=el["tag_name"],
+            href=el["attr__href"][0:2048] if el.get("attr__href") else None,
+            attr_class=el["attr__class"].split(" ") if el.get("attr__class") else None,
+            attr_id=el.get("attr__id"),
+            nth_child=el.get("nth_child"),
+            nth_of_type=el.get("nth_of_type"),
+            attributes={key: value for key, value in el.items() if key.startswith("attr__")},
+        )
+        for el in elements
+    ]
 
 
 def _capture(
@@ -97,27 +142,9 @@ def _capture(
     properties: Dict,
     timestamp: Union[datetime.datetime, str],
 ) -> None:
-    elements = properties.get("$elements")
-    elements_list = None
-    if elements:
-        del properties["$elements"]
-        elements_list = [
-            Element(
-                text=el["$el_text"][0:400] if el.get("$el_text") else None,
-                tag_name=el["tag_name"],
-                href=el["attr__href"][0:2048] if el.get("attr__href") else None,
-                attr_class=el["attr__class"].split(" ") if el.get("attr__class") else None,
-                attr_id=el.get("attr__id"),
-                nth_child=el.get("nth_child"),
-                nth_of_type=el.get("nth_of_type"),
-                attributes={key: value for key, value in el.items() if key.startswith("attr__")},
-            )
-            for index, el in enumerate(elements)
-        ]
+    elements_list = _pop_elements(properties)
 
-    team = Team.objects.only(
-        "slack_incoming_webhook", "event_names", "event_properties", "anonymize_ips", "ingested_event",
-    ).get(pk=team_id)
+    team = Team.objects.get_cached(team_id)
 
     if not team.anonymize_ips and "$ip" not in properties:
         properties["$ip"] = ip
@@ -132,100 +159,66 @@ def _capture(
         **({"elements": elements_list} if elements_list else {})
     )
     store_names_and_properties(team=team, event=event, properties=properties)
-    if not Person.objects.distinct_ids_exist(team_id=team_id, distinct_ids=[str(distinct_id)]):
-        # Catch race condition where in between getting and creating,
-        # another request already created this user
-        try:
-            Person.objects.create(team_id=team_id, distinct_ids=[str(distinct_id)])
-        except IntegrityError:
-            pass
+    Person.objects.get_or_create_person_id(team_id, str(distinct_id))
 
 
 def get_or_create_person(team_id: int, distinct_id: str) -> Tuple[Person, bool]:
-    person: Person
-    created = False
-
-    if not Person.objects.distinct_ids_exist(team_id=team_id, distinct_ids=[str(distinct_id)]):
-        try:
-            person = Person.objects.create(team_id=team_id, distinct_ids=[str(distinct_id)])
-            created = True
-        except IntegrityError:
-            person = Person.objects.get(
-                team_id=team_id, persondistinctid__team_id=team_id, persondistinctid__distinct_id=str(distinct_id)
-            )
-            created = False
-    else:
-        person = Person.objects.get(
-            team_id=team_id, persondistinctid__team_id=team_id, persondistinctid__distinct_id=str(distinct_id)
-        )
-        created = False
-
-    return person, created
-
-
-def _update_person_properties(team_id: int, distinct_id: str, properties: Dict) -> None:
+    person_id, created = Person.objects.get_or_create_person_id(team_id, str(distinct_id))
     try:
-        person = Person.objects.get(
-            team_id=team_id, persondistinctid__team_id=team_id, persondistinctid__distinct_id=str(distinct_id)
-        )
+        return Person.objects.get(pk=person_id), created
     except Person.DoesNotExist:
-        try:
-            person = Person.objects.create(team_id=team_id, distinct_ids=[str(distinct_id)])
-        # Catch race condition where in between getting and creating, another request already created this person
-        except:
-            person = Person.objects.get(
-                team_id=team_id, persondistinctid__team_id=team_id, persondistinctid__distinct_id=str(distinct_id)
-            )
-    person.properties.update(properties)
-    person.save()
+        # The cached person id is stale, e.g. that person was merged into another one by a different worker
+        invalidate_person_id_cache(team_id, [str(distinct_id)])
+        person_id, created = Person.objects.get_or_create_person_id(team_id, str(distinct_id))
+        return Person.objects.get(pk=person_id), created
 
 
-def _set_is_identified(team_id: int, distinct_id: str, is_identified: bool = True) -> None:
-    try:
-        person = Person.objects.get(
-            team_id=team_id, persondistinctid__team_id=team_id, persondistinctid__distinct_id=str(distinct_id)
-        )
-    except Person.DoesNotExist:
-        try:
-            person = Person.objects.create(team_id=team_id, distinct_ids=[str(distinct_id)])
-        # Catch race condition where in between getting and creating, another request already created this person
-        except:
-            person = Person.objects.get(
-                team_id=team_id, persondistinctid__team_id=team_id, persondistinctid__distinct_id=str(distinct_id)
-            )
-    if not person.is_identified:
-        person.is_identified = is_identified
-        person.save()
+def _update_person_properties(team_id: int, distinct_id: str, properties: Dict, is_identified: bool = False) -> None:
+    person_id, _ = Person.objects.get_or_create_person_id(team_id, str(distinct_id))
+    if not Person.objects.update_properties(person_id, properties, is_identified=is_identified):
+        # The cached person id is stale, e.g. that person was merged into another one by a different worker
+        invalidate_person_id_cache(team_id, [str(distinct_id)])
+        person_id, _ = Person.objects.get_or_create_person_id(team_id, str(distinct_id))
+        Person.objects.update_properties(person_id, properties, is_identified=is_identified)
 
 
-def _store_session_recording_event(
-    team_id: int, distinct_id: str, session_id: str, timestamp: Union[datetime.datetime, str], snapshot_data: dict
-) -> None:
-    SessionRecordingEvent.objects.create(
+def _session_recording_event(
+    team_id: int, distinct_id: str, data: dict, timestamp: datetime.datetime
+) -> SessionRecordingEvent:
+    return SessionRecordingEvent(
         team_id=team_id,
         distinct_id=distinct_id,
-        session_id=session_id,
+        session_id=data["properties"]["$session_id"],
         timestamp=timestamp,
-        snapshot_data=snapshot_data,
+        snapshot_data=data["properties"]["$snapshot_data"],
     )
 
 
-def handle_timestamp(data: dict, now: str, sent_at: Optional[str]) -> datetime.datetime:
+def handle_timestamp(
+    data: dict, now: Union[str, datetime.datetime], sent_at: Optional[Union[str, datetime.datetime]]
+) -> datetime.datetime:
+    """
+    `now` and `sent_at` may be passed already parsed, so batches that share them only parse them once
+    """
+    if isinstance(now, str):
+        now = parse_iso_datetime(now)
     if data.get("timestamp"):
+        timestamp = parse_iso_datetime(data["timestamp"])
         if sent_at:
+            if isinstance(sent_at, str):
+                sent_at = parse_iso_datetime(sent_at)
             # sent_at - timestamp == now - x
             # x = now + (timestamp - sent_at)
             try:
                 # timestamp and sent_at must both be in the same format: either both with or both without timezones
                 # otherwise we can't get a diff to add to now
-                return parser.isoparse(now) + (parser.isoparse(data["timestamp"]) - parser.isoparse(sent_at))
+                return now + (timestamp - sent_at)
             except TypeError as e:
                 capture_exception(e)
-        return parser.isoparse(data["timestamp"])
-    now_datetime = parser.parse(now)
+        return timestamp
     if data.get("offset"):
-        return now_datetime - relativedelta(microseconds=data["offset"] * 1000)
-    return now_datetime
+        return now - datetime.timedelta(milliseconds=data["offset"])
+    return now
 
 
 def handle_identify_or_alias(event: str, properties: dict, distinct_id: str, team_id: int) -> None:
@@ -238,31 +231,25 @@ def handle_identify_or_alias(event: str, properties: dict, distinct_id: str, tea
             _alias(
                 previous_distinct_id=properties["$anon_distinct_id"], distinct_id=distinct_id, team_id=team_id,
             )
-        if properties.get("$set"):
-            _update_person_properties(team_id=team_id, distinct_id=distinct_id, properties=properties["$set"])
-        _set_is_identified(team_id=team_id, distinct_id=distinct_id)
+        _update_person_properties(
+            team_id=team_id, distinct_id=distinct_id, properties=properties.get("$set") or {}, is_identified=True
+        )
 
 
 @shared_task(name="posthog.tasks.process_event.process_event", ignore_result=True)
 def process_event(
     distinct_id: str, ip: str, site_url: str, data: dict, team_id: int, now: str, sent_at: Optional[str],
 ) -> None:
+    if data["event"] == "$snapshot":
+        _session_recording_event(team_id, distinct_id, data, handle_timestamp(data, now, sent_at)).save()
+        return
+
     properties = data.get("properties", {})
     if data.get("$set"):
         properties["$set"] = data["$set"]
 
     handle_identify_or_alias(data["event"], properties, distinct_id, team_id)
 
-    if data["event"] == "$snapshot":
-        _store_session_recording_event(
-            team_id=team_id,
-            distinct_id=distinct_id,
-            session_id=data["properties"]["$session_id"],
-            timestamp=handle_timestamp(data, now, sent_at),
-            snapshot_data=data["properties"]["$snapshot_data"],
-        )
-        return
-
     _capture(
         ip=ip,
         site_url=site_url,
@@ -272,3 +259,80 @@ def process_event(
         properties=properties,
         timestamp=handle_timestamp(data, now, sent_at),
     )
+
+
+def _capture_batch(
+    ip: str, site_url: str, team_id: int, captured: List[Tuple[str, str, Dict, datetime.datetime]]
+) -> None:
+    """
+    Set-based version of `_capture` for a chunk of (event, distinct_id, properties, timestamp) tuples:
+    one INSERT for the events and one query to resolve element groups, plus one to resolve any uncached distinct ids.
+    """
+    team = Team.objects.get_cached(team_id)
+
+    events: List[Event] = []
+    elements_lists: List[Optional[List[Element]]] = []
+    for event, distinct_id, properties, timestamp in captured:
+        elements_lists.append(_pop_elements(properties))
+        if not team.anonymize_ips and "$ip" not in properties:
+            properties["$ip"] = ip
+        events.append(
+            Event(event=event, distinct_id=distinct_id, properties=properties, team=team, timestamp=timestamp)
+        )
+
+    Event.objects.bulk_create_with_elements(team=team, events=events, elements_lists=elements_lists, site_url=site_url)
+    store_names_and_properties_batch(team=team, events=[(event.event, event.properties) for event in events])
+
+    for distinct_id, person_id in Person.objects.get_person_ids(
+        team_id, [event.distinct_id for event in events]
+    ).items():
+        if person_id is None:
+            Person.objects.get_or_create_person_id(team_id, distinct_id)
+
+
+@shared_task(name="posthog.tasks.process_event.process_event_batch", ignore_result=True)
+def process_event_batch(
+    ip: str, site_url: str, events: List[Tuple[str, dict]], team_id: int, now: str, sent_at: Optional[str],
+) -> None:
+    captured: List[Tuple[str, str, Dict, datetime.datetime]] = []
+    snapshots: List[SessionRecordingEvent] = []
+    now_datetime = parse_iso_datetime(now)
+    sent_at_datetime = parse_iso_datetime(sent_at) if sent_at else None
+    for distinct_id, data in events:
+        timestamp = handle_timestamp(data, now_datetime, sent_at_datetime)
+        if data["event"] == "$snapshot":
+            snapshots.append(_session_recording_event(team_id, distinct_id, data, timestamp))
+            continue
+
+        properties = data.get("properties", {})
+        if data.get("$set"):
+            properties["$set"] = data["$set"]
+
+        # Person changes must happen in order, so they aren't batched
+        handle_identify_or_alias(data["event"], properties, distinct_id, team_id)
+
+        captured.append((data["event"], distinct_id, properties, timestamp))
+
+    if snapshots:
+        SessionRecordingEvent.objects.bulk_create(snapshots)
+
+    for index in range(0, len(captured), settings.EVENT_BATCH_SIZE):
+        _capture_batch(ip, site_url, team_id, captured[index : index + settings.EVENT_BATCH_SIZE])
+
+
+@shared_task(name="posthog.tasks.process_event.process_session_recording_events", ignore_result=True)
+def process_session_recording_events(
+    team_id: int, events: List[Tuple[str, dict]], now: str, sent_at: Optional[str],
+) -> None:
+    """
+    `$snapshot` events need no person or team processing. They're consumed from their own queue
+    (SESSION_RECORDING_CELERY_QUEUE), so recording bursts don't hold up regular events, and written with one INSERT.
+    """
+    now_datetime = parse_iso_datetime(now)
+    sent_at_datetime = parse_iso_datetime(sent_at) if sent_at else None
+    SessionRecordingEvent.objects.bulk_create(
+        [
+            _session_recording_event(team_id, distinct_id, data, handle_timestamp(data, now_datetime, sent_at_datetime))
+            for distinct_id, data in events
+        ]
+    )
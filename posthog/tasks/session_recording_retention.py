@@ -1,17 +1,31 @@
-from collections import defaultdict
+import logging
+import time
 from datetime import datetime, timedelta
-from typing import Dict, List
+from typing import List
 
+import statsd
 from celery import shared_task
-from dateutil import parser
-from django.db.models import QuerySet
-from django.utils import timezone
+from django.conf import settings
+from django.db import connection
+from django.db.models import Max
 from django.utils.timezone import now
 
 from posthog.models import SessionRecordingEvent, Team
+from posthog.utils import parse_iso_datetime
+
+logger = logging.getLogger(__name__)
 
 RETENTION_PERIOD = timedelta(days=7)
 SESSION_CUTOFF = timedelta(minutes=30)
+# Sessions whose events are deleted per query
+SESSIONS_PER_BATCH = 500
+# After this long the task schedules itself to continue, so a single run never holds a worker for long
+MAX_RUNTIME_SECONDS = 5 * 60
+
+DELETE_SESSION_RECORDING_EVENTS_SQL = """
+DELETE FROM posthog_sessionrecordingevent
+WHERE team_id = %(team_id)s AND timestamp <= %(time_threshold)s AND session_id = ANY(%(session_ids)s)
+"""
 
 
 def session_recording_retention_scheduler() -> None:
@@ -21,31 +35,66 @@ def session_recording_retention_scheduler() -> None:
 
 
 @shared_task(ignore_result=True, max_retries=1)
-def session_recording_retention(team_id: int, time_threshold: str) -> None:
-    time_threshold_dt = parser.isoparse(time_threshold)
-    events = SessionRecordingEvent.objects.filter(team_id=team_id, timestamp__lte=time_threshold_dt).order_by(
-        "timestamp"
+def session_recording_retention(team_id: int, time_threshold: str, after_session_id: str = "") -> None:
+    """
+    Deletes the events older than `time_threshold` of sessions that ended before it, in batches of sessions ordered
+    by session id. Everything is done in the database, so memory use doesn't depend on the size of the team.
+    """
+    time_threshold_dt = parse_iso_datetime(time_threshold)
+    counter = (
+        statsd.Counter("%s_posthog_celery" % (settings.STATSD_PREFIX,)) if settings.STATSD_HOST is not None else None
     )
-    purged_sessions = {
-        session_id: events
-        for session_id, events in build_sessions(events).items()
-        if not close_to_threshold(time_threshold_dt, events)
-    }
+    deadline = time.monotonic() + MAX_RUNTIME_SECONDS
+    deleted_sessions = deleted_events = 0
+
+    while True:
+        session_ids = expired_session_ids(team_id, time_threshold_dt, after_session_id, SESSIONS_PER_BATCH)
+        if not session_ids:
+            break
 
-    primary_keys = [event.pk for session_events in purged_sessions.values() for event in session_events]
-    SessionRecordingEvent.objects.filter(pk__in=primary_keys).delete()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                DELETE_SESSION_RECORDING_EVENTS_SQL,
+                {"team_id": team_id, "time_threshold": time_threshold_dt, "session_ids": session_ids},
+            )
+            batch_deleted_events = cursor.rowcount
+        deleted_sessions += len(session_ids)
+        deleted_events += batch_deleted_events
+        if counter is not None:
+            counter.increment("session_recording_retention_deleted_sessions", len(session_ids))
+            counter.increment("session_recording_retention_deleted_events", batch_deleted_events)
 
+        after_session_id = session_ids[-1]
+        if len(session_ids) < SESSIONS_PER_BATCH:
+            break
+        if time.monotonic() > deadline:
+            session_recording_retention.delay(
+                team_id=team_id, time_threshold=time_threshold, after_session_id=after_session_id
+            )
+            break
+
+    logger.info(
+        "Session recording retention for team %s deleted %s events of %s sessions",
+        team_id,
+        deleted_events,
+        deleted_sessions,
+    )
 
-def build_sessions(events: QuerySet) -> Dict[str, List[SessionRecordingEvent]]:
-    sessions = defaultdict(list)
-    for event in events:
-        sessions[event.session_id].append(event)
-    return sessions
 
+def expired_session_ids(team_id: int, time_threshold: datetime, after_session_id: str, limit: int) -> List[str]:
+    """
+    Ids of sessions with events before `time_threshold`, whose last event before it is at least SESSION_CUTOFF older
+    than it. Sessions ending closer to the threshold may be cut in half, so they're kept for now.
 
-# If last event of session was within 30 minutes of threshold, it may be cut in half.
-#
-# Closely coupled with semantics in session queries
-def close_to_threshold(time_threshold: timezone.datetime, session_events: List[SessionRecordingEvent]) -> bool:
-    last_event_time = session_events[-1].timestamp
-    return (time_threshold - last_event_time) <= SESSION_CUTOFF
+    Closely coupled with semantics in session queries
+    """
+    return list(
+        SessionRecordingEvent.objects.filter(
+            team_id=team_id, timestamp__lte=time_threshold, session_id__gt=after_session_id
+        )
+        .values("session_id")
+        .annotate(last_timestamp=Max("timestamp"))
+        .filter(last_timestamp__lt=time_threshold - SESSION_CUTOFF)
+        .order_by("session_id")
+        .values_list("session_id", flat=True)[:limit]
+    )
@@ -0,0 +1,114 @@
+from datetime import timedelta
+from typing import Any, List
+from unittest.mock import MagicMock, call, patch
+
+from django.utils.timezone import now
+from freezegun import freeze_time
+
+from posthog.api.test.base import BaseTest
+from posthog.models import Action, ActionStep, Event, Team
+from posthog.tasks.calculate_action import (
+    calculate_action_incrementally,
+    calculate_actions_from_last_calculation,
+    calculate_team_actions,
+)
+
+
+class TestCalculateAction(BaseTest):
+    def _events(self, count: int, event: str = "$pageview") -> List[Event]:
+        return [Event.objects.create(team=self.team, distinct_id="user", event=event) for _ in range(count)]
+
+    def _action(self, team: Team, **kwargs: Any) -> Action:
+        action = Action.objects.create(team=team, **kwargs)
+        ActionStep.objects.create(action=action, event="$pageview")
+        return action
+
+    @patch("posthog.tasks.calculate_action.calculate_team_actions.apply_async")
+    def test_fans_out_per_team(self, patch_apply_async: MagicMock) -> None:
+        other_team = Team.objects.create()
+        self._action(self.team)
+        self._action(self.team)
+        self._action(other_team)
+        self._action(Team.objects.create(), deleted=True)
+        events = self._events(2)
+
+        with freeze_time(now() + timedelta(minutes=5)):
+            calculate_actions_from_last_calculation()
+
+        self.assertCountEqual(
+            patch_apply_async.call_args_list,
+            [
+                call(kwargs={"team_id": team_id, "until_event_id": events[-1].pk}, expires=600)
+                for team_id in [self.team.pk, other_team.pk]
+            ],
+        )
+
+    @patch("posthog.tasks.calculate_action.calculate_team_actions.apply_async")
+    def test_leaves_recent_events_to_the_next_run(self, patch_apply_async: MagicMock) -> None:
+        self._action(self.team)
+        events = self._events(1)
+        with freeze_time(now() + timedelta(minutes=5)):
+            self._events(1)
+            calculate_actions_from_last_calculation()
+
+        patch_apply_async.assert_called_once_with(
+            kwargs={"team_id": self.team.pk, "until_event_id": events[0].pk}, expires=600
+        )
+
+    @patch("posthog.tasks.calculate_action.EVENT_IDS_PER_CHUNK", 2)
+    def test_calculates_in_chunks_from_watermark(self) -> None:
+        events = self._events(6)
+        self._events(1, event="$autocapture")
+        action = self._action(self.team, last_calculated_event_id=events[1].pk)
+
+        with self.assertNumQueries(6):
+            calculate_action_incrementally(action, until_event_id=events[4].pk)
+
+        self.assertCountEqual(action.events.all(), events[2:5])
+        self.assertEqual(Action.objects.get(pk=action.pk).last_calculated_event_id, events[4].pk)
+
+        # Calculating a range again doesn't add duplicates
+        action.last_calculated_event_id = events[0].pk
+        calculate_action_incrementally(action, until_event_id=events[5].pk)
+        self.assertCountEqual(action.events.all(), events[1:6])
+
+    def test_watermark_never_moves_back(self) -> None:
+        events = self._events(3)
+        action = self._action(self.team, last_calculated_event_id=events[2].pk)
+        stale_action = Action.objects.get(pk=action.pk)
+        stale_action.last_calculated_event_id = events[0].pk
+
+        calculate_action_incrementally(stale_action, until_event_id=events[1].pk)
+
+        self.assertEqual(Action.objects.get(pk=action.pk).last_calculated_event_id, events[2].pk)
+
+    def test_first_calculation_catches_up_since_last_calculation(self) -> None:
+        action = self._action(self.team)
+        action.last_calculated_at = now() - timedelta(hours=1)
+        action.save()
+        events = self._events(2)
+        action.events.clear()
+
+        calculate_team_actions(team_id=self.team.pk, until_event_id=events[-1].pk)
+
+        self.assertCountEqual(action.events.all(), events)
+        self.assertEqual(Action.objects.get(pk=action.pk).last_calculated_event_id, events[-1].pk)
+
+    def test_skips_actions_being_recalculated(self) -> None:
+        events = self._events(1)
+        action = self._action(self.team, last_calculated_event_id=0, is_calculating=True)
+
+        calculate_team_actions(team_id=self.team.pk, until_event_id=events[0].pk)
+
+        self.assertEqual(action.events.count(), 0)
+        self.assertEqual(Action.objects.get(pk=action.pk).last_calculated_event_id, 0)
+
+    def test_full_recalculation_resets_watermark(self) -> None:
+        events = self._events(2)
+        action = self._action(self.team)
+
+        with freeze_time(now() + timedelta(minutes=5)):
+            action.calculate_events()
+
+        self.assertCountEqual(action.events.all(), events)
+        self.assertEqual(Action.objects.get(pk=action.pk).last_calculated_event_id, events[-1].pk)
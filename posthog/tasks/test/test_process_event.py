@@ -16,11 +16,14 @@ from posthog.models import (
     ElementGroup,
     Event,
     Person,
+    PersonDistinctId,
     SessionRecordingEvent,
     Team,
     User,
 )
 from posthog.tasks.process_event import process_event as _process_event
+from posthog.tasks.process_event import process_event_batch, process_session_recording_events
+from posthog.tasks.update_event_names_and_properties import flush_event_names_and_properties
 
 
 def get_elements(event_id: Union[int, UUID]) -> List[Element]:
@@ -42,7 +45,7 @@ def test_process_event_factory(
             self.team.ingested_event = True  # avoid sending `first team event ingested` to PostHog
             self.team.save()
 
-            with self.assertNumQueries(30 if settings.EE_AVAILABLE else 28):  # extra queries to check for hooks
+            with self.assertNumQueries(26 if settings.EE_AVAILABLE else 24):  # extra queries to check for hooks
                 process_event(
                     2,
                     "",
@@ -725,7 +728,9 @@ def test_process_event_factory(
                 now().isoformat(),
                 now().isoformat(),
             )
+            flush_event_names_and_properties()
             self.team.refresh_from_db()
+            self.assertListEqual(self.team.event_names, ["purchase"])
             self.assertListEqual(self.team.event_properties, ["price", "name", "$ip"])
             self.assertListEqual(self.team.event_properties_numerical, ["price"])
 
@@ -733,4 +738,98 @@ def test_process_event_factory(
 
 
 class TestProcessEvent(test_process_event_factory(_process_event, Event.objects.all, SessionRecordingEvent.objects.all, get_elements)):  # type: ignore
-    pass
+    def test_process_event_batch(self) -> None:
+        Person.objects.create(team=self.team, distinct_ids=["alpha"])
+        action = Action.objects.create(team=self.team)
+        ActionStep.objects.create(action=action, event="$autocapture", selector="a")
+        elements = [
+            {"tag_name": "a", "nth_child": 1, "nth_of_type": 2, "attr__class": "btn btn-sm"},
+            {"tag_name": "div", "nth_child": 1, "nth_of_type": 2, "$el_text": "💻"},
+        ]
+
+        process_event_batch(
+            "127.0.0.1",
+            "",
+            [
+                ("alpha", {"event": "$pageview", "properties": {"$current_url": "https://posthog.com"}}),
+                ("beta", {"event": "$identify", "properties": {"$set": {"email": "beta@posthog.com"}}}),
+                ("alpha", {"event": "$autocapture", "properties": {"$elements": elements}}),
+                ("beta", {"event": "$autocapture", "properties": {"$elements": elements, "price": 3}}),
+                (
+                    "beta",
+                    {"event": "$snapshot", "properties": {"$session_id": "abc", "$snapshot_data": {"timestamp": 123}},},
+                ),
+            ],
+            self.team.pk,
+            now().isoformat(),
+            now().isoformat(),
+        )
+
+        self.assertEqual(
+            sorted(Event.objects.values_list("distinct_id", "event")),
+            [("alpha", "$autocapture"), ("alpha", "$pageview"), ("beta", "$autocapture"), ("beta", "$identify")],
+        )
+        self.assertEqual(SessionRecordingEvent.objects.get().session_id, "abc")
+        self.assertEqual(Person.objects.count(), 2)
+        self.assertEqual(
+            Person.objects.get(persondistinctid__distinct_id="beta").properties, {"email": "beta@posthog.com"}
+        )
+
+        autocaptures = Event.objects.filter(event="$autocapture")
+        self.assertEqual(ElementGroup.objects.count(), 1)
+        self.assertEqual(autocaptures[0].elements_hash, autocaptures[1].elements_hash)
+        self.assertEqual(get_elements(autocaptures[0].pk)[1].text, "💻")
+        self.assertEqual(action.events.count(), 2)
+
+        flush_event_names_and_properties()
+        self.team.refresh_from_db()
+        self.assertEqual(self.team.event_names, ["$pageview", "$identify", "$autocapture"])
+        self.assertEqual(self.team.event_properties_numerical, ["price"])
+
+    def test_process_session_recording_events(self) -> None:
+        with self.assertNumQueries(1):
+            process_session_recording_events(
+                self.team.pk,
+                [
+                    ("alpha", {"event": "$snapshot", "properties": {"$session_id": "abc", "$snapshot_data": {"a": 1}}}),
+                    (
+                        "alpha",
+                        {
+                            "event": "$snapshot",
+                            "properties": {"$session_id": "abc", "$snapshot_data": {"a": 2}},
+                            "offset": 1000,
+                        },
+                    ),
+                ],
+                "2020-01-01T12:00:00.000Z",
+                None,
+            )
+
+        snapshots = SessionRecordingEvent.objects.order_by("timestamp")
+        self.assertEqual([snapshot.snapshot_data for snapshot in snapshots], [{"a": 2}, {"a": 1}])
+        self.assertEqual(snapshots[0].timestamp.isoformat(), "2020-01-01T11:59:59+00:00")
+        self.assertEqual(Person.objects.count(), 0)
+
+    def test_identify_with_stale_person_id_cache(self) -> None:
+        person_a = Person.objects.create(team=self.team, distinct_ids=["anonymous_id"])
+        person_b = Person.objects.create(team=self.team, distinct_ids=["new_distinct_id"])
+        Person.objects.get_person_ids(self.team.pk, ["anonymous_id", "new_distinct_id"])
+
+        # Another worker merges person_a into person_b without touching this process' cache
+        PersonDistinctId.objects.filter(person=person_a).update(person=person_b)
+        Person.objects.filter(pk=person_a.pk).delete()
+
+        _process_event(
+            "anonymous_id",
+            "",
+            "",
+            {"event": "$identify", "properties": {"$set": {"email": "someone@posthog.com"}}},
+            self.team.pk,
+            now().isoformat(),
+            now().isoformat(),
+        )
+
+        person_b.refresh_from_db()
+        self.assertEqual(person_b.properties, {"email": "someone@posthog.com"})
+        self.assertTrue(person_b.is_identified)
+        self.assertEqual(Person.objects.count(), 1)
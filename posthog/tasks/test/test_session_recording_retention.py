@@ -49,6 +49,51 @@ class TestSessionRecording(BaseTest):
 
             self.assertEqual(SessionRecordingEvent.objects.count(), 5)
 
+    @patch("posthog.tasks.session_recording_retention.SESSIONS_PER_BATCH", 2)
+    def test_deletes_sessions_in_batches(self) -> None:
+        with freeze_time("2020-01-10"):
+            for session_id in ["1", "2", "3", "4", "5"]:
+                self.create_snapshot(session_id, threshold() - timedelta(days=1))
+                self.create_snapshot(session_id, threshold() - timedelta(days=1, minutes=5))
+            kept_event = self.create_snapshot("6", threshold() - timedelta(minutes=10))
+
+            session_recording_retention(self.team.id, threshold().isoformat())
+
+            self.assertEqual(list(SessionRecordingEvent.objects.all()), [kept_event])
+
+    @patch("posthog.tasks.session_recording_retention.SESSIONS_PER_BATCH", 2)
+    @patch("posthog.tasks.session_recording_retention.MAX_RUNTIME_SECONDS", -1)
+    @patch("posthog.tasks.session_recording_retention.session_recording_retention.delay")
+    def test_continues_in_new_task_after_max_runtime(self, patched_session_recording_retention: MagicMock) -> None:
+        with freeze_time("2020-01-10"):
+            for session_id in ["1", "2", "3"]:
+                self.create_snapshot(session_id, threshold() - timedelta(days=1))
+
+            session_recording_retention(self.team.id, threshold().isoformat())
+
+            self.assertEqual(
+                sorted(SessionRecordingEvent.objects.values_list("session_id", flat=True)), ["3"],
+            )
+            patched_session_recording_retention.assert_called_once_with(
+                team_id=self.team.id, time_threshold=threshold().isoformat(), after_session_id="2"
+            )
+
+            session_recording_retention(self.team.id, threshold().isoformat(), after_session_id="2")
+
+            self.assertEqual(SessionRecordingEvent.objects.count(), 0)
+
+    def test_does_not_delete_other_teams(self) -> None:
+        with freeze_time("2020-01-10"):
+            self.create_snapshot("1", threshold() - timedelta(days=1))
+            other_team = Team.objects.create()
+            SessionRecordingEvent.objects.create(
+                team=other_team, distinct_id="distinct_id", timestamp=threshold() - timedelta(days=1), session_id="1"
+            )
+
+            session_recording_retention(self.team.id, threshold().isoformat())
+
+            self.assertEqual(list(SessionRecordingEvent.objects.values_list("team_id", flat=True)), [other_team.pk])
+
     def create_snapshot(self, session_id: str, timestamp: datetime) -> SessionRecordingEvent:
         return SessionRecordingEvent.objects.create(
             team=self.team,
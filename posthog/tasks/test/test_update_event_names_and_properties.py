@@ -0,0 +1,40 @@
+from posthog.api.test.base import BaseTest
+from posthog.models import Team
+from posthog.redis import get_client
+from posthog.tasks.update_event_names_and_properties import (
+    TEAMS_WITH_NEW_NAMES_AND_PROPERTIES,
+    flush_event_names_and_properties,
+    record_names_and_properties,
+)
+
+
+class TestUpdateEventNamesAndProperties(BaseTest):
+    def test_flush_appends_new_names_and_properties(self) -> None:
+        self.team.event_names = ["$pageview"]
+        self.team.event_properties = ["$current_url"]
+        self.team.save()
+
+        record_names_and_properties(self.team.pk, ["$pageview", "purchase"], ["price"], ["price"])
+        record_names_and_properties(self.team.pk, ["purchase", "$autocapture"], ["$current_url"], [])
+        flush_event_names_and_properties()
+
+        self.team.refresh_from_db()
+        self.assertEqual(self.team.event_names, ["$pageview", "purchase", "$autocapture"])
+        self.assertEqual(self.team.event_properties, ["$current_url", "price"])
+        self.assertEqual(self.team.event_properties_numerical, ["price"])
+        self.assertFalse(get_client().sismember(TEAMS_WITH_NEW_NAMES_AND_PROPERTIES, self.team.pk))
+
+        # Nothing left to flush
+        with self.assertNumQueries(0):
+            flush_event_names_and_properties()
+
+    def test_flush_skips_deleted_teams(self) -> None:
+        team = Team.objects.create(organization=self.organization)
+        record_names_and_properties(team.pk, ["purchase"], [], [])
+        record_names_and_properties(self.team.pk, ["purchase"], [], [])
+        team.delete()
+
+        flush_event_names_and_properties()
+
+        self.team.refresh_from_db()
+        self.assertEqual(self.team.event_names, ["purchase"])
@@ -0,0 +1,103 @@
+import threading
+import time
+from typing import Iterable, List, Tuple
+
+from django.db import transaction
+
+from posthog.models import Team
+from posthog.redis import get_client
+
+TEAMS_WITH_NEW_NAMES_AND_PROPERTIES = "teams_with_new_event_names_and_properties"
+NEW_EVENT_NAMES = "team_new_event_names:{}"
+NEW_EVENT_PROPERTIES = "team_new_event_properties:{}"
+NEW_EVENT_PROPERTIES_NUMERICAL = "team_new_event_properties_numerical:{}"
+
+_last_score = 0
+_score_lock = threading.Lock()
+
+
+def _next_scores(count: int) -> List[int]:
+    # Microseconds since the epoch, strictly increasing within the process. Names and properties are stored in sorted
+    # sets with these as scores, so they're appended to the team in the order they were first seen.
+    global _last_score
+    with _score_lock:
+        start = max(time.time_ns() // 1000, _last_score + 1)
+        _last_score = start + count - 1
+    return list(range(start, start + count))
+
+
+def record_names_and_properties(
+    team_id: int,
+    event_names: Iterable[str],
+    event_properties: Iterable[str],
+    event_properties_numerical: Iterable[str],
+) -> None:
+    pipeline = get_client().pipeline(transaction=False)
+    for key, members in (
+        (NEW_EVENT_NAMES, event_names),
+        (NEW_EVENT_PROPERTIES, event_properties),
+        (NEW_EVENT_PROPERTIES_NUMERICAL, event_properties_numerical),
+    ):
+        members = list(members)
+        if members:
+            pipeline.zadd(key.format(team_id), dict(zip(members, _next_scores(len(members)))), nx=True)
+    pipeline.sadd(TEAMS_WITH_NEW_NAMES_AND_PROPERTIES, team_id)
+    pipeline.execute()
+
+
+def flush_event_names_and_properties() -> None:
+    client = get_client()
+    while True:
+        team_id = client.spop(TEAMS_WITH_NEW_NAMES_AND_PROPERTIES)
+        if team_id is None:
+            return
+        flush_event_names_and_properties_for_team(int(team_id))
+
+
+def flush_event_names_and_properties_for_team(team_id: int) -> None:
+    event_names, event_properties, event_properties_numerical = _pop_names_and_properties(team_id)
+    try:
+        with transaction.atomic():
+            team = (
+                Team.objects.select_for_update()
+                .only("event_names", "event_properties", "event_properties_numerical")
+                .get(pk=team_id)
+            )
+            updated = [
+                field
+                for field, new_values in (
+                    ("event_names", event_names),
+                    ("event_properties", event_properties),
+                    ("event_properties_numerical", event_properties_numerical),
+                )
+                if _extend(getattr(team, field), new_values)
+            ]
+            if updated:
+                team.save(update_fields=updated)
+    except Team.DoesNotExist:
+        pass
+    except Exception:
+        # Put them back so they're picked up by the next flush
+        record_names_and_properties(team_id, event_names, event_properties, event_properties_numerical)
+        raise
+
+
+def _pop_names_and_properties(team_id: int) -> Tuple[List[str], List[str], List[str]]:
+    keys = [key.format(team_id) for key in (NEW_EVENT_NAMES, NEW_EVENT_PROPERTIES, NEW_EVENT_PROPERTIES_NUMERICAL)]
+    pipeline = get_client().pipeline(transaction=True)
+    for key in keys:
+        pipeline.zrange(key, 0, -1)
+    pipeline.delete(*keys)
+    event_names, event_properties, event_properties_numerical, _ = pipeline.execute()
+    return (
+        [member.decode("utf-8") for member in event_names],
+        [member.decode("utf-8") for member in event_properties],
+        [member.decode("utf-8") for member in event_properties_numerical],
+    )
+
+
+def _extend(existing: List[str], new_values: List[str]) -> bool:
+    known = set(existing)
+    additions = [value for value in new_values if value not in known]
+    existing.extend(additions)
+    return len(additions) > 0
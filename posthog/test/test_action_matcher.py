@@ -0,0 +1,234 @@
+from typing import List
+
+from posthog.api.test.base import BaseTest
+from posthog.models import Action, ActionStep, Cohort, Element, Event, Person
+from posthog.models.action_matcher import ACTION_MATCHER_CACHE, CompiledAction, matching_actions
+from posthog.test.test_event_model import filter_by_actions_factory
+
+
+def _get_events_for_action(action: Action) -> List[Event]:
+    return [
+        event
+        for event in Event.objects.filter(team_id=action.team_id).order_by("-id")
+        if action in matching_actions(event)
+    ]
+
+
+class TestActionMatcherFilters(
+    filter_by_actions_factory(Event.objects.create, Person.objects.create, _get_events_for_action)  # type: ignore
+):
+    pass
+
+
+class TestActionMatcher(BaseTest):
+    def _action(self, **step) -> Action:
+        action = Action.objects.create(team=self.team, name=str(step))
+        ActionStep.objects.create(action=action, **step)
+        return action
+
+    def _event(self, event: str = "$pageview", **kwargs) -> Event:
+        return Event.objects.create(team=self.team, distinct_id="user", event=event, **kwargs)
+
+    def assertMatchesDatabase(self, actions: List[Action], events: List[Event]) -> None:
+        for event in events:
+            in_database = [
+                action for action in actions if Event.objects.filter(pk=event.pk).query_db_by_action(action).exists()
+            ]
+            self.assertEqual(matching_actions(event), in_database, event.properties)
+
+    def test_property_operators_match_database(self):
+        actions = [
+            self._action(event="$pageview", properties=[{"key": "plan", "value": value, "operator": operator}])
+            for operator, value in [
+                (None, "premium"),
+                ("exact", "5"),
+                ("exact", "true"),
+                ("is_not", "premium"),
+                ("icontains", "PREM"),
+                ("not_icontains", "prem"),
+                ("regex", "^pre"),
+                ("not_regex", "^pre"),
+                ("gt", "5"),
+                ("lt", "5"),
+                ("is_set", "is_set"),
+                ("is_not_set", "is_not_set"),
+            ]
+        ]
+        events = [
+            self._event(properties=properties)
+            for properties in [
+                {"plan": "premium"},
+                {"plan": "free"},
+                {"plan": 5},
+                {"plan": 10},
+                {"plan": "10"},
+                {"plan": True},
+                {"plan": 1},
+                {"plan": None},
+                {"plan": ["premium"]},
+                {},
+            ]
+        ]
+        self.assertMatchesDatabase(actions, events)
+
+    def test_regexes_match_database(self):
+        patterns = [
+            "^pre",
+            "ium$",
+            "pre.ium",
+            "[[:alpha:]]+ium",
+            "[[:digit:]]",
+            r"\mprem",
+            r"\ypremium\y",
+            r"prem\b",
+            r"^[^]a]+$",
+            r"(?=p)premium",
+            r"(?i)PREMIUM",
+            r"\d+",
+        ]
+        actions = [
+            self._action(event="$pageview", properties=[{"key": "plan", "value": pattern, "operator": "regex"}])
+            for pattern in patterns
+        ]
+        events = [
+            self._event(properties={"plan": plan})
+            for plan in ["premium", "premium\n", "pre\nium", "pre:ium", "free plan", "plan 5", "[premium]"]
+        ]
+        self.assertMatchesDatabase(actions, events)
+        self.assertEqual(
+            [all(not step.needs_database for step in CompiledAction(action).steps) for action in actions],
+            [True, True, True, False, False, False, False, False, True, True, False, True],
+        )
+
+    def test_steps_without_event_name(self):
+        any_event = self._action(url="posthog.com", url_matching=ActionStep.CONTAINS)
+        action = Action.objects.create(team=self.team, name="pageview or any pricing event")
+        ActionStep.objects.create(action=action, event="$pageview")
+        ActionStep.objects.create(action=action, url="pricing", url_matching=ActionStep.CONTAINS)
+        events = [
+            self._event(properties={"$current_url": "https://posthog.com/pricing"}),
+            self._event(event="custom", properties={"$current_url": "https://posthog.com/pricing"}),
+            self._event(event="custom", properties={"$current_url": "https://posthog.com/"}),
+            self._event(event="custom"),
+        ]
+        self.assertMatchesDatabase([any_event, action], events)
+        self.assertEqual(events[0].actions, [any_event, action])
+
+    def test_url_matching_matches_database(self):
+        actions = [
+            self._action(event="$pageview", url="https://posthog.com/pricing", url_matching=ActionStep.EXACT),
+            self._action(event="$pageview", url="posthog.com/pr", url_matching=ActionStep.CONTAINS),
+            self._action(event="$pageview", url="posthog_com", url_matching=ActionStep.CONTAINS),
+            self._action(event="$pageview", url=r"^https://\w+\.com/p", url_matching=ActionStep.REGEX),
+        ]
+        events = [
+            self._event(properties={"$current_url": url})
+            for url in ["https://posthog.com/pricing", "https://posthog.com/", "https://example.com/pricing", 5]
+        ] + [self._event()]
+        self.assertMatchesDatabase(actions, events)
+
+    def test_element_filters_match_database(self):
+        actions = [
+            self._action(event="$autocapture", tag_name="button", text="Sign up"),
+            self._action(event="$autocapture", href="/signup"),
+            self._action(event="$autocapture", properties=[{"key": "text", "value": "Sign up", "type": "element"}]),
+        ]
+        events = [
+            self._event(event="$autocapture", elements=elements)
+            for elements in [
+                [Element(tag_name="button", text="Sign up"), Element(tag_name="div")],
+                [Element(tag_name="a", text="Sign up", href="/signup")],
+                [Element(tag_name="button", text="Log in")],
+            ]
+        ] + [self._event(event="$autocapture")]
+        self.assertMatchesDatabase(actions, events)
+
+    def test_person_and_cohort_properties(self):
+        person = Person.objects.create(team=self.team, distinct_ids=["user"], properties={"email": "a@posthog.com"})
+        cohort = Cohort.objects.create(team=self.team, groups=[{"properties": {"email": "a@posthog.com"}}])
+        cohort.calculate_people()
+        by_person = self._action(
+            event="$pageview",
+            properties=[{"key": "email", "value": "posthog.com", "operator": "icontains", "type": "person"}],
+        )
+        by_cohort = self._action(event="$pageview", properties=[{"key": "id", "value": cohort.pk, "type": "cohort"}])
+
+        self.assertEqual(self._event().actions, [by_person, by_cohort])
+        person.properties = {}
+        person.save()
+        self.assertEqual(self._event().actions, [by_cohort])
+        other_event = Event.objects.create(team=self.team, distinct_id="someone else", event="$pageview")
+        self.assertEqual(other_event.actions, [])
+
+    def test_selectors_match_database(self):
+        actions = [
+            self._action(event="$autocapture", selector=selector)
+            for selector in [
+                "button",
+                "div > button",
+                "div button",
+                "section > div > button",
+                "div > div",
+                "div div",
+                "button.btn.primary",
+                "button.secondary",
+                'button[data-attr="signup"]',
+                '[id="form"] > button',
+                "div:nth-child(2) > button",
+                "a",
+            ]
+        ]
+        events = [
+            self._event(event="$autocapture", elements=elements)
+            for elements in [
+                [
+                    Element(tag_name="button", attr_class=["btn", "primary"], attributes={"attr__data-attr": "signup"}),
+                    Element(tag_name="div", attr_id="form", nth_child=2),
+                    Element(tag_name="div"),
+                    Element(tag_name="section"),
+                ],
+                [Element(tag_name="button"), Element(tag_name="span"), Element(tag_name="div")],
+                [Element(tag_name="div"), Element(tag_name="button", attr_class=None)],
+            ]
+        ] + [self._event(event="$autocapture")]
+        self.assertMatchesDatabase(actions, events)
+
+    def test_selectors_are_matched_without_queries(self):
+        action = self._action(event="$autocapture", selector="div > button")
+        elements = [Element(tag_name="button", order=0), Element(tag_name="div", order=1)]
+        event = self._event(event="$autocapture", elements=elements)
+        self.assertEqual(matching_actions(event, elements), [action])
+
+        other_event = self._event(event="$autocapture", elements=[Element(tag_name="button")])
+        with self.assertNumQueries(0):
+            self.assertEqual(matching_actions(event, elements), [action])
+            # The result for these elements is cached
+            self.assertEqual(matching_actions(event, []), [action])
+            self.assertEqual(matching_actions(other_event, [Element(tag_name="button", order=0)]), [])
+
+    def test_matching_does_not_query_once_compiled(self):
+        action = self._action(event="$pageview", url="/pricing", properties=[{"key": "plan", "value": "premium"}])
+        event = self._event(properties={"$current_url": "https://posthog.com/pricing", "plan": "premium"})
+        self.assertEqual(event.actions, [action])
+
+        with self.assertNumQueries(0):
+            self.assertEqual(event.actions, [action])
+            self.assertEqual(matching_actions(event, elements=[]), [action])
+
+    def test_invalidated_when_actions_change(self):
+        action = self._action(event="$pageview")
+        event = self._event()
+        self.assertEqual(event.actions, [action])
+        self.assertIn(self.team.pk, ACTION_MATCHER_CACHE)
+
+        step = action.steps.get()
+        step.event = "$autocapture"
+        step.save()
+        self.assertEqual(event.actions, [])
+
+        other_action = self._action(event="$pageview")
+        self.assertEqual(event.actions, [other_action])
+
+        other_action.deleted = True
+        other_action.save()
+        self.assertEqual(event.actions, [])
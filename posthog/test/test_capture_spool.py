@@ -0,0 +1,208 @@
+import os
+import subprocess
+import tempfile
+from datetime import datetime, timezone
+from io import StringIO
+from typing import List
+from unittest.mock import MagicMock, patch
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase
+
+from posthog import capture_spool
+from posthog.capture_spool import CaptureSpool, send_or_spool
+
+
+def _task(index: int) -> dict:
+    return {"name": "posthog.tasks.process_event.process_event", "queue": "celery", "args": [index]}
+
+
+def _write_leftover_segment(directory: str) -> None:
+    """Writes a segment left open by a process that has exited"""
+    process = subprocess.Popen(["true"])
+    process.wait()
+    with open(os.path.join(directory, "{:020d}-{}.open".format(1, process.pid)), "wb") as segment:
+        segment.write(b'{"name": "task", "queue": "celery", "args": [1]}\n')
+
+
+class TestCaptureSpool(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.spool = CaptureSpool(self.directory, segment_bytes=1024)
+
+    def segments(self):
+        return sorted(os.listdir(self.directory))
+
+    def test_replays_segments_in_order(self):
+        for index in range(100):
+            self.spool.append(_task(index))
+        self.spool.rotate()
+        self.assertGreater(len(self.segments()), 1)
+
+        sent: List[dict] = []
+        self.assertEqual(self.spool.drain(sent.append), 100)
+
+        self.assertEqual(sent, [_task(index) for index in range(100)])
+        self.assertEqual(self.segments(), [])
+
+    def test_open_segment_is_not_replayed(self):
+        self.spool.append(_task(1))
+
+        sent: List[dict] = []
+        self.assertEqual(self.spool.drain(sent.append), 0)
+        self.spool.rotate(min_age_seconds=60)
+        self.assertEqual(self.spool.drain(sent.append), 0)
+        self.spool.rotate()
+        self.assertEqual(self.spool.drain(sent.append), 1)
+
+    def test_failed_replay_puts_the_rest_back(self):
+        for index in range(5):
+            self.spool.append(_task(index))
+        self.spool.rotate()
+
+        sent: List[dict] = []
+
+        def send(task):
+            if task["args"] == [3]:
+                raise ConnectionError()
+            sent.append(task)
+
+        self.assertEqual(self.spool.drain(send), 3)
+        self.assertEqual(len(self.segments()), 1)
+        self.assertTrue(self.segments()[0].endswith(".spool"))
+
+        self.assertEqual(self.spool.drain(sent.append), 2)
+        self.assertEqual(sent, [_task(index) for index in range(5)])
+
+    @patch("posthog.capture_spool.DRAIN_BATCH_SIZE", 2)
+    def test_stops_between_batches_when_told_to(self):
+        for index in range(5):
+            self.spool.append(_task(index))
+        self.spool.rotate()
+
+        sent: List[dict] = []
+        self.assertEqual(self.spool.drain(sent.append, should_continue=lambda: False), 2)
+        self.assertEqual(self.spool.drain(sent.append), 3)
+        self.assertEqual(sent, [_task(index) for index in range(5)])
+
+    def test_recovers_segments_of_exited_processes(self):
+        process = subprocess.Popen(["true"])
+        process.wait()
+        with open(os.path.join(self.directory, "{:020d}-{}.open".format(1, process.pid)), "wb") as segment:
+            segment.write(b'{"args": [1]}\n{"args": [2]}\n{"args"')
+        with open(os.path.join(self.directory, "{:020d}-1.{}.draining".format(2, process.pid)), "wb") as segment:
+            segment.write(b'{"args": [3]}\n')
+
+        sent: List[dict] = []
+        self.assertEqual(self.spool.drain(sent.append), 3)
+        self.assertEqual(sent, [{"args": [1]}, {"args": [2]}, {"args": [3]}])
+        self.assertEqual(self.segments(), [])
+
+    def test_datetimes_are_spooled_as_iso_strings(self):
+        self.spool.append({"args": [datetime(2020, 1, 1, tzinfo=timezone.utc)]})
+        self.spool.rotate()
+
+        sent: List[dict] = []
+        self.spool.drain(sent.append)
+        self.assertEqual(sent, [{"args": ["2020-01-01T00:00:00+00:00"]}])
+
+
+@patch("posthog.capture_spool._broker_unavailable_until", 0.0)
+@patch("posthog.capture_spool._queue_depth_checked_at", float("-inf"))
+class TestSendOrSpool(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.spool = CaptureSpool(self.directory, segment_bytes=1024)
+        # No drainer thread, tests drain explicitly
+        spool_patcher = patch("posthog.capture_spool.get_spool", return_value=self.spool)
+        spool_patcher.start()
+        self.addCleanup(spool_patcher.stop)
+
+    def spooled(self):
+        self.spool.rotate()
+        sent: List[dict] = []
+        self.spool.drain(sent.append)
+        return sent
+
+    @patch("posthog.capture_spool.celery_app.send_task")
+    def test_sends_when_broker_is_healthy(self, patch_send_task: MagicMock):
+        send_or_spool(name="task", queue="celery", args=[1])
+
+        patch_send_task.assert_called_once_with(name="task", queue="celery", args=[1], retry=False)
+        self.assertEqual(self.spooled(), [])
+
+    @patch("posthog.capture_spool.celery_app.send_task", side_effect=ConnectionError())
+    def test_spools_when_broker_fails_and_skips_it_for_a_while(self, patch_send_task: MagicMock):
+        send_or_spool(name="task", queue="celery", args=[1])
+        send_or_spool(name="task", queue="celery", args=[2])
+
+        self.assertEqual(patch_send_task.call_count, 1)
+        self.assertEqual(
+            self.spooled(),
+            [{"name": "task", "queue": "celery", "args": [1]}, {"name": "task", "queue": "celery", "args": [2]}],
+        )
+
+    @patch("posthog.capture_spool.get_redis_queue_depth", return_value=2000000)
+    @patch("posthog.capture_spool.celery_app.send_task")
+    def test_spools_when_queue_is_too_deep(self, patch_send_task: MagicMock, patch_queue_depth: MagicMock):
+        send_or_spool(name="task", queue="celery", args=[1])
+        send_or_spool(name="task", queue="celery", args=[2])
+
+        patch_send_task.assert_not_called()
+        # The queue depth reading is reused
+        self.assertEqual(patch_queue_depth.call_count, 1)
+        self.assertEqual(len(self.spooled()), 2)
+
+    @patch("posthog.capture_spool.celery_app.send_task")
+    def test_drain_once_replays_when_broker_recovers(self, patch_send_task: MagicMock):
+        self.spool.append({"name": "task", "queue": "celery", "args": [1]})
+        self.spool.rotate()
+
+        with patch("posthog.capture_spool._broker_unavailable_until", float("inf")):
+            self.assertEqual(capture_spool.drain_once(self.spool), 0)
+        self.assertEqual(capture_spool.drain_once(self.spool), 1)
+
+        patch_send_task.assert_called_once_with(name="task", queue="celery", args=[1], retry=False)
+
+
+@patch("posthog.capture_spool._broker_unavailable_until", 0.0)
+@patch("posthog.capture_spool._queue_depth_checked_at", float("-inf"))
+@patch("posthog.capture_spool.get_redis_queue_depth", return_value=0)
+@patch("posthog.capture_spool.celery_app.send_task")
+class TestDrainLeftoverSegments(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        _write_leftover_segment(self.directory)
+
+    @patch("posthog.capture_spool._spool_pid", None)
+    @patch("posthog.capture_spool._spool", None)
+    @patch("posthog.capture_spool.threading.Thread")
+    def test_drainer_started_at_startup_replays_them(
+        self, patch_thread: MagicMock, patch_send_task: MagicMock, patch_queue_depth: MagicMock
+    ):
+        with self.settings(CAPTURE_SPOOL_DIR=self.directory):
+            capture_spool.start_drainer()
+
+        # Nothing was spooled by this process, but its drainer runs anyway
+        patch_thread.assert_called_once()
+        self.assertEqual(patch_thread.call_args[1]["target"], capture_spool._drain_forever)
+        spool = patch_thread.call_args[1]["args"][0]
+
+        self.assertEqual(capture_spool.drain_once(spool), 1)
+        patch_send_task.assert_called_once_with(name="task", queue="celery", args=[1], retry=False)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_drain_capture_spool_command(self, patch_send_task: MagicMock, patch_queue_depth: MagicMock):
+        stdout = StringIO()
+        call_command("drain_capture_spool", dir=self.directory, stdout=stdout)
+
+        self.assertEqual(stdout.getvalue(), "Replayed 1 tasks\n")
+        patch_send_task.assert_called_once_with(name="task", queue="celery", args=[1], retry=False)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_drain_capture_spool_command_needs_a_directory(
+        self, patch_send_task: MagicMock, patch_queue_depth: MagicMock
+    ):
+        with self.assertRaises(CommandError):
+            call_command("drain_capture_spool", dir=None)
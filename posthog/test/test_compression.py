@@ -0,0 +1,76 @@
+import gzip
+import json
+
+import brotli
+import lzstring
+import zstandard
+from django.test import SimpleTestCase
+
+from posthog.compression import DecompressionError, decompress_brotli, decompress_gzip, decompress_lz64, decompress_zstd
+
+
+class TestCompression(SimpleTestCase):
+    def test_decompress_lz64(self):
+        for value in [
+            "a",
+            "aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa",
+            json.dumps(
+                [
+                    {"event": "$pageview", "properties": {"$current_url": "https://posthog.com/{}".format(i)}}
+                    for i in range(100)
+                ]
+            ),
+            "unicode: é 中文 😀",
+        ]:
+            compressed = lzstring.LZString().compressToBase64(value)
+            self.assertEqual(decompress_lz64(compressed, 10000), lzstring.LZString().decompressFromBase64(compressed))
+
+    def test_decompress_lz64_invalid(self):
+        with self.assertRaises(DecompressionError):
+            decompress_lz64("not base64!", 10000)
+        with self.assertRaises(DecompressionError):
+            decompress_lz64(lzstring.LZString().compressToBase64("a" * 100), 50)
+
+    def test_decompress_gzip(self):
+        self.assertEqual(decompress_gzip(gzip.compress(b"abc"), 10), b"abc")
+        # Concatenated members, like gzip.decompress
+        self.assertEqual(decompress_gzip(gzip.compress(b"abc") + gzip.compress(b"def"), 10), b"abcdef")
+
+    def test_decompress_gzip_invalid(self):
+        with self.assertRaises(DecompressionError):
+            decompress_gzip(gzip.compress(b"a" * 100), 50)
+        with self.assertRaises(DecompressionError):
+            decompress_gzip(gzip.compress(b"abc")[:-5], 50)
+        with self.assertRaises(DecompressionError):
+            decompress_gzip(b"not gzip", 50)
+
+    def test_decompress_zstd(self):
+        self.assertEqual(decompress_zstd(zstandard.ZstdCompressor().compress(b"abc"), 10), b"abc")
+        # Frames without the content size in their header
+        self.assertEqual(
+            decompress_zstd(zstandard.ZstdCompressor(write_content_size=False).compress(b"abc"), 10), b"abc"
+        )
+
+    def test_decompress_zstd_invalid(self):
+        with self.assertRaises(DecompressionError):
+            decompress_zstd(zstandard.ZstdCompressor().compress(b"a" * 100), 50)
+        with self.assertRaises(DecompressionError):
+            decompress_zstd(zstandard.ZstdCompressor(write_content_size=False).compress(b"a" * 100), 50)
+        with self.assertRaises(DecompressionError):
+            decompress_zstd(zstandard.ZstdCompressor().compress(b"abc" * 100)[:-5], 1000)
+        with self.assertRaises(DecompressionError):
+            decompress_zstd(b"not zstd", 50)
+
+    def test_decompress_brotli(self):
+        self.assertEqual(decompress_brotli(brotli.compress(b"abc"), 10), b"abc")
+        # Fed to the decompressor in chunks
+        data = json.dumps([{"event": "$pageview", "properties": {"i": i}} for i in range(1000)]).encode()
+        self.assertEqual(decompress_brotli(brotli.compress(data), len(data)), data)
+
+    def test_decompress_brotli_invalid(self):
+        with self.assertRaises(DecompressionError):
+            decompress_brotli(brotli.compress(b"a" * 100), 50)
+        with self.assertRaises(DecompressionError):
+            decompress_brotli(brotli.compress(b"abc" * 100)[:-3], 1000)
+        with self.assertRaises(DecompressionError):
+            decompress_brotli(b"not brotli", 50)
@@ -13,5 +13,5 @@ class TestDemo(BaseTest):
         self.assertEqual(Event.objects.count(), 192)
         self.assertEqual(Person.objects.count(), 100)
         self.assertEqual(Action.objects.count(), 4)
-        self.assertEqual(Action.objects.all()[1].events.count(), 9)
+        self.assertEqual(Action.objects.get(name="HogFlix signed up").events.count(), 9)
         self.assertIn("$pageview", demo_team.event_names)
@@ -1,6 +1,8 @@
 from unittest.mock import call, patch
 
-from posthog.api.test.base import BaseTest
+from django.db import transaction
+
+from posthog.api.test.base import BaseTest, TransactionBaseTest
 from posthog.models import Action, ActionStep, Element, ElementGroup, Event, Person, Team
 from posthog.models.event import Selector, SelectorPart
 
@@ -399,6 +401,75 @@ class TestElementGroup(BaseTest):
         self.assertEqual(group3, group3_duplicate)
         self.assertEqual(ElementGroup.objects.count(), 2)
 
+    def test_get_or_create_hashes(self):
+        existing = ElementGroup.objects.create(team=self.team, elements=[Element(tag_name="button", text="Sign up!")])
+
+        hashes = ElementGroup.objects.get_or_create_hashes(
+            team=self.team,
+            elements_lists=[
+                [Element(tag_name="button", text="Sign up!")],
+                None,
+                [Element(tag_name="a", href="/movie"), Element(tag_name="div")],
+                [Element(tag_name="a", href="/movie"), Element(tag_name="div")],
+            ],
+        )
+
+        self.assertEqual(hashes[0], existing.hash)
+        self.assertIsNone(hashes[1])
+        self.assertEqual(hashes[2], hashes[3])
+        self.assertEqual(ElementGroup.objects.count(), 2)
+        new_group = ElementGroup.objects.get(hash=hashes[2])
+        self.assertEqual(
+            [element.tag_name for element in new_group.element_set.order_by("order")], ["a", "div"],
+        )
+
+    def test_hash_is_stable(self) -> None:
+        # Events reference groups by hash, so the hash of the same elements must never change
+        elements = [
+            Element(
+                tag_name="a",
+                href="/movie",
+                text="Watch",
+                attr_class=["btn", "primary"],
+                nth_child=1,
+                nth_of_type=2,
+                attributes={"attr__z": "1", "attr__a": "x"},
+            ),
+            Element(tag_name="div", attr_id="main"),
+        ]
+        self.assertEqual(
+            ElementGroup.objects.create(team=self.team, elements=elements).hash, "4edd9a7835f469d9d1982f46185b8b10"
+        )
+
+
+class TestElementGroupCache(TransactionBaseTest):
+    def test_seen_groups_are_not_queried(self) -> None:
+        group = ElementGroup.objects.create(team=self.team, elements=[Element(tag_name="button", text="Sign up!")])
+        other_team = Team.objects.create()
+
+        with self.assertNumQueries(0):
+            cached_group = ElementGroup.objects.create(
+                team=self.team, elements=[Element(tag_name="button", text="Sign up!")]
+            )
+            hashes = ElementGroup.objects.get_or_create_hashes(
+                team=self.team, elements_lists=[[Element(tag_name="button", text="Sign up!")]]
+            )
+        self.assertEqual((cached_group.pk, cached_group.hash), (group.pk, group.hash))
+        self.assertEqual(hashes, [group.hash])
+
+        other_group = ElementGroup.objects.create(
+            team=other_team, elements=[Element(tag_name="button", text="Sign up!")]
+        )
+        self.assertNotEqual(other_group.pk, group.pk)
+
+    def test_rolled_back_groups_are_not_cached(self) -> None:
+        with self.assertRaises(ValueError), transaction.atomic():
+            ElementGroup.objects.create(team=self.team, elements=[Element(tag_name="button")])
+            raise ValueError
+
+        group = ElementGroup.objects.create(team=self.team, elements=[Element(tag_name="button")])
+        self.assertEqual(ElementGroup.objects.get().pk, group.pk)
+
 
 class TestActions(BaseTest):
     def _signup_event(self, distinct_id: str):
@@ -498,7 +569,7 @@ class TestPreCalculation(BaseTest):
         action = Action.objects.create(team=self.team, name="combined action")
         step1 = ActionStep.objects.create(action=action, event="user signed up")
         step2 = ActionStep.objects.create(action=action, event="user logged in")
-        with self.assertNumQueries(6):
+        with self.assertNumQueries(7):
             action.calculate_events()
         self.assertEqual(
             [e for e in action.events.all().order_by("id")], [user_signed_up, user_logged_in],
@@ -507,7 +578,7 @@ class TestPreCalculation(BaseTest):
         # update actionstep
         step2.event = "user logged out"
         step2.save()
-        with self.assertNumQueries(6):
+        with self.assertNumQueries(7):
             action.calculate_events()
         self.assertEqual(
             [e for e in action.events.all().order_by("id")], [user_signed_up, user_logged_out],
@@ -657,3 +728,20 @@ class TestSelectors(BaseTest):
         self.assertEqual(selector1.parts[1].data, {"tag_name": "div"})
         self.assertEqual(selector1.parts[1].direct_descendant, False)
         self.assertEqual(selector1.parts[1].unique_order, 1)
+
+    def test_matches(self):
+        elements = [
+            Element(tag_name="a", attr_class=["btn", "primary"], nth_child=1, order=0),
+            Element(tag_name="div", attributes={"attr__data-id": "5"}, order=1),
+            Element(tag_name="div", attr_id="main", order=2),
+        ]
+        self.assertTrue(Selector("div > a").matches(elements))
+        self.assertTrue(Selector("div a.btn:nth-child(1)").matches(elements))
+        self.assertTrue(Selector('[id="main"] > div[data-id="5"] > a').matches(elements))
+        self.assertTrue(Selector("div > div").matches(elements))
+        self.assertFalse(Selector("a > div").matches(elements))
+        self.assertTrue(Selector("div > div > a").matches(elements))
+        self.assertFalse(Selector("div > div > div").matches(elements))
+        self.assertFalse(Selector("a.secondary").matches(elements))
+        self.assertFalse(Selector("a:nth-child(2)").matches(elements))
+        self.assertFalse(Selector("span").matches(elements))
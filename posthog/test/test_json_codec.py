@@ -0,0 +1,71 @@
+import datetime
+import json
+import math
+from decimal import Decimal
+from unittest.mock import patch
+from uuid import UUID
+
+import pytz
+from django.test import SimpleTestCase
+from rest_framework.renderers import JSONRenderer
+
+from posthog import json_codec
+from posthog.api.base import FastJSONRenderer
+
+
+class TestJSONCodec(SimpleTestCase):
+    values = [
+        {"event": "$pageview", "properties": {"$current_url": "https://posthog.com", "nested": [1, 2.5, None, True]}},
+        {"unicode": "é 中文 😀", "empty": {}},
+        [1, "two", {"three": 3}],
+        "string",
+        2 ** 70,
+    ]
+
+    def test_round_trip(self):
+        for value in self.values:
+            self.assertEqual(json_codec.loads(json_codec.dumps(value)), value)
+            self.assertEqual(json_codec.loads(json_codec.dumps_bytes(value)), value)
+            self.assertEqual(json.loads(json_codec.dumps(value)), value)
+
+    def test_stdlib_fallback(self):
+        with patch("posthog.json_codec.orjson", None):
+            for value in self.values:
+                self.assertEqual(json_codec.loads(json_codec.dumps(value)), value)
+
+    def test_loads_accepts_what_stdlib_accepts(self):
+        self.assertTrue(math.isnan(json_codec.loads('{"a": NaN}')["a"]))
+        self.assertEqual(json_codec.loads(b'["\\ud800"]'), ["\ud800"])
+
+    def test_loads_invalid(self):
+        with self.assertRaises(json_codec.JSONDecodeError):
+            json_codec.loads("not json")
+
+    def test_non_finite_floats(self):
+        value = {"nan": float("nan"), "infinity": float("inf"), "negative_infinity": float("-inf")}
+        self.assertEqual(json_codec.dumps(value), '{"nan":null,"infinity":null,"negative_infinity":null}')
+        with patch("posthog.json_codec.orjson", None):
+            self.assertEqual(json_codec.dumps(value), '{"nan":NaN,"infinity":Infinity,"negative_infinity":-Infinity}')
+
+    def test_non_string_keys(self):
+        self.assertEqual(json_codec.loads(json_codec.dumps({1: "a"})), {"1": "a"})
+
+
+class TestFastJSONRenderer(SimpleTestCase):
+    def test_matches_drf_renderer(self):
+        data = {
+            "id": UUID("0176ee0b-7f6a-0000-4c0b-a4b1a8f2c5a1"),
+            "created_at": datetime.datetime(2020, 1, 1, 12, 0, 0, 123456, tzinfo=pytz.UTC),
+            "day": datetime.date(2020, 1, 1),
+            "amount": Decimal("1.50"),
+            "name": "line\u2028separator é",
+            "results": [{"count": 1, "breakdown": None}],
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_indent_uses_drf_renderer(self):
+        data = {"a": [1, 2]}
+        self.assertEqual(
+            FastJSONRenderer().render(data, "application/json; indent=4"),
+            JSONRenderer().render(data, "application/json; indent=4"),
+        )
@@ -0,0 +1,82 @@
+from unittest.mock import MagicMock, patch
+
+from django.test import SimpleTestCase
+from freezegun import freeze_time
+
+from posthog.local_cache import CacheInvalidationListener, LocalCache
+
+
+class TestLocalCache(SimpleTestCase):
+    def test_get_and_set(self) -> None:
+        cache: LocalCache[str, int] = LocalCache(max_size=10)
+        cache.set("a", 1)
+        cache.set_many({"b": 2, "c": 3})
+
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("d"))
+        self.assertEqual(cache.get_many(["a", "c", "d"]), {"a": 1, "c": 3})
+
+    def test_none_values_are_cached(self) -> None:
+        cache: LocalCache[str, None] = LocalCache(max_size=10)
+        cache.set("a", None)
+
+        self.assertEqual(cache.get_many(["a", "b"]), {"a": None})
+
+    def test_entries_expire(self) -> None:
+        cache: LocalCache[str, int] = LocalCache(max_size=10, ttl_seconds=60)
+        with freeze_time("2020-01-01T12:00:00Z") as frozen_time:
+            cache.set("a", 1)
+            frozen_time.tick(delta=59)
+            self.assertEqual(cache.get("a"), 1)
+            frozen_time.tick(delta=2)
+            self.assertIsNone(cache.get("a"))
+
+    def test_least_recently_used_entry_is_evicted(self) -> None:
+        cache: LocalCache[str, int] = LocalCache(max_size=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        self.assertEqual(cache.get_many(["a", "b", "c"]), {"a": 1, "c": 3})
+
+    def test_delete(self) -> None:
+        cache: LocalCache[str, int] = LocalCache(max_size=10)
+        cache.set_many({"a": 1, "b": 2, "c": 3})
+        cache.delete(["a"])
+        cache.delete_where(lambda key, value: value == 2)
+
+        self.assertEqual(cache.get_many(["a", "b", "c"]), {"c": 3})
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+
+class TestCacheInvalidationListener(SimpleTestCase):
+    @patch("posthog.local_cache.threading.Thread")
+    def test_started_once_per_process(self, thread: MagicMock) -> None:
+        listener = CacheInvalidationListener("channel", "listener", invalidate=MagicMock(), on_subscribe=MagicMock())
+        with self.settings(TEST=False), patch("posthog.local_cache.os.getpid", return_value=1):
+            listener.start()
+            listener.start()
+        self.assertEqual(thread.call_count, 1)
+
+        # A forked process starts its own
+        with self.settings(TEST=False), patch("posthog.local_cache.os.getpid", return_value=2):
+            listener.start()
+        self.assertEqual(thread.call_count, 2)
+
+    @patch("posthog.local_cache.get_client")
+    def test_passes_messages_to_invalidate(self, get_client: MagicMock) -> None:
+        invalidate = MagicMock(side_effect=[None, KeyboardInterrupt])
+        on_subscribe = MagicMock()
+        pubsub = get_client.return_value.pubsub.return_value
+        pubsub.listen.return_value = [{"data": b"1"}, {"data": b"2"}]
+        listener = CacheInvalidationListener("channel", "listener", invalidate=invalidate, on_subscribe=on_subscribe)
+
+        # KeyboardInterrupt isn't caught, so it ends the listening loop
+        with self.assertRaises(KeyboardInterrupt):
+            listener._listen()
+
+        pubsub.subscribe.assert_called_once_with("channel")
+        on_subscribe.assert_called_once_with()
+        self.assertEqual([call[0][0] for call in invalidate.call_args_list], ["1", "2"])
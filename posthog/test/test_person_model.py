@@ -1,9 +1,14 @@
 import datetime
+from unittest.mock import patch
 
 import pytz
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
 
-from posthog.api.test.base import BaseTest
-from posthog.models import Action, ActionStep, Cohort, Event, Person
+from posthog.api.test.base import BaseTest, TransactionBaseTest
+from posthog.models import Action, ActionStep, Cohort, Event, Person, PersonDistinctId
+from posthog.models.person import PERSON_ID_CACHE
+from posthog.redis import get_client
 
 
 class TestPerson(BaseTest):
@@ -45,8 +50,140 @@ class TestPerson(BaseTest):
             person0.created_at, datetime.datetime(2019, 7, 1, tzinfo=pytz.UTC),
         )  # oldest created_at is kept
 
+    def test_merge_people_query_count_does_not_depend_on_size(self):
+        def merge_queries(distinct_id_count: int) -> int:
+            person = Person.objects.create(team=self.team)
+            other = Person.objects.create(
+                team=self.team, distinct_ids=[str(index) for index in range(distinct_id_count)]
+            )
+            with CaptureQueriesContext(connection) as queries:
+                person.merge_people([other])
+            self.assertEqual(len(person.distinct_ids), distinct_id_count)
+            Person.objects.all().delete()
+            return len(queries)
+
+        self.assertEqual(merge_queries(2), merge_queries(50))
+
+    def test_update_properties(self):
+        person = Person.objects.create(team=self.team, properties={"email": "old@posthog.com", "plan": "free"})
+
+        self.assertTrue(Person.objects.update_properties(person.pk, {"email": "new@posthog.com", "name": "Someone"}))
+
+        person.refresh_from_db()
+        self.assertEqual(person.properties, {"email": "new@posthog.com", "plan": "free", "name": "Someone"})
+        self.assertFalse(person.is_identified)
+
+        self.assertTrue(Person.objects.update_properties(person.pk, {}, is_identified=True))
+        person.refresh_from_db()
+        self.assertTrue(person.is_identified)
+
+    def test_update_properties_without_changes(self):
+        person = Person.objects.create(team=self.team, properties={"email": "someone@posthog.com"}, is_identified=True)
+
+        # The UPDATE matches no rows, so it's only followed by a check that the person exists
+        with self.assertNumQueries(2):
+            self.assertTrue(
+                Person.objects.update_properties(person.pk, {"email": "someone@posthog.com"}, is_identified=True)
+            )
+        self.assertFalse(Person.objects.update_properties(person.pk + 1, {"email": "someone@posthog.com"}))
+
+    def test_update_properties_narrowing_values(self):
+        person = Person.objects.create(
+            team=self.team, properties={"tags": ["a", "b"], "address": {"city": "London", "zip": "N1"}}
+        )
+
+        self.assertTrue(Person.objects.update_properties(person.pk, {"tags": ["a"], "address": {"city": "London"}}))
+
+        person.refresh_from_db()
+        self.assertEqual(person.properties, {"tags": ["a"], "address": {"city": "London"}})
+
+        Person.objects.update_properties(person.pk, {"missing": None})
+        person.refresh_from_db()
+        self.assertEqual(person.properties["missing"], None)
+
     def test_person_is_identified(self):
         person_identified = Person.objects.create(team=self.team, is_identified=True)
         person_anonymous = Person.objects.create(team=self.team)
         self.assertEqual(person_identified.is_identified, True)
         self.assertEqual(person_anonymous.is_identified, False)
+
+
+class TestPersonIdCache(BaseTest):
+    def setUp(self):
+        super().setUp()
+        PERSON_ID_CACHE.clear()
+
+    def test_get_person_ids(self):
+        person = Person.objects.create(distinct_ids=["1", "2"], team=self.team)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                Person.objects.get_person_ids(self.team.pk, ["1", "2", "3"]),
+                {"1": person.pk, "2": person.pk, "3": None},
+            )
+        with self.assertNumQueries(0):
+            self.assertEqual(Person.objects.get_person_id(self.team.pk, "1"), person.pk)
+            self.assertIsNone(Person.objects.get_person_id(self.team.pk, "3"))
+
+        # Other processes are served from Redis
+        PERSON_ID_CACHE.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(Person.objects.get_person_id(self.team.pk, "2"), person.pk)
+
+    def test_get_or_create_person_id(self):
+        self.assertIsNone(Person.objects.get_person_id(self.team.pk, "1"))
+
+        person_id, created = Person.objects.get_or_create_person_id(self.team.pk, "1")
+        self.assertTrue(created)
+        self.assertEqual(Person.objects.get(persondistinctid__distinct_id="1").pk, person_id)
+        with self.assertNumQueries(0):
+            self.assertEqual(Person.objects.get_or_create_person_id(self.team.pk, "1"), (person_id, False))
+
+    def test_get_or_create_person_id_with_stale_cache(self):
+        self.assertIsNone(Person.objects.get_person_id(self.team.pk, "1"))
+        # Created without going through the ORM, so the cached None isn't invalidated
+        person = Person.objects.create(team=self.team)
+        PersonDistinctId.objects.bulk_create([PersonDistinctId(person=person, team=self.team, distinct_id="1")])
+
+        self.assertEqual(Person.objects.get_or_create_person_id(self.team.pk, "1"), (person.pk, False))
+
+
+# Invalidation happens on commit, which test cases wrapped in a transaction never get to
+class TestPersonIdCacheInvalidation(TransactionBaseTest):
+    def setUp(self):
+        super().setUp()
+        PERSON_ID_CACHE.clear()
+
+    def test_cache_invalidated_on_merge(self):
+        person1 = Person.objects.create(distinct_ids=["1"], team=self.team)
+        person2 = Person.objects.create(distinct_ids=["2", "3"], team=self.team)
+        Person.objects.get_person_ids(self.team.pk, ["1", "2", "3"])
+
+        with patch.object(get_client(), "hdel", wraps=get_client().hdel) as patch_hdel:
+            person1.merge_people([person2])
+
+        patch_hdel.assert_called_once_with("person_ids:{}".format(self.team.pk), "2", "3")
+        self.assertEqual(Person.objects.get_person_ids(self.team.pk, ["2", "3"]), {"2": person1.pk, "3": person1.pk})
+
+    def test_cache_invalidated_after_commit(self):
+        person = Person.objects.create(distinct_ids=["1"], team=self.team)
+        other_person = Person.objects.create(team=self.team)
+        Person.objects.get_person_id(self.team.pk, "1")
+
+        with transaction.atomic():
+            PersonDistinctId.objects.filter(distinct_id="1").update(person=other_person)
+            with patch.object(get_client(), "hdel") as patch_hdel:
+                PersonDistinctId.objects.get(distinct_id="1").save()
+            patch_hdel.assert_not_called()
+            # A concurrent reader still sees the old person and caches it again
+            get_client().hset("person_ids:{}".format(self.team.pk), "1", person.pk)
+
+        self.assertEqual(Person.objects.get_person_id(self.team.pk, "1"), other_person.pk)
+
+    def test_cache_invalidated_on_delete(self):
+        person = Person.objects.create(distinct_ids=["1"], team=self.team)
+        Person.objects.get_person_id(self.team.pk, "1")
+
+        person.delete()
+
+        self.assertIsNone(Person.objects.get_person_id(self.team.pk, "1"))
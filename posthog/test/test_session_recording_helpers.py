@@ -0,0 +1,63 @@
+import random
+from unittest.mock import patch
+
+from django.test import SimpleTestCase
+
+from posthog.helpers.session_recording import compress_and_chunk_snapshots, decompress_chunked_snapshot_data
+
+
+def _snapshot_event(snapshot_data):
+    return {
+        "event": "$snapshot",
+        "properties": {"$session_id": "abc", "$snapshot_data": snapshot_data},
+        "timestamp": "2020-11-24T13:43:07.123Z",
+    }
+
+
+class TestSessionRecordingHelpers(SimpleTestCase):
+    full_snapshot = {
+        "type": 2,
+        "data": {"node": {"childNodes": [{"tagName": "div", "id": index} for index in range(500)]}},
+        "timestamp": 1_600_000_000,
+    }
+    # Random data doesn't compress, so this ends up in several chunks
+    random_snapshot = {"type": 3, "data": "".join(random.choice("abcdef0123456789") for _ in range(5000))}
+
+    def test_small_snapshots_stay_as_they_are(self):
+        events = [("user", _snapshot_event({"type": 3, "timestamp": 1_600_000_001}))]
+        self.assertEqual(compress_and_chunk_snapshots(events), events)
+
+    def test_compress_and_chunk_round_trip(self):
+        events = compress_and_chunk_snapshots(
+            [
+                ("user", _snapshot_event(self.full_snapshot)),
+                ("user", _snapshot_event(self.random_snapshot)),
+                ("user", _snapshot_event({"type": 3})),
+            ],
+            chunk_size=1000,
+        )
+
+        self.assertGreater(len(events), 3)
+        for distinct_id, event in events:
+            self.assertEqual(distinct_id, "user")
+            self.assertEqual(event["timestamp"], "2020-11-24T13:43:07.123Z")
+            self.assertEqual(event["properties"]["$session_id"], "abc")
+        snapshot_data = [event["properties"]["$snapshot_data"] for _, event in events]
+        self.assertLess(len(snapshot_data[0]["data"]), 1000)
+
+        random.shuffle(snapshot_data)
+        self.assertCountEqual(
+            decompress_chunked_snapshot_data(snapshot_data), [self.full_snapshot, self.random_snapshot, {"type": 3}]
+        )
+
+    def test_incomplete_snapshots_are_skipped(self):
+        events = compress_and_chunk_snapshots([("user", _snapshot_event(self.random_snapshot))], chunk_size=1000)
+        snapshot_data = [event["properties"]["$snapshot_data"] for _, event in events][1:]
+        self.assertEqual(decompress_chunked_snapshot_data(snapshot_data), [])
+
+    @patch("posthog.helpers.session_recording.zstandard", None)
+    def test_gzip_without_zstd(self):
+        events = compress_and_chunk_snapshots([("user", _snapshot_event(self.full_snapshot))])
+        snapshot_data = [event["properties"]["$snapshot_data"] for _, event in events]
+        self.assertEqual(snapshot_data[0]["compression"], "gzip-base64")
+        self.assertEqual(decompress_chunked_snapshot_data(snapshot_data), [self.full_snapshot])
@@ -0,0 +1,108 @@
+from unittest.mock import patch
+
+from django.db import transaction
+from freezegun import freeze_time
+
+from posthog.api.test.base import BaseTest, TransactionBaseTest
+from posthog.models import Team
+from posthog.models.team import TEAM_CACHE, _cache_team, _team_cache_invalidation
+
+
+class TestTeamCache(BaseTest):
+    def setUp(self):
+        super().setUp()
+        TEAM_CACHE.clear()
+
+    def test_get_team_from_token_is_cached(self):
+        with self.assertNumQueries(1):
+            team = Team.objects.get_team_from_token(self.team.api_token)
+        with self.assertNumQueries(0):
+            self.assertEqual(Team.objects.get_team_from_token(self.team.api_token), team)
+            self.assertEqual(Team.objects.get_cached(self.team.pk), team)
+
+    def test_get_cached(self):
+        with self.assertNumQueries(1):
+            team = Team.objects.get_cached(self.team.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(Team.objects.get_cached(self.team.pk), team)
+
+    def test_each_caller_gets_its_own_copy(self):
+        team = Team.objects.get_cached(self.team.pk)
+        assert team is not None
+        team.anonymize_ips = True
+
+        cached_team = Team.objects.get_cached(self.team.pk)
+        assert cached_team is not None
+        self.assertIsNot(cached_team, team)
+        self.assertFalse(cached_team.anonymize_ips)
+
+    def test_unknown_token_is_not_cached(self):
+        self.assertIsNone(Team.objects.get_team_from_token("unknown"))
+        with self.assertNumQueries(1):
+            self.assertIsNone(Team.objects.get_team_from_token("unknown"))
+
+    def test_cache_invalidated_on_save(self):
+        Team.objects.get_team_from_token(self.team.api_token)
+
+        self.team.anonymize_ips = True
+        self.team.save()
+
+        with self.assertNumQueries(1):
+            team = Team.objects.get_team_from_token(self.team.api_token)
+        assert team is not None
+        self.assertTrue(team.anonymize_ips)
+
+    def test_cache_invalidated_on_token_change(self):
+        old_token = self.team.api_token
+        Team.objects.get_team_from_token(old_token)
+
+        self.team.api_token = "new-token"
+        self.team.save()
+
+        self.assertIsNone(Team.objects.get_team_from_token(old_token))
+        self.assertEqual(Team.objects.get_team_from_token("new-token"), self.team)
+
+    def test_cache_expires(self):
+        with freeze_time("2020-01-01T12:00:00Z") as frozen_time:
+            Team.objects.get_cached(self.team.pk)
+            frozen_time.tick(delta=59)
+            with self.assertNumQueries(0):
+                Team.objects.get_cached(self.team.pk)
+            frozen_time.tick(delta=2)
+            with self.assertNumQueries(1):
+                Team.objects.get_cached(self.team.pk)
+
+    @patch.object(TEAM_CACHE, "max_size", 3)
+    def test_least_recently_used_team_is_evicted(self):
+        team2 = Team.objects.create(organization=self.organization)
+        team3 = Team.objects.create(organization=self.organization)
+        Team.objects.get_cached(self.team.pk)
+        Team.objects.get_cached(team2.pk)
+        Team.objects.get_cached(self.team.pk)
+        Team.objects.get_cached(team3.pk)
+
+        with self.assertNumQueries(0):
+            Team.objects.get_cached(self.team.pk)
+        with self.assertNumQueries(1):
+            Team.objects.get_cached(team2.pk)
+
+
+class TestTeamCacheInvalidation(TransactionBaseTest):
+    def setUp(self):
+        super().setUp()
+        TEAM_CACHE.clear()
+
+    @patch.object(_team_cache_invalidation, "publish")
+    def test_cache_invalidated_after_commit(self, publish):
+        with transaction.atomic():
+            Team.objects.get_cached(self.team.pk)
+            self.team.anonymize_ips = True
+            self.team.save()
+            # Another worker can still read the old row before the commit
+            _cache_team(Team(pk=self.team.pk, api_token=self.team.api_token, anonymize_ips=False))
+            publish.assert_not_called()
+
+        publish.assert_called_once_with(self.team.pk)
+        team = Team.objects.get_cached(self.team.pk)
+        assert team is not None
+        self.assertTrue(team.anonymize_ips)
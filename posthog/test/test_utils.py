@@ -1,9 +1,10 @@
+from dateutil import parser
 from django.test import TestCase
 from freezegun import freeze_time
 
 from posthog.api.test.base import BaseTest
 from posthog.models import Event
-from posthog.utils import relative_date_parse
+from posthog.utils import parse_iso_datetime, relative_date_parse
 
 
 class TestRelativeDateParse(TestCase):
@@ -41,3 +42,28 @@ class TestRelativeDateParse(TestCase):
     @freeze_time("2020-01-31")
     def test_normal_date(self):
         self.assertEqual(relative_date_parse("2019-12-31").strftime("%Y-%m-%d"), "2019-12-31")
+
+
+class TestParseISODatetime(TestCase):
+    def test_matches_isoparse(self):
+        for value in [
+            "2020-11-24T13:43:07.123Z",
+            "2020-11-24T13:43:07Z",
+            "2020-11-24T13:43:07.123456+00:00",
+            "2020-11-24T13:43:07.123-05:30",
+            "2020-11-24T13:43:07",
+            "2020-11-24",
+            # formats datetime.fromisoformat doesn't handle
+            "2020-11-24T13:43:07.1Z",
+            "2020-11-24T13:43:07.12345Z",
+            "20201124T134307Z",
+            "2020-11-24T13:43:07+0100",
+        ]:
+            parsed = parse_iso_datetime(value)
+            expected = parser.isoparse(value)
+            self.assertEqual(parsed, expected, value)
+            self.assertEqual(parsed.utcoffset(), expected.utcoffset(), value)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            parse_iso_datetime("not a timestamp")
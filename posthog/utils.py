@@ -1,6 +1,5 @@
 import base64
 import datetime
-import gzip
 import hashlib
 import json
 import os
@@ -11,7 +10,6 @@ import uuid
 from typing import Any, Dict, List, Mapping, Optional, Tuple, Union
 from urllib.parse import urljoin, urlparse
 
-import lzstring
 import pytz
 from dateutil import parser
 from dateutil.relativedelta import relativedelta
@@ -23,6 +21,8 @@ from django.utils import timezone
 from rest_framework.exceptions import APIException
 from sentry_sdk import capture_exception, push_scope
 
+from posthog import json_codec
+from posthog.compression import DecompressionError, decompress_brotli, decompress_gzip, decompress_lz64, decompress_zstd
 from posthog.redis import get_client
 
 
@@ -62,6 +62,23 @@ def exception_reporting(exception: BaseException, context: Dict) -> None:
         capture_exception(exception)
 
 
+def parse_iso_datetime(input: str) -> datetime.datetime:
+    """
+    Same as dateutil's isoparse, but several times faster for the formats clients actually send, e.g.
+    "2020-11-24T13:43:07.123Z" or the output of datetime.isoformat(). Anything else goes through isoparse.
+    """
+    try:
+        if input.endswith("Z"):
+            parsed = datetime.datetime.fromisoformat(input[:-1])
+            if parsed.tzinfo is None:
+                return parsed.replace(tzinfo=datetime.timezone.utc)
+        else:
+            return datetime.datetime.fromisoformat(input)
+    except ValueError:
+        pass
+    return parser.isoparse(input)
+
+
 def relative_date_parse(input: str) -> datetime.datetime:
     try:
         return datetime.datetime.strptime(input, "%Y-%m-%d").replace(tzinfo=pytz.UTC)
@@ -304,6 +321,10 @@ def base64_to_json(data) -> Dict:
     )
 
 
+class RequestParsingError(Exception):
+    pass
+
+
 # Used by non-DRF endpoins from capture.py and decide.py (/decide, /batch, /capture, etc)
 def load_data_from_request(request):
     data_res: Dict[str, Any] = {"data": {}, "body": None}
@@ -330,20 +351,27 @@ def load_data_from_request(request):
     )
     compression = compression.lower()
 
-    if compression == "gzip":
-        data = gzip.decompress(data)
-
-    if compression == "lz64":
-        if isinstance(data, str):
-            data = lzstring.LZString().decompressFromBase64(data.replace(" ", "+"))
-        else:
-            data = lzstring.LZString().decompressFromBase64(data.decode().replace(" ", "+"))
-        data = data.encode("utf-16", "surrogatepass").decode("utf-16")
+    try:
+        if compression == "gzip":
+            data = decompress_gzip(data, settings.MAX_DECOMPRESSED_REQUEST_SIZE)
+        elif compression == "zstd":
+            data = decompress_zstd(data, settings.MAX_DECOMPRESSED_REQUEST_SIZE)
+        elif compression == "br":
+            data = decompress_brotli(data, settings.MAX_DECOMPRESSED_REQUEST_SIZE)
+        elif compression == "lz64":
+            if not isinstance(data, str):
+                data = data.decode()
+            data = decompress_lz64(data.replace(" ", "+"), settings.MAX_DECOMPRESSED_REQUEST_SIZE)
+            if data is None:
+                raise DecompressionError("Invalid lz64 data")
+            data = data.encode("utf-16", "surrogatepass").decode("utf-16")
+    except DecompressionError as e:
+        raise RequestParsingError("Invalid {} request data: {}".format(compression, e))
 
     #  Is it plain json?
     try:
-        data = json.loads(data)
-    except json.JSONDecodeError:
+        data = json_codec.loads(data)
+    except json_codec.JSONDecodeError:
         # if not, it's probably base64 encoded from other libraries
         data = base64_to_json(data)
     data_res["data"] = data
@@ -9,8 +9,15 @@ https://docs.djangoproject.com/en/2.2/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "posthog.settings")
 
 application = get_wsgi_application()
+
+# Not in AppConfig.ready, which management commands run too, where the drainer would race drain_capture_spool
+if settings.CAPTURE_SPOOL_DIR:
+    from posthog.capture_spool import start_drainer
+
+    start_drainer()